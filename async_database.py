@@ -0,0 +1,293 @@
+# async_database.py
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiosqlite
+import config
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabase:
+    """🎯 АСИНХРОННЫЙ СЛОЙ НАД Database ДЛЯ ОБРАБОТЧИКОВ БОТА
+
+    Именованные методы выполняются в отдельном потоке БД и не блокируют
+    event loop, произвольные SELECT идут через aiosqlite, а изменяющие
+    запросы - через поток записи Database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # Общая с Database политика: счетчики блокировок считаются вместе
+        self.retry_policy = db.retry_policy
+        self.conn = None
+        # Database потокобезопасна (пул чтения + поток записи), поэтому
+        # запросы разных чатов выполняются параллельно
+        self._executor = ThreadPoolExecutor(max_workers=config.READ_POOL_SIZE, thread_name_prefix="db")
+
+    async def _run(self, method, *args, **kwargs):
+        """Выполняет синхронный метод Database вне event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+
+    async def connect(self):
+        """Открывает aiosqlite соединение (лениво, при первом запросе)"""
+        if self.conn is None:
+            self.conn = await aiosqlite.connect(self.db.db_path, timeout=self.retry_policy.busy_timeout, uri=self.db.db_path.startswith('file:'))
+            self.conn.row_factory = sqlite3.Row
+            await self.conn.execute('PRAGMA query_only=ON')
+            logger.info("✅ Асинхронное подключение к SQLite открыто")
+        return self.conn
+
+    async def close(self):
+        """Закрывает aiosqlite соединение и поток БД"""
+        if self.conn is not None:
+            try:
+                await self.conn.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка закрытия асинхронного соединения: {e}")
+            self.conn = None
+        self._executor.shutdown(wait=False)
+
+    async def _execute_with_retry(self, query, params=()):
+        """Выполняет запрос с неблокирующими повторными попытками при блокировке"""
+        for attempt in range(self.retry_policy.max_retries):
+            try:
+                conn = await self.connect()
+                cursor = await conn.execute(query, params)
+                self.db.supervisor.record_success()
+                return cursor
+            except sqlite3.OperationalError as e:
+                self.db.supervisor.record_failure(e)
+                if self.retry_policy.is_locked(e) and await self.retry_policy.retry_async(attempt):
+                    logger.warning(f"⚠️ База заблокирована, повторная попытка {attempt + 1}")
+                    continue
+                raise
+            except sqlite3.DatabaseError as e:
+                self.db.supervisor.record_failure(e)
+                logger.error(f"❌ Ошибка базы данных, переподключаемся: {e}")
+                await self.reset()
+                if attempt < self.retry_policy.max_retries - 1:
+                    await self.retry_policy.async_backoff(attempt)
+                    continue
+                raise
+
+    async def reset(self):
+        """Сбрасывает aiosqlite соединение (после восстановления БД)"""
+        if self.conn is not None:
+            try:
+                await self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    async def fetchone(self, query, params=()):
+        """Возвращает одну строку результата"""
+        started = time.monotonic()
+        cursor = await self._execute_with_retry(query, params)
+        try:
+            row = await cursor.fetchone()
+        finally:
+            await cursor.close()
+        self.db.query_stats.record(query, (time.monotonic() - started) * 1000, int(row is not None))
+        return row
+
+    async def fetchall(self, query, params=()):
+        """Возвращает все строки результата"""
+        started = time.monotonic()
+        cursor = await self._execute_with_retry(query, params)
+        try:
+            rows = await cursor.fetchall()
+        finally:
+            await cursor.close()
+        self.db.query_stats.record(query, (time.monotonic() - started) * 1000, len(rows))
+        return rows
+
+    async def execute(self, query, params=()):
+        """Выполняет изменяющий запрос через поток записи, возвращает rowcount"""
+        # submit_write может восстанавливать соединения - тоже вне event loop
+        future = await self._run(self.db.submit_write, query, params)
+        return await asyncio.wrap_future(future)
+
+    # 🎯 МЕТОДЫ Database, ВЫПОЛНЯЕМЫЕ ВНЕ EVENT LOOP
+
+    def generate_time_slots(self, start_time, end_time):
+        """Генерирует временные слоты (без обращения к БД)"""
+        return self.db.generate_time_slots(start_time, end_time)
+
+    async def reconnect(self):
+        await self.reset()
+        return await self._run(self.db.reconnect)
+
+    async def migrate(self):
+        return await self._run(self.db.migrate)
+
+    async def create_backup(self):
+        return await self._run(self.db.create_backup)
+
+    async def restore_from_backup(self, backup_path=None, until=None):
+        await self.reset()
+        return await self._run(self.db.restore_from_backup, backup_path, until)
+
+    async def create_incremental_backup(self):
+        return await self._run(self.db.create_incremental_backup)
+
+    async def create_scheduled_backup(self):
+        return await self._run(self.db.create_scheduled_backup)
+
+    async def inspect_backup(self, backup_path=None):
+        return await self._run(self.db.inspect_backup, backup_path)
+
+    async def get_startup_info(self):
+        return await self._run(self.db.get_startup_info)
+
+    async def get_query_stats(self, limit=config.QUERY_STATS_TOP, order_by='total_ms'):
+        return await self._run(self.db.get_query_stats, limit, order_by)
+
+    async def get_retry_stats(self):
+        return await self._run(self.db.get_retry_stats)
+
+    async def get_health(self):
+        return await self._run(self.db.get_health)
+
+    async def get_wal_stats(self):
+        return await self._run(self.db.get_wal_stats)
+
+    async def get_backup_status(self):
+        return await self._run(self.db.get_backup_status)
+
+    async def get_backup_scheduler_stats(self):
+        return await self._run(self.db.get_backup_scheduler_stats)
+
+    async def get_backup_files_info(self):
+        return await self._run(self.db.get_backup_files_info)
+
+    async def automatic_cleanup(self):
+        return await self._run(self.db.automatic_cleanup)
+
+    async def emergency_cleanup(self):
+        return await self._run(self.db.emergency_cleanup)
+
+    async def emergency_size_management(self):
+        return await self._run(self.db.emergency_size_management)
+
+    async def add_appointment(self, user_id, user_name, user_username, phone, service, date, time, is_manual=False):
+        return await self._run(self.db.add_appointment, user_id, user_name, user_username, phone, service, date, time, is_manual)
+
+    async def add_or_update_user(self, user_id, username, first_name, last_name):
+        return await self._run(self.db.add_or_update_user, user_id, username, first_name, last_name)
+
+    async def is_admin(self, user_id):
+        return await self._run(self.db.is_admin, user_id)
+
+    async def get_available_slots(self, date):
+        return await self._run(self.db.get_available_slots, date)
+
+    async def set_work_schedule(self, weekday, start_time, end_time, is_working=True):
+        return await self._run(self.db.set_work_schedule, weekday, start_time, end_time, is_working)
+
+    async def get_work_schedule(self, weekday=None):
+        return await self._run(self.db.get_work_schedule, weekday)
+
+    async def get_schedule_snapshot(self):
+        return await self._run(self.db.get_schedule_snapshot)
+
+    async def get_week_schedule(self):
+        return await self._run(self.db.get_week_schedule)
+
+    async def get_user_appointments(self, user_id):
+        return await self._run(self.db.get_user_appointments, user_id)
+
+    async def get_all_appointments(self):
+        return await self._run(self.db.get_all_appointments)
+
+    async def get_appointments_in_range(self, start_date, end_date, after=None, limit=None):
+        return await self._run(self.db.get_appointments_in_range, start_date, end_date, after, limit)
+
+    async def get_appointments_by_date(self, date):
+        return await self._run(self.db.get_appointments_by_date, date)
+
+    async def get_appointments_by_user(self, user_id, after=None, limit=None):
+        return await self._run(self.db.get_appointments_by_user, user_id, after, limit)
+
+    async def get_manual_appointments(self, after=None, limit=None):
+        return await self._run(self.db.get_manual_appointments, after, limit)
+
+    async def count_appointments_by_date(self, start_date, end_date):
+        return await self._run(self.db.count_appointments_by_date, start_date, end_date)
+
+    async def get_today_appointments(self):
+        return await self._run(self.db.get_today_appointments)
+
+    async def cancel_appointment(self, appointment_id, user_id=None):
+        return await self._run(self.db.cancel_appointment, appointment_id, user_id)
+
+    async def mark_24h_reminder_sent(self, appointment_id):
+        return await self._run(self.db.mark_24h_reminder_sent, appointment_id)
+
+    async def mark_1h_reminder_sent(self, appointment_id):
+        return await self._run(self.db.mark_1h_reminder_sent, appointment_id)
+
+    async def get_appointment(self, appointment_id):
+        return await self._run(self.db.get_appointment, appointment_id)
+
+    async def save_reminder(self, appointment_id, reminder_type, scheduled_time):
+        return await self._run(self.db.save_reminder, appointment_id, reminder_type, scheduled_time)
+
+    async def mark_reminder_sent(self, appointment_id, reminder_type):
+        return await self._run(self.db.mark_reminder_sent, appointment_id, reminder_type)
+
+    async def get_pending_reminders(self):
+        return await self._run(self.db.get_pending_reminders)
+
+    async def get_appointments_without_reminders(self, start, end):
+        return await self._run(self.db.get_appointments_without_reminders, start, end)
+
+    async def delete_old_sent_reminders(self, before):
+        return await self._run(self.db.delete_old_sent_reminders, before)
+
+    async def set_notification_chat(self, admin_id, chat_id):
+        return await self._run(self.db.set_notification_chat, admin_id, chat_id)
+
+    async def get_notification_chats(self):
+        return await self._run(self.db.get_notification_chats)
+
+    async def get_total_users_count(self):
+        return await self._run(self.db.get_total_users_count)
+
+    async def get_active_users_count(self, days=30):
+        return await self._run(self.db.get_active_users_count, days)
+
+    async def cleanup_completed_appointments(self):
+        return await self._run(self.db.cleanup_completed_appointments)
+
+    async def archive_appointments(self, before):
+        return await self._run(self.db.archive_appointments, before)
+
+    async def get_archive_stats(self):
+        return await self._run(self.db.get_archive_stats)
+
+    async def get_conflicting_appointments(self, weekday, new_start_time, new_end_time, new_is_working):
+        return await self._run(self.db.get_conflicting_appointments, weekday, new_start_time, new_end_time, new_is_working)
+
+    async def cancel_appointments_by_ids(self, appointment_ids):
+        return await self._run(self.db.cancel_appointments_by_ids, appointment_ids)
+
+    async def add_admin(self, admin_id, username, first_name, last_name, added_by):
+        return await self._run(self.db.add_admin, admin_id, username, first_name, last_name, added_by)
+
+    async def remove_admin(self, admin_id):
+        return await self._run(self.db.remove_admin, admin_id)
+
+    async def get_all_admins(self):
+        return await self._run(self.db.get_all_admins)
+
+    async def get_admin_info(self, admin_id):
+        return await self._run(self.db.get_admin_info, admin_id)
+
+    async def check_query_plans(self):
+        return await self._run(self.db.check_query_plans)
+
+    async def get_weekly_stats(self):
+        return await self._run(self.db.get_weekly_stats)
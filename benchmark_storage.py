@@ -0,0 +1,143 @@
+# benchmark_storage.py
+"""🎯 СРАВНЕНИЕ ПРОФИЛЕЙ НАСТРОЙКИ SQLite НА НАГРУЗКЕ БОТА
+
+Для каждого профиля из config.TUNING_PROFILES в отдельном процессе
+создается новая БД, на нее проигрываются записи клиентов, чтение
+(свободные слоты, записи пользователя, все записи, записи на сегодня)
+из нескольких потоков и отмены. Печатается пропускная способность
+каждой фазы и пиковый RSS процесса.
+
+    python benchmark_storage.py
+    python benchmark_storage.py --profiles low_memory throughput --bookings 5000
+    python benchmark_storage.py --url memory://
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import psutil
+
+import config
+
+
+def run_workload(args):
+    """Проигрывает нагрузку в текущем процессе и возвращает метрики"""
+    import database
+    import storage
+
+    process = psutil.Process()
+    peak_rss = process.memory_info().rss
+
+    def sample_rss():
+        nonlocal peak_rss
+        peak_rss = max(peak_rss, process.memory_info().rss)
+
+    with tempfile.TemporaryDirectory(prefix='barbershop_bench_') as directory:
+        # Backup не входит в измеряемую нагрузку. Отключаем его при создании:
+        # иначе новая пустая БД восстановится из backup бота в config.BACKUP_DIR
+        options = {'backup_dir': os.path.join(directory, 'backups'), 'backup_enabled': False}
+        if args.url:
+            db = storage.create_storage(args.url, allow_memory_storage=True, **options)
+        else:
+            db = database.Database(os.path.join(directory, 'barbershop.db'), tuning_profile=args.profile, **options)
+
+        rng = random.Random(args.seed)
+        start_date = database.get_moscow_time().date() + timedelta(days=1)
+        dates = []
+        for day in range(args.bookings // len(config.TIME_SLOTS) + 1):
+            current = start_date + timedelta(days=day)
+            db.set_work_schedule(current.weekday(), "10:00", "20:00", True)
+            dates.append(current.strftime("%Y-%m-%d"))
+        slots = [(date, slot) for date in dates for slot in config.TIME_SLOTS][:args.bookings]
+        users = list(range(1000, 1000 + max(1, args.bookings // 4)))
+
+        results = {'profile': args.url or args.profile}
+
+        started = time.perf_counter()
+        appointment_ids = []
+        for date, slot in slots:
+            user_id = rng.choice(users)
+            appointment_ids.append(db.add_appointment(user_id, f"Клиент {user_id}", None, "+79000000000", "Стрижка", date, slot))
+        elapsed = time.perf_counter() - started
+        results['bookings_per_s'] = len(slots) / elapsed
+        sample_rss()
+
+        def read(_):
+            kind = rng.randrange(4)
+            if kind == 0:
+                return db.get_available_slots(rng.choice(dates))
+            if kind == 1:
+                return db.get_user_appointments(rng.choice(users))
+            if kind == 2:
+                return db.get_all_appointments()
+            return db.get_today_appointments()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            for _ in pool.map(read, range(args.reads)):
+                pass
+        elapsed = time.perf_counter() - started
+        results['reads_per_s'] = args.reads / elapsed
+        sample_rss()
+
+        to_cancel = rng.sample(appointment_ids, len(appointment_ids) // 10)
+        started = time.perf_counter()
+        for appointment_id in to_cancel:
+            db.cancel_appointment(appointment_id)
+        elapsed = time.perf_counter() - started
+        results['cancels_per_s'] = len(to_cancel) / elapsed if to_cancel else 0.0
+        sample_rss()
+
+        db.close()
+        results['peak_rss_mb'] = peak_rss / (1024 * 1024)
+        if not args.url:
+            results['db_size_kb'] = os.path.getsize(os.path.join(directory, 'barbershop.db')) // 1024
+    return results
+
+
+def run_isolated(args, profile):
+    """Запускает нагрузку для профиля в отдельном процессе, чтобы RSS не смешивался"""
+    command = [sys.executable, os.path.abspath(__file__), '--worker',
+               '--bookings', str(args.bookings), '--reads', str(args.reads),
+               '--threads', str(args.threads), '--seed', str(args.seed)]
+    command += ['--url', args.url] if args.url else ['--profile', profile]
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей настройки SQLite")
+    parser.add_argument('--profiles', nargs='+', default=list(config.TUNING_PROFILES))
+    parser.add_argument('--url', help="хранилище по DATABASE_URL вместо профилей (например memory://)")
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--reads', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=config.READ_POOL_SIZE)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(run_workload(args)))
+        return
+
+    profiles = [None] if args.url else args.profiles
+    print(f"{'профиль':<12} {'запись/с':>10} {'чтение/с':>10} {'отмена/с':>10} {'RSS, MB':>9} {'БД, KB':>8}")
+    for profile in profiles:
+        r = run_isolated(args, profile)
+        print(f"{r['profile']:<12} {r['bookings_per_s']:>10.0f} {r['reads_per_s']:>10.0f} "
+              f"{r['cancels_per_s']:>10.0f} {r['peak_rss_mb']:>9.1f} {r.get('db_size_kb', 0):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,8 @@ from telegram.ext import (
 from telegram.error import BadRequest, TelegramError, Conflict
 from datetime import datetime, timedelta, timezone
 import database
+import async_database
+import storage
 import config
 import httpx
 import asyncio
@@ -26,8 +28,8 @@ import asyncio
 # 🎯 BACKUP ФУНКЦИИ ДЛЯ RENDER (ЛОКАЛЬНЫЕ ФАЙЛЫ)
 
 def get_database_path():
-    """🎯 ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ПУТИ К БАЗЕ ДАННЫХ"""
-    return '/tmp/barbershop.db'
+    """🎯 ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ПУТИ К БАЗЕ ДАННЫХ (ИЗ DATABASE_URL)"""
+    return db.db_path
 
 async def backup_database(context: ContextTypes.DEFAULT_TYPE):
     """🎯 ЛОКАЛЬНОЕ РЕЗЕРВНОЕ КОПИРОВАНИЕ БЕЗ УВЕДОМЛЕНИЙ"""
@@ -35,7 +37,7 @@ async def backup_database(context: ContextTypes.DEFAULT_TYPE):
         logger.info("💾 Запуск автоматического локального backup...")
         
         # Создаем backup через database.py (без уведомлений)
-        backup_path = db.create_backup()
+        backup_path = await adb.create_backup()
         
         if backup_path:
             logger.info(f"✅ Автоматический backup создан: {backup_path}")
@@ -63,12 +65,12 @@ async def check_memory_usage(context: ContextTypes.DEFAULT_TYPE):
             logger.warning("⚠️ Близко к лимиту памяти! Выполняем экстренную очистку...")
             
             # Создаем backup перед очисткой (без уведомлений)
-            backup_path = db.create_backup()
+            backup_path = await adb.create_backup()
             if backup_path:
                 logger.info(f"✅ Backup перед очисткой создан: {backup_path}")
             
             # Выполняем экстренную очистку
-            deleted_count = db.emergency_cleanup()
+            deleted_count = await adb.emergency_cleanup()
             
             logger.info(f"🚨 Экстренная очистка: удалено {deleted_count} записей")
             
@@ -81,13 +83,13 @@ async def show_backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """🎯 ПОКАЗЫВАЕТ СТАТУС BACKUP БЕЗ ВОССТАНОВЛЕНИЯ"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой функции")
         return
     
     # 🎯 ТОЛЬКО ПОКАЗЫВАЕМ СТАТУС, НЕ ВОССТАНАВЛИВАЕМ!
-    backup_status = db.get_backup_status()
-    backup_files = db.get_backup_files_info()
+    backup_status = await adb.get_backup_status()
+    backup_files = await adb.get_backup_files_info()
     
     if not backup_status and not backup_files:
         text = "📊 *Статус Backup*\n\n📭 Нет данных о backup"
@@ -95,10 +97,12 @@ async def show_backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
         text = "📊 *Статус Backup*\n\n"
         
         if backup_files:
-            text += f"📁 *Backup файлов:* {len(backup_files)}\n\n"
-            for i, file_info in enumerate(backup_files[:3], 1):
-                text += f"{i}. 📄 `{os.path.basename(file_info['path'])}`\n"
+            text += f"📁 *Поколений backup:* {len(backup_files)}\n\n"
+            for i, file_info in enumerate(backup_files[:5], 1):
+                kind = "день" if file_info['kind'] == 'daily' else "час"
+                text += f"{i}. 📄 `{os.path.basename(file_info['path'])}` ({kind})\n"
                 text += f"   📏 {file_info['size_kb']} KB | 🕐 {file_info['date']}\n\n"
+            text += "♻️ Восстановить поколение: /restore N\n\n"
         
         if backup_status:
             text += "*Последние операции backup:*\n\n"
@@ -121,17 +125,15 @@ async def show_backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 text += "\n"
     
     # 🎯 ИСПРАВЛЕНИЕ: ПРАВИЛЬНЫЙ РАСЧЕТ РАЗМЕРА ОСНОВНОЙ БД
-    db_path = '/tmp/barbershop.db'
+    db_path = get_database_path()
     if os.path.exists(db_path):
         db_size = os.path.getsize(db_path) / (1024 * 1024)  # MB
         size_info = f"{db_size:.2f} MB"
         
         # Получаем текущие данные из БД
         try:
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            appointments_count = cursor.fetchone()[0]
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            users_count = cursor.fetchone()[0]
+            appointments_count = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+            users_count = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
             
             text += f"💾 *Текущая БД:* {size_info} ({appointments_count} записей, {users_count} пользователей)\n"
         except Exception as e:
@@ -163,7 +165,7 @@ async def create_backup_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
@@ -171,10 +173,10 @@ async def create_backup_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text("💾 *Создание локального backup...*\n\nПожалуйста, подождите...", parse_mode='Markdown')
     
     # Создаем backup
-    backup_path = db.create_backup()
+    backup_path = await adb.create_backup()
     
     if backup_path:
-        backup_files = db.get_backup_files_info()
+        backup_files = await adb.get_backup_files_info()
         
         text = (
             f"✅ *Локальный backup создан успешно!*\n\n"
@@ -207,23 +209,21 @@ async def show_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
     try:
         # Получаем статистику
-        total_users = db.get_total_users_count()
-        active_users = db.get_active_users_count(30)
+        total_users = await adb.get_total_users_count()
+        active_users = await adb.get_active_users_count(30)
         
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-        total_appointments = cursor.fetchone()[0]
+        total_appointments = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
         
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments WHERE appointment_date >= DATE("now")')
-        future_appointments = cursor.fetchone()[0]
+        future_appointments = (await adb.fetchone(database.HOT_QUERIES['future_appointments_count'], (database.local_epoch_minutes(get_moscow_time().strftime("%Y-%m-%d")),)))[0]
         
         # Получаем размер БД
-        db_path = '/tmp/barbershop.db'
+        db_path = get_database_path()
         if os.path.exists(db_path):
             size_bytes = os.path.getsize(db_path)
             size_mb = size_bytes / (1024 * 1024)
@@ -236,8 +236,12 @@ async def show_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             size_bytes = 0
         
         # 🎯 ИСПРАВЛЕННАЯ ЧАСТЬ: Получаем статус backup
-        backup_files = db.get_backup_files_info()
-        backup_status = db.get_backup_status()
+        backup_files = await adb.get_backup_files_info()
+        backup_status = await adb.get_backup_status()
+        wal_stats = await adb.get_wal_stats()
+        scheduler_stats = await adb.get_backup_scheduler_stats()
+        archive_stats = await adb.get_archive_stats()
+        health = await adb.get_health()
         
         # 🎯 ИСПРАВЛЕНИЕ: ПРАВИЛЬНАЯ ОБРАБОТКА ВРЕМЕНИ
         last_backup_time = "нет данных"
@@ -263,13 +267,23 @@ async def show_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"• Активных (30 дней): {active_users}\n\n"
             f"📅 *Записи:*\n"
             f"• Всего: {total_appointments}\n"
-            f"• Будущих: {future_appointments}\n\n"
+            f"• Будущих: {future_appointments}\n"
+            f"• В архиве: {archive_stats['appointments']} ({archive_stats['size_kb']} KB)\n\n"
             f"💾 *Backup система:*\n"
             f"• Файлов backup: {len(backup_files)}\n"
             f"• Последний backup: {last_backup_time}\n"
             f"• Статус: {last_backup_status}\n"
+            f"• Отложенных backup: {scheduler_stats['backups']} (объединено изменений: {scheduler_stats['coalesced']})\n"
             f"• Размер БД: {size_info}\n"
             f"• Размер в байтах: {size_bytes} bytes\n\n"  # 🎯 ДОБАВЛЕНО ДЛЯ ДИАГНОСТИКИ
+            f"🗂 *WAL:*\n"
+            f"• Размер: {wal_stats.get('wal_size_kb', 0)} KB\n"
+            f"• Checkpoint: {wal_stats.get('checkpoints', 0)} (последний: {wal_stats.get('last_mode') or 'нет'})\n"
+            f"• Длительность: {wal_stats.get('last_duration_ms', 0):.1f} ms, макс. {wal_stats.get('max_duration_ms', 0):.1f} ms\n\n"
+            f"🩺 *Соединение:*\n"
+            f"• Состояние: {health['state']} (ошибок: {health['failures']}, переподключений: {health['reconnects']})\n"
+            f"• Обслуживание: {health['maintenance_runs']} раз, последнее {health['last_maintenance_at'] or 'нет'} "
+            f"(quick\\_check: {health['last_quick_check'] or 'нет'}), записей с тех пор: {health['writes_since_maintenance']}\n\n"
             f"🛠 *Render Free Tier:*\n"
             f"• Память: 512 MB\n"
             f"• Хранилище: Эфемерное (/tmp/)\n"
@@ -294,7 +308,7 @@ async def backup_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """🎯 КОМАНДА ДЛЯ РУЧНОЙ ПРОВЕРКИ BACKUP"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой команде")
         return
     
@@ -304,48 +318,28 @@ async def backup_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def check_backup_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверяет содержимое бэкап файла"""
     user_id = update.effective_user.id
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         return
 
-    import sqlite3
-    import os
-    
-    backup_path = "/tmp/barbershop_latest_backup.db"
-    current_db_path = "/tmp/barbershop.db"
-    
-    if not os.path.exists(backup_path):
-        await update.message.reply_text("❌ Бэкап файл не существует")
-        return
-    
     try:
-        # Проверяем бэкап файл
-        conn_backup = sqlite3.connect(backup_path)
-        cursor_backup = conn_backup.cursor()
-        
-        # Считаем записи в бэкапе
-        cursor_backup.execute('SELECT COUNT(*) FROM appointments')
-        backup_appointments = cursor_backup.fetchone()[0]
-        
-        cursor_backup.execute('SELECT COUNT(*) FROM bot_users') 
-        backup_users = cursor_backup.fetchone()[0]
+        # Проверяем последнее поколение backup
+        backup_info = await adb.inspect_backup()
+        if not backup_info:
+            await update.message.reply_text("❌ Бэкап не существует или поврежден")
+            return
         
-        conn_backup.close()
+        backup_path = os.path.basename(backup_info['path'])
+        backup_appointments = backup_info['appointments']
+        backup_users = backup_info['users']
         
         # Проверяем текущую БД
-        conn_current = sqlite3.connect(current_db_path)
-        cursor_current = conn_current.cursor()
-        
-        cursor_current.execute('SELECT COUNT(*) FROM appointments')
-        current_appointments = cursor_current.fetchone()[0]
-        
-        cursor_current.execute('SELECT COUNT(*) FROM bot_users')
-        current_users = cursor_current.fetchone()[0]
-        
-        conn_current.close()
+        current_db_path = get_database_path()
+        current_appointments = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+        current_users = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
         
         text = (
             f"🔍 *Диагностика Бэкапа:*\n\n"
-            f"📁 *Бэкап файл:* {backup_path}\n"
+            f"📁 *Бэкап файл:* `{backup_path}`\n"
             f"📊 *Записей в бэкапе:* {backup_appointments}\n"
             f"👥 *Пользователей в бэкапе:* {backup_users}\n\n"
             f"📁 *Текущая БД:* {current_db_path}\n"
@@ -384,7 +378,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = database.Database()
+db = storage.create_storage()
+adb = async_database.AsyncDatabase(db)
 
 # Создаем Flask приложение для веб-сервера
 web_app = Flask(__name__)
@@ -434,7 +429,7 @@ def health():
         "status": "healthy",
         "service": "barbershop-bot",
         "timestamp": database.get_moscow_time().isoformat(),
-        "database": "connected" if db.conn else "disconnected"
+        "database": "connected" if db.ping() else "disconnected"
     }
 
 @web_app.route('/ping')
@@ -464,7 +459,7 @@ def deep_health():
     """Глубокая проверка здоровья"""
     try:
         # Проверяем подключение к базе данных
-        db_status = "connected" if db.conn else "disconnected"
+        db_status = "connected" if db.ping() else "disconnected"
         
         # Проверяем токен бота
         bot_token = config.BOT_TOKEN
@@ -616,6 +611,13 @@ def start_enhanced_self_ping():
     ping_thread.start()
     logger.info("🔁 Enhanced self-ping service started")
 
+def close_database_at_exit():
+    """Закрывает БД при выходе процесса, чтобы записать манифест чистой остановки"""
+    try:
+        db.close()
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка закрытия БД при выходе: {e}")
+
 def signal_handler(signum, frame):
     """Обработчик сигналов для graceful shutdown"""
     logger.info(f"📞 Received signal {signum}, performing graceful shutdown...")
@@ -673,11 +675,11 @@ def get_moscow_time_from_naive(naive_datetime):
         # Если уже имеет часовой пояс, конвертируем в московский
         return naive_datetime.astimezone(moscow_tz)
 
-def get_main_keyboard(user_id):
+async def get_main_keyboard(user_id):
     """Создает основную клавиатуру под сообщением"""
     keyboard = []
     
-    if db.is_admin(user_id):
+    if await adb.is_admin(user_id):
         # 🎯 ИСПРАВЛЕННАЯ КЛАВИАТУРА ДЛЯ АДМИНИСТРАТОРА
         keyboard = [
             [KeyboardButton("📝 Записать клиента вручную")],
@@ -708,16 +710,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Добавляем/обновляем пользователя в статистике
-    db.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
+    await adb.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
     
-    keyboard = get_main_keyboard(user.id)
+    keyboard = await get_main_keyboard(user.id)
     
     welcome_text = (
         f"👋 Добро пожаловать в парикмахерскую *{config.BARBERSHOP_NAME}*, {user.first_name}!\n\n"
         "Я - бот для записи на стрижку. Выберите действие на клавиатуре ниже:\n\n"
     )
     
-    if db.is_admin(user.id):
+    if await adb.is_admin(user.id):
         welcome_text += (
             "📝 *Записать клиента вручную* - запись клиента по телефону или при личной встрече\n"
             "📋 *Мои записи* - записи, внесенные вручную\n"
@@ -776,9 +778,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Обновляем время последней активности пользователя
     user = update.effective_user
-    db.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
+    await adb.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
     
-    if db.is_admin(user_id):
+    if await adb.is_admin(user_id):
         # Обработка для администратора
         if text == "📝 Записать клиента вручную":
             await make_appointment_start(update, context, is_admin=True)
@@ -805,7 +807,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text(
                 "Пожалуйста, используйте кнопки ниже для навигации",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
     else:
         # Обработка для обычного пользователя
@@ -826,7 +828,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text(
                 "Пожалуйста, используйте кнопки ниже для навигации",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -842,13 +844,13 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         await update.message.reply_text(
             f"🏠 *Главное меню {config.BARBERSHOP_NAME}*\n\nВыберите действие на клавиатуре ниже:",
-            reply_markup=get_main_keyboard(user_id),
+            reply_markup=await get_main_keyboard(user_id),
             parse_mode='Markdown'
         )
 
 async def show_work_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает график работы для обычного пользователя"""
-    schedule = db.get_week_schedule()
+    schedule = await adb.get_week_schedule()
     
     text = f"🗓️ *График работы {config.BARBERSHOP_NAME}*\n\n"
     
@@ -872,7 +874,7 @@ async def show_work_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         await update.message.reply_text(
             text,
-            reply_markup=get_main_keyboard(update.effective_user.id),
+            reply_markup=await get_main_keyboard(update.effective_user.id),
             parse_mode='Markdown'
         )
 
@@ -902,7 +904,7 @@ async def about_barbershop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(
             text,
-            reply_markup=get_main_keyboard(update.effective_user.id),
+            reply_markup=await get_main_keyboard(update.effective_user.id),
             parse_mode='Markdown'
         )
 
@@ -910,12 +912,12 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает статистику пользователей бота (только для администратора)"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой функции")
         return
     
-    total_users = db.get_total_users_count()
-    active_users = db.get_active_users_count(30)
+    total_users = await adb.get_total_users_count()
+    active_users = await adb.get_active_users_count(30)
     
     text = (
         f"📈 *Статистика бота {config.BARBERSHOP_NAME}*\n\n"
@@ -941,12 +943,12 @@ async def weekly_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
     try:
-        stats = db.get_weekly_stats()
+        stats = await adb.get_weekly_stats()
         
         text = (
             f"📊 *ОТЧЕТ ЗА ПРОШЕДШУЮ НЕДЕЛЮ*\n\n"
@@ -1010,6 +1012,8 @@ async def service_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     days_shown = 0
     i = 0
+    # 🎯 ГРАФИК БЕРЕМ ОДИН РАЗ НА ВЕСЬ ЦИКЛ ПО ДНЯМ
+    schedule_snapshot = await adb.get_schedule_snapshot()
     
     while days_shown < 7 and i < 30:
         date = today + timedelta(days=i)
@@ -1018,7 +1022,7 @@ async def service_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         weekday = date.weekday()
         day_name = config.WEEKDAYS[weekday]
         
-        schedule = db.get_work_schedule(weekday)
+        schedule = schedule_snapshot.rows(weekday)
         if schedule and schedule[0][4]:
             start_time, end_time = schedule[0][2], schedule[0][3]
             
@@ -1085,7 +1089,7 @@ async def date_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     date = query.data.split("_")[1]
     context.user_data['date'] = date
     
-    available_slots = db.get_available_slots(date)
+    available_slots = await adb.get_available_slots(date)
     
     today = get_moscow_time().date()
     selected_date = datetime.strptime(date, "%Y-%m-%d").date()
@@ -1093,7 +1097,7 @@ async def date_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if selected_date == today:
         weekday = selected_date.weekday()
-        schedule = db.get_work_schedule(weekday)
+        schedule = await adb.get_work_schedule(weekday)
         if schedule and schedule[0][4]:
             start_time, end_time = schedule[0][2], schedule[0][3]
             available_slots = filter_available_slots(available_slots, current_time, start_time, end_time)
@@ -1188,7 +1192,7 @@ async def date_selected_back(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['awaiting_phone'] = False
     
     date = context.user_data['date']
-    available_slots = db.get_available_slots(date)
+    available_slots = await adb.get_available_slots(date)
     
     today = get_moscow_time().date()
     selected_date = datetime.strptime(date, "%Y-%m-%d").date()
@@ -1196,7 +1200,7 @@ async def date_selected_back(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if selected_date == today:
         weekday = selected_date.weekday()
-        schedule = db.get_work_schedule(weekday)
+        schedule = await adb.get_work_schedule(weekday)
         if schedule and schedule[0][4]:
             start_time, end_time = schedule[0][2], schedule[0][3]
             available_slots = filter_available_slots(available_slots, current_time, start_time, end_time)
@@ -1290,14 +1294,15 @@ async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         appointment_user_name = "Администратор (ручная запись)" if is_admin_manual else user.full_name
         appointment_username = "admin_manual" if is_admin_manual else user.username
         
-        appointment_id = db.add_appointment(
+        appointment_id = await adb.add_appointment(
             user_id=appointment_user_id,
             user_name=appointment_user_name,
             user_username=appointment_username,
             phone=normalized_phone,
             service=user_data['service'],
             date=user_data['date'],
-            time=user_data['time']
+            time=user_data['time'],
+            is_manual=is_admin_manual
         )
         logger.info(f"✅ Запись создана с ID: {appointment_id}")
 
@@ -1332,9 +1337,7 @@ async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             is_manual=is_admin_manual
         )
         
-        await check_duplicate_appointments(context)
-        
-        main_keyboard = get_main_keyboard(user.id)
+        main_keyboard = await get_main_keyboard(user.id)
         
         if is_admin_manual:
             success_text = (
@@ -1363,7 +1366,7 @@ async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     except Exception as e:
         logger.error(f"Ошибка при создании записи: {e}")
-        main_keyboard = get_main_keyboard(user.id)
+        main_keyboard = await get_main_keyboard(user.id)
         
         if "уже занято" in str(e):
             await update.message.reply_text(
@@ -1382,46 +1385,8 @@ async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return ConversationHandler.END
 
-def add_appointment(self, user_id, user_name, user_username, phone, service, date, time):
-    """Добавляет новую запись С АВТОМАТИЧЕСКИМ BACKUP"""
-    try:
-        # Проверяем, не занято ли время
-        cursor = self.execute_with_retry('''
-            SELECT COUNT(*) FROM appointments 
-            WHERE appointment_date = ? AND appointment_time = ?
-        ''', (date, time))
-        
-        if cursor.fetchone()[0] > 0:
-            raise Exception("Это время уже занято другим клиентом")
-        
-        cursor = self.execute_with_retry('''
-            INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, user_name, user_username, phone, service, date, time))
-        
-        appointment_id = cursor.lastrowid
-        
-        self.execute_with_retry('''
-            INSERT OR REPLACE INTO schedule (date, time, available)
-            VALUES (?, ?, ?)
-        ''', (date, time, False))
-        
-        self.conn.commit()
-        
-        # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПОСЛЕ КАЖДОЙ НОВОЙ ЗАПИСИ
-        if self.backup_enabled:
-            logger.info(f"💾 Автоматический backup после создания записи #{appointment_id}")
-            self.create_backup()
-        
-        return appointment_id
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка БД в add_appointment: {e}")
-        raise
-
 async def schedule_appointment_reminders(context: ContextTypes.DEFAULT_TYPE, appointment_id: int, date: str, time: str, user_id: int):
     """Планирует напоминания для новой записи сразу при создании"""
-    cursor = None
     try:
         logger.info(f"🎯 Планирование напоминаний для записи #{appointment_id}")
         
@@ -1439,13 +1404,7 @@ async def schedule_appointment_reminders(context: ContextTypes.DEFAULT_TYPE, app
         
         if time_until_24h > 0:
             # Сохраняем в БД
-            cursor = db.execute_with_retry('''
-                INSERT INTO scheduled_reminders (appointment_id, reminder_type, scheduled_time)
-                VALUES (?, ?, ?)
-                ON CONFLICT (appointment_id, reminder_type) DO UPDATE SET
-                scheduled_time = excluded.scheduled_time,
-                sent = FALSE
-            ''', (appointment_id, '24h', reminder_24h_moscow))
+            await adb.save_reminder(appointment_id, '24h', reminder_24h_moscow)
             
             # Конвертируем в UTC для job_queue
             reminder_24h_utc = reminder_24h_moscow.astimezone(timezone.utc)
@@ -1467,13 +1426,7 @@ async def schedule_appointment_reminders(context: ContextTypes.DEFAULT_TYPE, app
         
         if time_until_1h > 0:
             # Сохраняем в БД
-            cursor = db.execute_with_retry('''
-                INSERT INTO scheduled_reminders (appointment_id, reminder_type, scheduled_time)
-                VALUES (?, ?, ?)
-                ON CONFLICT (appointment_id, reminder_type) DO UPDATE SET
-                scheduled_time = excluded.scheduled_time,
-                sent = FALSE
-            ''', (appointment_id, '1h', reminder_1h_moscow))
+            await adb.save_reminder(appointment_id, '1h', reminder_1h_moscow)
             
             # Конвертируем в UTC для job_queue
             reminder_1h_utc = reminder_1h_moscow.astimezone(timezone.utc)
@@ -1489,17 +1442,12 @@ async def schedule_appointment_reminders(context: ContextTypes.DEFAULT_TYPE, app
         else:
             logger.info(f"⏩ 1h напоминание для #{appointment_id} пропущено (время прошло)")
             
-        db.conn.commit()
         logger.info(f"✅ Все напоминания для записи #{appointment_id} запланированы")
             
     except Exception as e:
         logger.error(f"❌ Ошибка при планировании напоминаний для #{appointment_id}: {e}")
         import traceback
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
-    finally:
-        # Всегда закрываем курсор
-        if cursor:
-            cursor.close()
 
 async def send_single_24h_reminder(context: ContextTypes.DEFAULT_TYPE):
     """Отправляет одно 24-часовое напоминание для конкретной записи"""
@@ -1513,11 +1461,7 @@ async def send_single_24h_reminder(context: ContextTypes.DEFAULT_TYPE):
         moscow_time = get_moscow_time()
         logger.info(f"⏰ [24h] Отправка напоминания для записи #{appointment_id} пользователю {user_id} в {moscow_time.strftime('%d.%m.%Y %H:%M')} MSK")
         
-        cursor = db.execute_with_retry('''
-            SELECT user_name, user_username, phone, service, appointment_date, appointment_time 
-            FROM appointments WHERE id = ?
-        ''', (appointment_id,))
-        result = cursor.fetchone()
+        result = await adb.get_appointment(appointment_id)
         
         if not result:
             logger.error(f"❌ Запись #{appointment_id} не найдена для напоминания")
@@ -1528,12 +1472,7 @@ async def send_single_24h_reminder(context: ContextTypes.DEFAULT_TYPE):
         # Пропускаем напоминания для ручных записей администратора
         if user_name == "Администратор":
             logger.info(f"⏩ Пропуск 24h напоминания для записи администратора #{appointment_id}")
-            cursor = db.execute_with_retry('''
-                UPDATE scheduled_reminders 
-                SET sent = TRUE 
-                WHERE appointment_id = ? AND reminder_type = '24h'
-            ''', (appointment_id,))
-            db.conn.commit()
+            await adb.mark_reminder_sent(appointment_id, '24h')
             return
         
         appointment_date = datetime.strptime(date, "%Y-%m-%d").date()
@@ -1554,24 +1493,14 @@ async def send_single_24h_reminder(context: ContextTypes.DEFAULT_TYPE):
         
         await context.bot.send_message(chat_id=user_id, text=text, parse_mode='Markdown')
         
-        cursor = db.execute_with_retry('''
-            UPDATE scheduled_reminders 
-            SET sent = TRUE 
-            WHERE appointment_id = ? AND reminder_type = '24h'
-        ''', (appointment_id,))
-        db.conn.commit()
+        await adb.mark_reminder_sent(appointment_id, '24h')
         
         logger.info(f"✅ 24h напоминание отправлено пользователю {user_id} для записи #{appointment_id}")
         
     except BadRequest as e:
         if "chat not found" in str(e).lower():
             logger.warning(f"⚠️ Chat not found for user {user_id}, skipping 24h reminder")
-            cursor = db.execute_with_retry('''
-                UPDATE scheduled_reminders 
-                SET sent = TRUE 
-                WHERE appointment_id = ? AND reminder_type = '24h'
-            ''', (appointment_id,))
-            db.conn.commit()
+            await adb.mark_reminder_sent(appointment_id, '24h')
         else:
             logger.error(f"❌ BadRequest при отправке 24h напоминания: {e}")
     except Exception as e:
@@ -1591,11 +1520,7 @@ async def send_single_1h_reminder(context: ContextTypes.DEFAULT_TYPE):
         moscow_time = get_moscow_time()
         logger.info(f"⏰ [1h] Отправка напоминания для записи #{appointment_id} пользователю {user_id} в {moscow_time.strftime('%d.%m.%Y %H:%M')} MSK")
         
-        cursor = db.execute_with_retry('''
-            SELECT user_name, user_username, phone, service, appointment_date, appointment_time 
-            FROM appointments WHERE id = ?
-        ''', (appointment_id,))
-        result = cursor.fetchone()
+        result = await adb.get_appointment(appointment_id)
         
         if not result:
             logger.error(f"❌ Запись #{appointment_id} не найдена для напоминания")
@@ -1606,12 +1531,7 @@ async def send_single_1h_reminder(context: ContextTypes.DEFAULT_TYPE):
         # Пропускаем напоминания для ручных записей администратора
         if user_name == "Администратор":
             logger.info(f"⏩ Пропуск 1h напоминания для записи администратора #{appointment_id}")
-            cursor = db.execute_with_retry('''
-                UPDATE scheduled_reminders 
-                SET sent = TRUE 
-                WHERE appointment_id = ? AND reminder_type = '1h'
-            ''', (appointment_id,))
-            db.conn.commit()
+            await adb.mark_reminder_sent(appointment_id, '1h')
             return
         
         appointment_date = datetime.strptime(date, "%Y-%m-%d").date()
@@ -1632,24 +1552,14 @@ async def send_single_1h_reminder(context: ContextTypes.DEFAULT_TYPE):
         
         await context.bot.send_message(chat_id=user_id, text=text, parse_mode='Markdown')
         
-        cursor = db.execute_with_retry('''
-            UPDATE scheduled_reminders 
-            SET sent = TRUE 
-            WHERE appointment_id = ? AND reminder_type = '1h'
-        ''', (appointment_id,))
-        db.conn.commit()
+        await adb.mark_reminder_sent(appointment_id, '1h')
         
         logger.info(f"✅ 1h напоминание отправлено пользователю {user_id} для записи #{appointment_id}")
         
     except BadRequest as e:
         if "chat not found" in str(e).lower():
             logger.warning(f"⚠️ Chat not found for user {user_id}, skipping 1h reminder")
-            cursor = db.execute_with_retry('''
-                UPDATE scheduled_reminders 
-                SET sent = TRUE 
-                WHERE appointment_id = ? AND reminder_type = '1h'
-            ''', (appointment_id,))
-            db.conn.commit()
+            await adb.mark_reminder_sent(appointment_id, '1h')
         else:
             logger.error(f"❌ BadRequest при отправке 1h напоминания: {e}")
     except Exception as e:
@@ -1690,16 +1600,8 @@ async def debug_jobs(context: ContextTypes.DEFAULT_TYPE):
 async def restore_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE):
     """🎯 УЛУЧШЕННОЕ ВОССТАНОВЛЕНИЕ НАПОМИНАНИЙ ИЗ БД"""
     try:
-        cursor = db.execute_with_retry('''
-            SELECT sr.appointment_id, sr.reminder_type, sr.scheduled_time, a.user_id, a.appointment_date, a.appointment_time
-            FROM scheduled_reminders sr
-            JOIN appointments a ON sr.appointment_id = a.id
-            WHERE sr.sent = FALSE 
-            AND datetime(sr.scheduled_time) > datetime('now')
-            ORDER BY sr.scheduled_time
-        ''')
+        reminders = await adb.get_pending_reminders()
         
-        reminders = cursor.fetchall()
         logger.info(f"🔄 Восстановление {len(reminders)} напоминаний из БД")
         
         current_moscow = get_moscow_time()
@@ -1711,8 +1613,7 @@ async def restore_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE):
                 appointment_id, reminder_type, scheduled_time, user_id, appointment_date, appointment_time = reminder
                 
                 # 🎯 ПРОВЕРЯЕМ ЧТО ЗАПИСЬ ВСЕ ЕЩЕ СУЩЕСТВУЕТ
-                cursor_check = db.execute_with_retry('SELECT id FROM appointments WHERE id = ?', (appointment_id,))
-                if not cursor_check.fetchone():
+                if not await adb.get_appointment(appointment_id):
                     logger.warning(f"⚠️ Запись #{appointment_id} не найдена, пропускаем напоминание")
                     continue
                 
@@ -1766,12 +1667,7 @@ async def restore_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE):
                     logger.info(f"⏩ Пропущено восстановление {reminder_type} напоминания для #{appointment_id} (время прошло или слишком близко)")
                     skipped_count += 1
                     # Помечаем как отправленное, чтобы больше не восстанавливать
-                    cursor_update = db.execute_with_retry('''
-                        UPDATE scheduled_reminders 
-                        SET sent = TRUE 
-                        WHERE appointment_id = ? AND reminder_type = ?
-                    ''', (appointment_id, reminder_type))
-                    db.conn.commit()
+                    await adb.mark_reminder_sent(appointment_id, reminder_type)
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка при восстановлении напоминания для записи #{appointment_id}: {e}")
@@ -1793,27 +1689,17 @@ async def restore_missing_reminders(context: ContextTypes.DEFAULT_TYPE):
         current_moscow = get_moscow_time()
         
         # Находим записи без напоминаний в ближайшие 48 часов
-        cursor = db.execute_with_retry('''
-            SELECT a.id, a.user_id, a.appointment_date, a.appointment_time
-            FROM appointments a
-            WHERE a.appointment_date >= DATE('now')
-            AND a.appointment_date <= DATE('now', '+2 days')
-            AND NOT EXISTS (
-                SELECT 1 FROM scheduled_reminders sr 
-                WHERE sr.appointment_id = a.id AND sr.sent = FALSE
-            )
-            ORDER BY a.appointment_date, a.appointment_time
-        ''')
+        today_start = database.local_epoch_minutes(current_moscow.strftime("%Y-%m-%d"))
+        appointments_without_reminders = await adb.get_appointments_without_reminders(today_start, today_start + 3 * 24 * 60)
         
-        appointments_without_reminders = cursor.fetchall()
         restored_count = 0
         
         for appointment in appointments_without_reminders:
             appointment_id, user_id, date, time = appointment
             
             # Пропускаем записи администратора
-            cursor_user = db.execute_with_retry('SELECT user_name FROM appointments WHERE id = ?', (appointment_id,))
-            user_name = cursor_user.fetchone()[0] if cursor_user.fetchone() else ""
+            user_row = await adb.get_appointment(appointment_id)
+            user_name = user_row[0] if user_row else ""
             
             if user_name == "Администратор":
                 continue
@@ -1829,8 +1715,8 @@ async def restore_missing_reminders(context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"❌ Ошибка при восстановлении отсутствующих напоминаний: {e}")
 
-def cancel_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE, appointment_id: int):
-    """Удаляет запланированные напоминания для отмененной записи"""
+async def cancel_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE, appointment_id: int):
+    """Снимает задания напоминаний отмененной записи (строки в БД удаляет adb.cancel_appointment)"""
     try:
         job_queue = context.job_queue
         removed_count = 0
@@ -1854,16 +1740,6 @@ def cancel_scheduled_reminders(context: ContextTypes.DEFAULT_TYPE, appointment_i
             logger.info(f"✅ Удалено 1h напоминание для записи #{appointment_id}")
         else:
             logger.info(f"ℹ️ 1h напоминание не найдено для записи #{appointment_id}")
-            
-        # 🎯 ИСПРАВЛЕННЫЙ SQL-ЗАПРОС (убрал %s, заменил на ?)
-        cursor = db.conn.cursor()
-        cursor.execute('''
-            DELETE FROM scheduled_reminders 
-            WHERE appointment_id = ? AND sent = FALSE
-        ''', (appointment_id,))
-        db.conn.commit()
-        
-        logger.info(f"🎯 Удалено напоминаний из БД для записи #{appointment_id}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка при удалении напоминаний для записи #{appointment_id}: {e}")
@@ -1872,12 +1748,11 @@ async def show_admin_manual_appointments(update: Update, context: ContextTypes.D
     """Показывает записи, внесенные администратором вручную"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой функции")
         return
     
-    all_appointments = db.get_all_appointments()
-    manual_appointments = [appt for appt in all_appointments if appt[1] == "Администратор"]
+    manual_appointments, _ = await adb.get_manual_appointments()
     
     if not manual_appointments:
         keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
@@ -1929,7 +1804,7 @@ async def show_my_appointments(update: Update, context: ContextTypes.DEFAULT_TYP
     """Показывает записи текущего пользователя"""
     user_id = update.effective_user.id
     
-    appointments = db.get_user_appointments(user_id)
+    appointments = await adb.get_user_appointments(user_id)
     
     if not appointments:
         keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
@@ -1979,12 +1854,16 @@ async def show_my_appointments(update: Update, context: ContextTypes.DEFAULT_TYP
 async def show_cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает записи для отмены"""
     user_id = update.effective_user.id
+    is_admin = await adb.is_admin(user_id)
     
-    if db.is_admin(user_id):
-        all_appointments = db.get_all_appointments()
-        appointments = [appt for appt in all_appointments if appt[1] == "Администратор" or str(appt[0]) == str(user_id)]
+    if is_admin:
+        # 🎯 РУЧНЫЕ ЗАПИСИ И СОБСТВЕННЫЕ ЗАПИСИ АДМИНИСТРАТОРА - ДВА ИНДЕКСНЫХ ЗАПРОСА
+        manual_appointments, _ = await adb.get_manual_appointments()
+        own_appointments, _ = await adb.get_appointments_by_user(user_id)
+        appointments = list({appt[0]: appt for appt in manual_appointments + own_appointments}.values())
+        appointments.sort(key=lambda appt: (appt[5], appt[6]))
     else:
-        appointments = db.get_user_appointments(user_id)
+        appointments = await adb.get_user_appointments(user_id)
     
     if not appointments:
         keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
@@ -2007,7 +1886,7 @@ async def show_cancel_appointment(update: Update, context: ContextTypes.DEFAULT_
     keyboard = []
     
     for appt in appointments:
-        if db.is_admin(user_id):
+        if is_admin:
             appt_id, user_name, username, phone, service, date, time = appt
         else:
             appt_id, service, date, time = appt
@@ -2017,7 +1896,7 @@ async def show_cancel_appointment(update: Update, context: ContextTypes.DEFAULT_
         day_name = config.WEEKDAYS[weekday]
         display_date = selected_date_obj.strftime("%d.%m.%Y")
         
-        if db.is_admin(user_id):
+        if is_admin:
             button_text = f"❌ #{appt_id} - {day_name} {display_date} {time}"
             callback_data = f"cancel_admin_{appt_id}"
         else:
@@ -2040,11 +1919,11 @@ async def show_all_appointments(update: Update, context: ContextTypes.DEFAULT_TY
     """Показывает все записи с телефонами (администратор)"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой функции")
         return
     
-    appointments = db.get_all_appointments()
+    appointments = await adb.get_all_appointments()
     
     if not appointments:
         keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
@@ -2094,14 +1973,14 @@ async def show_today_appointments_visual(update: Update, context: ContextTypes.D
     try:
         user_id = update.effective_user.id
         
-        if not db.is_admin(user_id):
+        if not await adb.is_admin(user_id):
             if update.callback_query:
                 await update.callback_query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
             else:
                 await update.message.reply_text("❌ У вас нет доступа к этой функции")
             return
         
-        appointments = db.get_today_appointments()
+        appointments = await adb.get_today_appointments()
         
         moscow_time = get_moscow_time()
         today = moscow_time.date()
@@ -2109,7 +1988,7 @@ async def show_today_appointments_visual(update: Update, context: ContextTypes.D
         current_time = moscow_time.time()
         
         weekday = today.weekday()
-        work_schedule = db.get_work_schedule(weekday)
+        work_schedule = await adb.get_work_schedule(weekday)
         
         if not work_schedule or not work_schedule[0][4]:
             keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
@@ -2130,7 +2009,7 @@ async def show_today_appointments_visual(update: Update, context: ContextTypes.D
         
         start_time = work_schedule[0][2]
         end_time = work_schedule[0][3]
-        all_slots = db.generate_time_slots(start_time, end_time)
+        all_slots = adb.generate_time_slots(start_time, end_time)
         
         booked_slots = {}
         for user_name, phone, service, time in appointments:
@@ -2218,7 +2097,7 @@ async def show_week_appointments(update: Update, context: ContextTypes.DEFAULT_T
     """Показывает выбор дней недели для просмотра записей"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         if update.callback_query:
             await update.callback_query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         else:
@@ -2231,6 +2110,12 @@ async def show_week_appointments(update: Update, context: ContextTypes.DEFAULT_T
     
     days_shown = 0
     i = 0
+    # 🎯 ГРАФИК БЕРЕМ ОДИН РАЗ НА ВЕСЬ ЦИКЛ ПО ДНЯМ
+    schedule_snapshot = await adb.get_schedule_snapshot()
+    # 🎯 КОЛИЧЕСТВО ЗАПИСЕЙ ПО ВСЕМ ДНЯМ ОКНА - ОДНИМ ЗАПРОСОМ
+    appointment_counts = await adb.count_appointments_by_date(
+        today.strftime("%Y-%m-%d"), (today + timedelta(days=30)).strftime("%Y-%m-%d")
+    )
     
     while days_shown < 7 and i < 30:
         date = today + timedelta(days=i)
@@ -2239,13 +2124,13 @@ async def show_week_appointments(update: Update, context: ContextTypes.DEFAULT_T
         weekday = date.weekday()
         day_name = config.WEEKDAYS[weekday]
         
-        schedule = db.get_work_schedule(weekday)
+        schedule = schedule_snapshot.rows(weekday)
         if schedule and schedule[0][4]:
             start_time, end_time = schedule[0][2], schedule[0][3]
             
             if is_date_available_for_view(date, current_time, start_time, end_time, i):
-                appointments_count = get_appointments_count_for_date(date_str)
-                total_slots = len(db.generate_time_slots(start_time, end_time))
+                appointments_count = appointment_counts.get(date_str, 0)
+                total_slots = len(adb.generate_time_slots(start_time, end_time))
                 
                 keyboard.append([InlineKeyboardButton(
                     f"📅 {day_name} {display_date} ({appointments_count}/{total_slots})", 
@@ -2283,22 +2168,21 @@ async def show_day_appointments_visual(update: Update, context: ContextTypes.DEF
     try:
         user_id = update.effective_user.id
         
-        if not db.is_admin(user_id):
+        if not await adb.is_admin(user_id):
             if update.callback_query:
                 await update.callback_query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
             else:
                 await update.message.reply_text("❌ У вас нет доступа к этой функции")
             return
         
-        all_appointments = db.get_all_appointments()
-        day_appointments = [appt for appt in all_appointments if appt[5] == date_str]
+        day_appointments = await adb.get_appointments_by_date(date_str)
         
         date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
         weekday = date_obj.weekday()
         day_name = config.WEEKDAYS[weekday]
         display_date = date_obj.strftime("%d.%m.%Y")
         
-        work_schedule = db.get_work_schedule(weekday)
+        work_schedule = await adb.get_work_schedule(weekday)
         
         if not work_schedule or not work_schedule[0][4]:
             keyboard = [[InlineKeyboardButton("🔙 Назад к неделе", callback_data="week_appointments")]]
@@ -2319,7 +2203,7 @@ async def show_day_appointments_visual(update: Update, context: ContextTypes.DEF
         
         start_time = work_schedule[0][2]
         end_time = work_schedule[0][3]
-        all_slots = db.generate_time_slots(start_time, end_time)
+        all_slots = adb.generate_time_slots(start_time, end_time)
         
         booked_slots = {}
         for appt in day_appointments:
@@ -2401,12 +2285,11 @@ async def show_day_contacts(update: Update, context: ContextTypes.DEFAULT_TYPE,
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
-    all_appointments = db.get_all_appointments()
-    day_appointments = [appt for appt in all_appointments if appt[5] == date_str]
+    day_appointments = await adb.get_appointments_by_date(date_str)
     
     date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
     weekday = date_obj.weekday()
@@ -2456,28 +2339,16 @@ def is_date_available_for_view(date, current_time, start_time, end_time, days_ah
     
     return False
 
-def get_appointments_count_for_date(date_str):
-    """Получает количество записей на указанную дату"""
-    try:
-        all_appointments = db.get_all_appointments()
-        count = 0
-        for appt in all_appointments:
-            if appt[5] == date_str:
-                count += 1
-        return count
-    except:
-        return 0
-
 async def show_all_contacts_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает все контакты на сегодня с полными номерами"""
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
-    appointments = db.get_today_appointments()
+    appointments = await adb.get_today_appointments()
     today = get_moscow_time().date()
     today_str = today.strftime("%d.%m.%Y")
     
@@ -2511,7 +2382,7 @@ async def handle_schedule_actions(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
@@ -2543,7 +2414,7 @@ async def show_phone_number(update: Update, context: ContextTypes.DEFAULT_TYPE,
     query = update.callback_query
     today = get_moscow_time().date().strftime("%Y-%m-%d")
     
-    appointments = db.get_today_appointments()
+    appointments = await adb.get_today_appointments()
     target_appointment = None
     
     for user_name, phone, service, time in appointments:
@@ -2586,7 +2457,7 @@ async def cancel_slot_appointment(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     today = get_moscow_time().date().strftime("%Y-%m-%d")
     
-    appointments = db.get_today_appointments()
+    appointments = await adb.get_today_appointments()
     target_appointment = None
     
     for user_name, phone, service, time in appointments:
@@ -2641,7 +2512,7 @@ async def confirm_cancel_slot(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     cancel_data = context.user_data['cancel_slot_data']
     
-    appointments = db.get_all_appointments()
+    appointments = await adb.get_appointments_by_date(cancel_data['date'])
     appointment_id = None
     
     for appt in appointments:
@@ -2655,7 +2526,7 @@ async def confirm_cancel_slot(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.answer("❌ Запись не найдена", show_alert=True)
         return
     
-    appointment = db.cancel_appointment(appointment_id)
+    appointment = await adb.cancel_appointment(appointment_id)
     if appointment:
         await notify_client_about_cancellation(context, appointment)
         await notify_admin_about_cancellation(context, appointment, query.from_user.id, is_admin=True)
@@ -2732,11 +2603,11 @@ async def manage_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Управление графиком работы"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой функции")
         return
     
-    schedule = db.get_week_schedule()
+    schedule = await adb.get_week_schedule()
     
     text = "🗓️ *График работы*\n\n"
     
@@ -2770,7 +2641,7 @@ async def manage_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Управление администраторами"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         if update.callback_query:
             await update.callback_query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         else:
@@ -2809,12 +2680,12 @@ async def show_admin_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     logger.info(f"🔄 show_admin_list вызван для пользователя {user_id}")
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         logger.warning(f"❌ Пользователь {user_id} не администратор")
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
-    admins = db.get_all_admins()
+    admins = await adb.get_all_admins()
     logger.info(f"📊 Найдено администраторов в БД: {len(admins)}")
     
     if not admins:
@@ -2870,7 +2741,7 @@ async def add_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     logger.info(f"🔄 add_admin_start вызван пользователем {user_id}")
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         logger.warning(f"❌ Пользователь {user_id} не администратор")
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
@@ -2910,12 +2781,12 @@ async def remove_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     logger.info(f"🔄 remove_admin_start вызван пользователем {user_id}")
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         logger.warning(f"❌ Пользователь {user_id} не администратор")
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
-    admins = db.get_all_admins()
+    admins = await adb.get_all_admins()
     logger.info(f"📊 Найдено администраторов: {len(admins)}")
     
     if len(admins) <= 1:
@@ -2977,11 +2848,11 @@ async def remove_admin_confirm(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
-    admin_info = db.get_admin_info(admin_id)
+    admin_info = await adb.get_admin_info(admin_id)
     if not admin_info:
         await query.answer("❌ Администратор не найден", show_alert=True)
         return
@@ -3019,7 +2890,7 @@ async def remove_admin_final(update: Update, context: ContextTypes.DEFAULT_TYPE,
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
@@ -3032,16 +2903,11 @@ async def remove_admin_final(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await query.answer("❌ Нельзя удалить самого себя", show_alert=True)
         return
     
-    deleted = db.remove_admin(admin_id)
+    deleted = await adb.remove_admin(admin_id)
     
     if deleted:
         text = f"✅ Администратор с ID {admin_id} удален"
         logger.info(f"✅ Администратор {admin_id} удален пользователем {user_id}")
-        
-        # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ИЗМЕНЕНИЯ АДМИНИСТРАТОРОВ
-        backup_path = db.create_backup()
-        if backup_path:
-            logger.info(f"💾 Backup создан после удаления администратора {admin_id}")
     else:
         text = "❌ Администратор не найден"
     
@@ -3077,11 +2943,11 @@ async def handle_admin_id_input(update: Update, context: ContextTypes.DEFAULT_TY
         new_admin_id = int(text)
         logger.info(f"🔢 Преобразован ID: {new_admin_id}")
         
-        if db.is_admin(new_admin_id):
+        if await adb.is_admin(new_admin_id):
             logger.warning(f"⚠️ Пользователь {new_admin_id} уже администратор")
             await update.message.reply_text(
                 "❌ Этот пользователь уже является администратором",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
         
@@ -3102,7 +2968,7 @@ async def handle_admin_id_input(update: Update, context: ContextTypes.DEFAULT_TY
         
         logger.info(f"➕ Добавляем администратора {new_admin_id} в БД")
         
-        success = db.add_admin(new_admin_id, username, first_name, last_name, user_id)
+        success = await adb.add_admin(new_admin_id, username, first_name, last_name, user_id)
         
         if success:
             display_name = f"{first_name} {last_name}".strip()
@@ -3111,11 +2977,6 @@ async def handle_admin_id_input(update: Update, context: ContextTypes.DEFAULT_TY
             
             logger.info(f"✅ Администратор {new_admin_id} успешно добавлен")
             
-            # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ДОБАВЛЕНИЯ АДМИНИСТРАТОРА
-            backup_path = db.create_backup()
-            if backup_path:
-                logger.info(f"💾 Backup создан после добавления администратора {new_admin_id}")
-            
             await update.message.reply_text(
                 f"✅ *Новый администратор добавлен!*\n\n"
                 f"👤 *Имя:* {display_name}\n"
@@ -3123,26 +2984,26 @@ async def handle_admin_id_input(update: Update, context: ContextTypes.DEFAULT_TY
                 f"Пользователь получил доступ к админ-панели.\n\n"
                 f"*Примечание:* Пользователь должен начать диалог с ботом (@{context.bot.username}), чтобы бот мог отправлять ему уведомления.",
                 parse_mode='Markdown',
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
         else:
             logger.error(f"❌ Ошибка при добавлении администратора {new_admin_id} в БД")
             await update.message.reply_text(
                 "❌ Ошибка при добавлении администратора в базу данных. Попробуйте еще раз.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
         
     except ValueError:
         logger.error(f"❌ Неверный формат ID: '{text}'")
         await update.message.reply_text(
             "❌ Неверный формат ID. Введите числовой ID пользователя:",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
     except Exception as e:
         logger.error(f"❌ Общая ошибка при добавлении администратора: {e}")
         await update.message.reply_text(
             "❌ Ошибка при добавлении администратора. Проверьте правильность ID и попробуйте еще раз.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 async def schedule_day_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3151,7 +3012,7 @@ async def schedule_day_selected(update: Update, context: ContextTypes.DEFAULT_TY
     weekday = int(query.data.split("_")[2])
     context.user_data['schedule_weekday'] = weekday
     
-    current_schedule = db.get_work_schedule(weekday)
+    current_schedule = await adb.get_work_schedule(weekday)
     day_name = config.WEEKDAYS[weekday]
     
     keyboard = [
@@ -3260,7 +3121,7 @@ async def schedule_end_selected(update: Update, context: ContextTypes.DEFAULT_TY
     weekday = context.user_data['schedule_weekday']
     day_name = config.WEEKDAYS[weekday]
     
-    conflicting_appointments = db.get_conflicting_appointments(weekday, start_time, end_time, True)
+    conflicting_appointments = await adb.get_conflicting_appointments(weekday, start_time, end_time, True)
     
     if conflicting_appointments:
         context.user_data['pending_schedule'] = {
@@ -3274,12 +3135,7 @@ async def schedule_end_selected(update: Update, context: ContextTypes.DEFAULT_TY
         await show_schedule_conflict_warning(update, context, conflicting_appointments, day_name)
         return
     
-    db.set_work_schedule(weekday, start_time, end_time, True)
-    
-    # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ИЗМЕНЕНИЯ ГРАФИКА РАБОТЫ
-    backup_path = db.create_backup()
-    if backup_path:
-        logger.info(f"💾 Backup создан после установки графика для {day_name}")
+    await adb.set_work_schedule(weekday, start_time, end_time, True)
     
     keyboard = [[InlineKeyboardButton("🔙 Назад к графику", callback_data="manage_schedule")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -3302,7 +3158,7 @@ async def schedule_off_selected(update: Update, context: ContextTypes.DEFAULT_TY
     weekday = int(query.data.split("_")[2])
     day_name = config.WEEKDAYS[weekday]
     
-    conflicting_appointments = db.get_conflicting_appointments(weekday, "10:00", "20:00", False)
+    conflicting_appointments = await adb.get_conflicting_appointments(weekday, "10:00", "20:00", False)
     
     if conflicting_appointments:
         context.user_data['pending_schedule'] = {
@@ -3316,12 +3172,7 @@ async def schedule_off_selected(update: Update, context: ContextTypes.DEFAULT_TY
         await show_schedule_conflict_warning(update, context, conflicting_appointments, day_name)
         return
     
-    db.set_work_schedule(weekday, "10:00", "20:00", False)
-    
-    # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ИЗМЕНЕНИЯ ГРАФИКА РАБОТЫ
-    backup_path = db.create_backup()
-    if backup_path:
-        logger.info(f"💾 Backup создан после установки выходного для {day_name}")
+    await adb.set_work_schedule(weekday, "10:00", "20:00", False)
     
     keyboard = [[InlineKeyboardButton("🔙 Назад к графику", callback_data="manage_schedule")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -3398,9 +3249,9 @@ async def handle_schedule_cancel_appointments(update: Update, context: ContextTy
     
     appointment_ids = [appt[0] for appt in conflicting_appointments]
     
-    canceled_appointments = db.cancel_appointments_by_ids(appointment_ids)
+    canceled_appointments = await adb.cancel_appointments_by_ids(appointment_ids)
     
-    db.set_work_schedule(
+    await adb.set_work_schedule(
         pending_schedule['weekday'],
         pending_schedule['start_time'],
         pending_schedule['end_time'],
@@ -3419,11 +3270,6 @@ async def handle_schedule_cancel_appointments(update: Update, context: ContextTy
     else:
         schedule_info = "выходной"
     
-    # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ИЗМЕНЕНИЯ ГРАФИКА РАБОТЫ
-    backup_path = db.create_backup()
-    if backup_path:
-        logger.info(f"💾 Backup создан после изменения графика работы для {day_name}")
-    
     keyboard = [[InlineKeyboardButton("🔙 Назад к графику", callback_data="manage_schedule")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -3513,7 +3359,7 @@ async def notify_clients_about_schedule_change(context: ContextTypes.DEFAULT_TYP
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для остановки бота (только для администраторов)"""
     user_id = update.effective_user.id
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет прав для этой команды")
         return
     
@@ -3550,7 +3396,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_main_menu(update, context)
     elif query.data == "make_appointment":
         user_id = query.from_user.id
-        is_admin = db.is_admin(user_id)
+        is_admin = await adb.is_admin(user_id)
         await make_appointment_start(update, context, is_admin=is_admin)
     
     # АДМИН-ПАНЕЛЬ
@@ -3663,10 +3509,10 @@ async def cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE,
     is_admin_cancel = query.data.startswith("cancel_admin_")
     
     if is_admin_cancel:
-        if db.is_admin(user_id):
-            cancel_scheduled_reminders(context, appointment_id)
+        if await adb.is_admin(user_id):
+            await cancel_scheduled_reminders(context, appointment_id)
             
-            appointment = db.cancel_appointment(appointment_id)
+            appointment = await adb.cancel_appointment(appointment_id)
             if appointment:
                 try:
                     await query.edit_message_text(f"✅ Запись #{appointment_id} отменена администратором")
@@ -3677,11 +3523,6 @@ async def cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE,
                         raise
                 await notify_client_about_cancellation(context, appointment)
                 await notify_admin_about_cancellation(context, appointment, user_id, is_admin=True)
-                
-                # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ОТМЕНЫ ЗАПИСИ
-                backup_path = db.create_backup()
-                if backup_path:
-                    logger.info(f"💾 Backup создан после отмены записи #{appointment_id}")
             else:
                 try:
                     await query.edit_message_text("❌ Запись не найдена")
@@ -3693,9 +3534,9 @@ async def cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE,
         else:
             await query.answer("У вас нет прав для отмены этой записи", show_alert=True)
     else:
-        cancel_scheduled_reminders(context, appointment_id)
+        await cancel_scheduled_reminders(context, appointment_id)
         
-        appointment = db.cancel_appointment(appointment_id, user_id)
+        appointment = await adb.cancel_appointment(appointment_id, user_id)
         if appointment:
             try:
                 await query.edit_message_text(f"✅ Ваша запись #{appointment_id} отменена")
@@ -3705,11 +3546,6 @@ async def cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 else:
                     raise
             await notify_admin_about_cancellation(context, appointment, user_id, is_admin=False)
-            
-            # 🎯 СОЗДАЕМ BACKUP ПОСЛЕ ОТМЕНЫ ЗАПИСИ
-            backup_path = db.create_backup()
-            if backup_path:
-                logger.info(f"💾 Backup создан после отмены записи #{appointment_id}")
         else:
             await query.answer("Запись не найдена или у вас нет прав для её отмены", show_alert=True)
 
@@ -3776,7 +3612,7 @@ async def notify_admin_about_cancellation(context: ContextTypes.DEFAULT_TYPE, ap
             f"⏰ Время: {time}"
         )
     
-    notification_chats = db.get_notification_chats()
+    notification_chats = await adb.get_notification_chats()
     for chat_id in notification_chats:
         try:
             await context.bot.send_message(
@@ -3795,7 +3631,7 @@ async def notify_admin_about_cancellation(context: ContextTypes.DEFAULT_TYPE, ap
 
 async def send_new_appointment_notification(context: ContextTypes.DEFAULT_TYPE, user_name, user_username, phone, service, date, time, appointment_id, is_manual=False):
     """Отправляет уведомление о новой записи с номером телефона"""
-    notification_chats = db.get_notification_chats()
+    notification_chats = await adb.get_notification_chats()
     
     if not notification_chats:
         logger.info("Нет настроенных чатов для уведомлений")
@@ -3829,40 +3665,9 @@ async def send_new_appointment_notification(context: ContextTypes.DEFAULT_TYPE,
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления в чат {chat_id}: {e}")
 
-async def check_duplicate_appointments(context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет и уведомляет о дублирующихся записях"""
-    try:
-        duplicates = db.check_duplicate_appointments()
-        
-        if duplicates:
-            for date, time, count in duplicates:
-                appointments = db.get_appointments_by_datetime(date, time)
-                
-                selected_date_obj = datetime.strptime(date, "%Y-%m-%d").date()
-                weekday = selected_date_obj.weekday()
-                day_name = config.WEEKDAYS[weekday]
-                display_date = selected_date_obj.strftime("%d.%m.%Y")
-                
-                text = (
-                    f"⚠️ *ВНИМАНИЕ: Обнаружены дублирующиеся записи!*\n\n"
-                    f"📅 Дата: {day_name} {display_date}\n"
-                    f"⏰ Время: {time}\n"
-                    f"👥 Количество записей: {count}\n\n"
-                    f"*Список клиентов:*\n"
-                )
-                
-                for appt_id, user_name, phone, service in appointments:
-                    text += f"• {user_name} ({phone}) - {service} (#{appt_id})\n"
-                
-                text += f"\n*Рекомендуется связаться с клиентами и перенести записи*"
-                
-                await send_admin_notification(context, text)
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке дублирующихся записей: {e}")
-
 async def send_admin_notification(context: ContextTypes.DEFAULT_TYPE, text):
     """Отправляет уведомление всем администраторам"""
-    notification_chats = db.get_notification_chats()
+    notification_chats = await adb.get_notification_chats()
     
     for chat_id in notification_chats:
         try:
@@ -3911,13 +3716,13 @@ def normalize_phone(phone):
 async def send_daily_schedule(context: ContextTypes.DEFAULT_TYPE):
     """Отправка ежедневного расписания администраторам"""
     try:
-        cleanup_result = db.cleanup_completed_appointments()
+        cleanup_result = await adb.cleanup_completed_appointments()
         
         if cleanup_result['total_deleted'] > 0:
             logger.info(f"Автоочистка перед расписанием: удалено {cleanup_result['total_deleted']} записей")
         
-        appointments = db.get_today_appointments()
-        notification_chats = db.get_notification_chats()
+        appointments = await adb.get_today_appointments()
+        notification_chats = await adb.get_notification_chats()
         
         if not notification_chats:
             logger.info("Нет настроенных чатов для ежедневного расписания")
@@ -3949,31 +3754,14 @@ async def send_daily_schedule(context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"❌ Ошибка при подготовке ежедневного расписания: {e}")
 
-async def check_duplicates_daily(context: ContextTypes.DEFAULT_TYPE):
-    """Ежедневная проверка дублирующихся записей"""
-    try:
-        cleanup_result = db.cleanup_completed_appointments()
-        
-        if cleanup_result['total_deleted'] > 0:
-            logger.info(f"Автоочистка перед проверкой дубликатов: удалено {cleanup_result['total_deleted']} записей")
-        
-        await check_duplicate_appointments(context)
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке дубликатов: {e}")
-
 async def cleanup_completed_appointments_daily(context: ContextTypes.DEFAULT_TYPE):
-    """Удаляет записи старше 7 дней в 00:00 MSK"""
+    """Переносит в архив записи старше 7 дней в 00:00 MSK"""
     try:
-        seven_days_ago = (get_moscow_time() - timedelta(days=7)).strftime("%Y-%m-%d")
-        
-        cursor = db.execute_with_retry('DELETE FROM appointments WHERE appointment_date < ?', (seven_days_ago,))
-        deleted_appointments = cursor.rowcount
+        seven_days_ago = database.local_epoch_minutes((get_moscow_time() - timedelta(days=7)).strftime("%Y-%m-%d"))
         
-        db.execute_with_retry('DELETE FROM schedule WHERE date < ?', (seven_days_ago,))
+        deleted_appointments = await adb.archive_appointments(seven_days_ago)
         
-        db.conn.commit()
-        
-        logger.info(f"✅ Ежедневная очистка: удалено {deleted_appointments} записей старше 7 дней")
+        logger.info(f"✅ Ежедневная очистка: в архив перенесено {deleted_appointments} записей старше 7 дней")
         
     except Exception as e:
         logger.error(f"❌ Ошибка при ежедневной очистке: {e}")
@@ -3982,7 +3770,7 @@ async def cleanup_old_data(context: ContextTypes.DEFAULT_TYPE):
     """🎯 УЛУЧШЕННАЯ ОЧИСТКА ДЛЯ RENDER"""
     try:
         # Используем улучшенную функцию из БД
-        cleanup_result = db.automatic_cleanup()  # 🎯 ИСПОЛЬЗУЕМ НОВУЮ ФУНКЦИЮ
+        cleanup_result = await adb.automatic_cleanup()  # 🎯 ИСПОЛЬЗУЕМ НОВУЮ ФУНКЦИЮ
         
         logger.info(f"✅ Очистка БД: удалено {cleanup_result['total_deleted']} записей")
         
@@ -3992,7 +3780,7 @@ async def cleanup_old_data(context: ContextTypes.DEFAULT_TYPE):
 async def cleanup_duplicate_reminders(context: ContextTypes.DEFAULT_TYPE):
     """Очищает дублирующиеся напоминания"""
     try:
-        cursor = db.execute_with_retry('''
+        deleted_count = await adb.execute('''
             DELETE FROM scheduled_reminders 
             WHERE id NOT IN (
                 SELECT MIN(id) 
@@ -4000,8 +3788,6 @@ async def cleanup_duplicate_reminders(context: ContextTypes.DEFAULT_TYPE):
                 GROUP BY appointment_id, reminder_type, sent
             )
         ''')
-        deleted_count = cursor.rowcount
-        db.conn.commit()
         
         if deleted_count > 0:
             logger.info(f"🧹 Очищено {deleted_count} дублирующихся напоминаний")
@@ -4013,12 +3799,7 @@ async def cleanup_old_reminders(context: ContextTypes.DEFAULT_TYPE):
     """Очищает старые отправленные напоминания"""
     try:
         seven_days_ago = (get_moscow_time() - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
-        cursor = db.execute_with_retry('''
-            DELETE FROM scheduled_reminders 
-            WHERE sent = TRUE AND scheduled_time < ?
-        ''', (seven_days_ago,))
-        deleted_count = cursor.rowcount
-        db.conn.commit()
+        deleted_count = await adb.delete_old_sent_reminders(seven_days_ago)
         
         if deleted_count > 0:
             logger.info(f"✅ Очищено {deleted_count} старых напоминаний")
@@ -4051,29 +3832,13 @@ async def debug_timezones(context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"❌ Ошибка в debug_timezones: {e}")
 
-async def optimize_database(context: ContextTypes.DEFAULT_TYPE):
-    """Регулярная оптимизация SQLite базы"""
-    try:
-        # ПЕРЕД каждой операцией проверяем соединение
-        db.check_connection()
-        cursor = db.execute_with_retry('PRAGMA optimize')
-        db.conn.commit()
-        logger.info("✅ База данных оптимизирована")
-    except Exception as e:
-        logger.error(f"❌ Ошибка оптимизации БД: {e}")
-        # Пытаемся восстановить соединение
-        try:
-            db.reconnect()
-        except:
-            pass
-
 async def backup_database(context: ContextTypes.DEFAULT_TYPE):
     """🎯 РУЧНОЕ РЕЗЕРВНОЕ КОПИРОВАНИЕ (только по команде администратора)"""
     try:
         logger.info("💾 Запуск ручного backup по команде администратора...")
         
         # Создаем backup через database.py
-        backup_path = db.create_backup()
+        backup_path = await adb.create_backup()
         
         if backup_path:
             logger.info(f"✅ Ручной backup создан: {backup_path}")
@@ -4112,100 +3877,6 @@ async def backup_database(context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"❌ Ошибка при создании ручного backup: {e}")
 
-async def check_database_size(context: ContextTypes.DEFAULT_TYPE):
-    """🎯 УЛУЧШЕННАЯ ПРОВЕРКА РАЗМЕРА БД ДЛЯ RENDER"""
-    try:
-        # Получаем правильный путь к БД
-        db_path = get_database_path()  # 🎯 ИСПОЛЬЗУЕМ ФУНКЦИЮ ИЗ database.py
-        
-        # Проверяем существование файла
-        if not os.path.exists(db_path):
-            logger.error(f"❌ Файл БД не найден: {db_path}")
-            # Пытаемся пересоздать таблицы
-            try:
-                db.create_tables()
-                logger.info("✅ Таблицы БД пересозданы")
-            except Exception as e:
-                logger.error(f"❌ Ошибка пересоздания таблиц: {e}")
-            return
-        
-        # Проверяем размер
-        size = os.path.getsize(db_path) / (1024 * 1024)  # Размер в MB
-        logger.info(f"📊 Размер базы данных: {size:.2f} MB")
-        
-        # Проверяем целостность БД
-        try:
-            cursor = db.execute_with_retry('PRAGMA integrity_check')
-            integrity = cursor.fetchone()[0]
-            if integrity == 'ok':
-                logger.info("✅ Целостность БД: OK")
-            else:
-                logger.error(f"❌ Проблемы с целостностью БД: {integrity}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка проверки целостности: {e}")
-        
-        # 🎯 АВТОМАТИЧЕСКАЯ ОЧИСТКА ЕСЛИ БД СЛИШКОМ БОЛЬШАЯ
-        if size > 5:  # 5MB лимит для бесплатного Render
-            try:
-                cleanup_result = db.automatic_cleanup()  # 🎯 ИСПОЛЬЗУЕМ НОВУЮ ФУНКЦИЮ
-                logger.info(f"🧹 Автоочистка: удалено {cleanup_result['total_deleted']} записей")
-                
-                if cleanup_result['total_deleted'] > 0:
-                    # Проверяем размер после очистки
-                    new_size = os.path.getsize(db_path) / (1024 * 1024)
-                    logger.info(f"📊 Размер БД после очистки: {new_size:.2f} MB")
-                    
-            except Exception as e:
-                logger.error(f"❌ Ошибка автоочистки: {e}")
-        
-        # Предупреждение если больше 3MB
-        if size > 3:
-            text = f"⚠️ *Размер БД:* {size:.2f} MB\n*Рекомендация:* Автоматическая очистка выполнена"
-            notification_chats = db.get_notification_chats()
-            for chat_id in notification_chats:
-                try:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=text,
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления: {e}")
-            
-    except Exception as e:
-        logger.error(f"❌ Ошибка проверки БД: {e}")
-
-async def keep_database_alive(context: ContextTypes.DEFAULT_TYPE):
-    """Поддерживает соединение с БД активным на Render"""
-    try:
-        # Простой запрос чтобы БД не "засыпала"
-        cursor = db.execute_with_retry('SELECT 1')
-        logger.debug("✅ Соединение с БД активно")
-    except Exception as e:
-        logger.warning(f"⚠️ Проблема с соединением БД, переподключаемся: {e}")
-        try:
-            db.reconnect()
-            logger.info("✅ Переподключение к БД успешно")
-        except Exception as reconnect_error:
-            logger.error(f"❌ Критическая ошибка переподключения: {reconnect_error}")
-
-async def prevent_sleep_mode(context: ContextTypes.DEFAULT_TYPE):
-    """🎯 ПРЕДОТВРАЩЕНИЕ РЕЖИМА СНА RENDER"""
-    try:
-        # Простая операция для поддержания активности
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments WHERE appointment_date >= DATE("now")')
-        future_appointments = cursor.fetchone()[0]
-        
-        logger.debug(f"🔧 Keep-alive: {future_appointments} будущих записей")
-        
-    except Exception as e:
-        logger.warning(f"⚠️ Keep-alive операция провалилась: {e}")
-        try:
-            db.reconnect()
-            logger.info("✅ Переподключение к БД после keep-alive ошибки")
-        except Exception as reconnect_error:
-            logger.error(f"❌ Критическая ошибка переподключения: {reconnect_error}")
-
 async def scheduled_restart(context: ContextTypes.DEFAULT_TYPE):
     """🎯 АВТОМАТИЧЕСКИЙ ПЕРЕЗАПУСК ДЛЯ RENDER (каждые 80 дней)"""
     try:
@@ -4213,7 +3884,7 @@ async def scheduled_restart(context: ContextTypes.DEFAULT_TYPE):
         
         # Отправляем уведомление администраторам
         text = "🔄 *Плановый перезапуск бота*\n\nБот будет автоматически перезапущен для поддержания стабильной работы."
-        notification_chats = db.get_notification_chats()
+        notification_chats = await adb.get_notification_chats()
         for chat_id in notification_chats:
             try:
                 await context.bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
@@ -4234,7 +3905,7 @@ async def debug_backup_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """🎯 ДИАГНОСТИЧЕСКАЯ КОМАНДА ДЛЯ ПРОВЕРКИ ФАЙЛОВ BACKUP"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой команде")
         return
     
@@ -4243,7 +3914,7 @@ async def debug_backup_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
     text = "🔍 *Диагностика файлов backup:*\n\n"
     
     # Проверяем основной файл БД
-    db_path = '/tmp/barbershop.db'
+    db_path = get_database_path()
     if os.path.exists(db_path):
         size = os.path.getsize(db_path)
         text += f"📁 *Основная БД:* {db_path}\n"
@@ -4256,8 +3927,7 @@ async def debug_backup_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Проверяем backup файлы
     backup_files = []
     patterns = [
-        "/tmp/barbershop_latest_backup.db",
-        "/tmp/barbershop_latest_backup.db.*", 
+        os.path.join(config.BACKUP_DIR, "*.db.gz"),
         "/tmp/barbershop_backup_*.db",
         "/tmp/*.db"  # Все файлы .db в /tmp/
     ]
@@ -4282,7 +3952,7 @@ async def debug_backup_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
         text += "❌ *Backup файлы не найдены!*\n\n"
     
     # Проверяем через функцию из БД
-    db_backup_files = db.get_backup_files_info()
+    db_backup_files = await adb.get_backup_files_info()
     text += f"📊 *Через db.get_backup_files_info():* {len(db_backup_files)} файлов\n"
     
     await update.message.reply_text(text, parse_mode='Markdown')
@@ -4291,18 +3961,16 @@ async def check_real_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """🎯 ПРОВЕРКА РЕАЛЬНЫХ ДАННЫХ В БД"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой команде")
         return
     
     try:
         # Проверяем таблицу appointments
-        cursor = db.execute_with_retry('SELECT id, user_name, phone, service, appointment_date, appointment_time FROM appointments')
-        all_appointments = cursor.fetchall()
+        all_appointments = await adb.fetchall('SELECT id, user_name, phone, service, appointment_date, appointment_time FROM appointments')
         
         # Проверяем таблицу bot_users
-        cursor = db.execute_with_retry('SELECT user_id, username, first_name, last_name FROM bot_users')
-        all_users = cursor.fetchall()
+        all_users = await adb.fetchall('SELECT user_id, username, first_name, last_name FROM bot_users')
         
         text = f"🔍 *РЕАЛЬНЫЕ ДАННЫЕ В БД:*\n\n"
         
@@ -4323,12 +3991,12 @@ async def check_real_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text += "❌ Нет пользователей\n"
         
         # Проверяем файлы
-        db_path = '/tmp/barbershop.db'
-        backup_path = '/tmp/barbershop_latest_backup.db'
+        db_path = get_database_path()
+        backup_files = await adb.get_backup_files_info()
         
         text += f"\n📁 *Файлы:*\n"
         text += f"• Основная БД: {os.path.exists(db_path)} ({os.path.getsize(db_path) if os.path.exists(db_path) else 0} bytes)\n"
-        text += f"• Backup БД: {os.path.exists(backup_path)} ({os.path.getsize(backup_path) if os.path.exists(backup_path) else 0} bytes)\n"
+        text += f"• Backup: {len(backup_files)} поколений ({backup_files[0]['size_kb'] if backup_files else 0} KB последнее)\n"
         
         await update.message.reply_text(text, parse_mode='Markdown')
         
@@ -4339,7 +4007,7 @@ async def check_real_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def debug_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Диагностика статуса бота"""
     user_id = update.effective_user.id
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой команде")
         return
         
@@ -4347,14 +4015,12 @@ async def debug_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверка БД
     try:
-        cursor = db.execute_with_retry('SELECT 1')
+        await adb.fetchone('SELECT 1')
         text += "✅ База данных: Активна\n"
         
         # Статистика БД
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-        appointments_count = cursor.fetchone()[0]
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM bot_users') 
-        users_count = cursor.fetchone()[0]
+        appointments_count = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+        users_count = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
         
         text += f"📊 Записей в БД: {appointments_count}\n"
         text += f"👥 Пользователей: {users_count}\n"
@@ -4362,8 +4028,8 @@ async def debug_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text += f"❌ База данных: Ошибка - {e}\n"
     
     # Проверка файлов
-    db_path = '/tmp/barbershop.db'
-    backup_path = '/tmp/barbershop_latest_backup.db'
+    db_path = get_database_path()
+    backup_files = await adb.get_backup_files_info()
     
     text += f"\n📁 *Файлы:*\n"
     text += f"• Основная БД: {'✅ Существует' if os.path.exists(db_path) else '❌ Отсутствует'}\n"
@@ -4371,14 +4037,12 @@ async def debug_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         size = os.path.getsize(db_path)
         text += f"  Размер: {size} bytes ({size/1024/1024:.2f} MB)\n"
     
-    text += f"• Backup БД: {'✅ Существует' if os.path.exists(backup_path) else '❌ Отсутствует'}\n"
-    if os.path.exists(backup_path):
-        size = os.path.getsize(backup_path)
-        text += f"  Размер: {size} bytes ({size/1024/1024:.2f} MB)\n"
+    text += f"• Backup: {'✅ Существует' if backup_files else '❌ Отсутствует'}\n"
+    if backup_files:
+        text += f"  Последний: {backup_files[0]['size_kb']} KB ({backup_files[0]['date']})\n"
     
     # Статус backup
-    backup_files = db.get_backup_files_info()
-    text += f"\n💾 Backup файлов: {len(backup_files)}\n"
+    text += f"\n💾 Поколений backup: {len(backup_files)}\n"
     
     # Время работы
     if context.application.bot_data.get('start_time'):
@@ -4390,36 +4054,79 @@ async def debug_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(text, parse_mode='Markdown')
 
+async def show_query_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """🎯 КОМАНДА /db_top [N] [calls|max_ms|lock_wait_ms]: САМЫЕ ДОРОГИЕ ЗАПРОСЫ К БД"""
+    user_id = update.effective_user.id
+    if not await adb.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа к этой команде")
+        return
+    
+    limit = config.QUERY_STATS_TOP
+    order_by = 'total_ms'
+    for arg in context.args or []:
+        if arg.isdigit():
+            limit = max(1, min(int(arg), 50))
+        elif arg in ('total_ms', 'calls', 'max_ms', 'lock_wait_ms'):
+            order_by = arg
+    
+    stats = await adb.get_query_stats(limit, order_by)
+    if not stats:
+        await update.message.reply_text("📊 Статистика запросов пока пуста")
+        return
+    
+    retry_stats = await adb.get_retry_stats()
+    buckets = '/'.join(str(bound) for bound in database.QueryStats.BUCKETS_MS)
+    lines = [f"📊 Топ-{len(stats)} запросов ({order_by}):",
+             f"🔒 Блокировок {retry_stats['contention']}, повторов {retry_stats['retries']}, "
+             f"отказов {retry_stats['gave_up']} (в event loop {retry_stats['refused_in_loop']}), "
+             f"пауз {retry_stats['backoff_ms']:.0f} ms", ""]
+    for number, item in enumerate(stats, 1):
+        lines.append(f"{number}. вызовов {item['calls']}, всего {item['total_ms']:.0f} ms, "
+                     f"ср. {item['avg_ms']:.1f} ms, макс. {item['max_ms']:.1f} ms")
+        lines.append(f"   строк {item['rows']}, повторов {item['retries']}, "
+                     f"ожидание блокировок {item['lock_wait_ms']:.0f} ms, медленных {item['slow']}, ошибок {item['errors']}")
+        lines.append(f"   ≤{buckets}/больше ms: {'/'.join(str(count) for count in item['histogram'])}")
+        lines.append(f"   {item['fingerprint'][:300]}")
+        lines.append("")
+    
+    # Без Markdown: в SQL встречаются * и _
+    await update.message.reply_text("\n".join(lines)[:4000])
+
 async def force_restore_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """🎯 ПРИНУДИТЕЛЬНОЕ ВОССТАНОВЛЕНИЕ ИЗ BACKUP"""
     user_id = update.effective_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await update.message.reply_text("❌ У вас нет доступа к этой команде")
         return
     
-    await update.message.reply_text("🔄 Запускаю принудительное восстановление из backup...")
+    # 🎯 /restore N - ВОССТАНОВЛЕНИЕ N-ГО ПОКОЛЕНИЯ (1 - ПОСЛЕДНЕЕ)
+    backup_path = None
+    if context.args:
+        backup_files = await adb.get_backup_files_info()
+        number = context.args[0]
+        # Отрицательный индекс списка взял бы поколение с конца - проверяем диапазон явно
+        if not number.isdigit() or not 1 <= int(number) <= len(backup_files):
+            if backup_files:
+                usage = f"❌ Использование: /restore N, где N - номер поколения от 1 до {len(backup_files)} (1 - последнее)"
+            else:
+                usage = "❌ Поколений backup нет - восстанавливать нечего"
+            await update.message.reply_text(usage)
+            return
+        backup_path = backup_files[int(number) - 1]['path']
     
-    # Закрываем текущее соединение
-    if db.conn:
-        try:
-            db.conn.close()
-        except:
-            pass
-        db.conn = None
+    await update.message.reply_text("🔄 Запускаю принудительное восстановление из backup...")
     
-    # Выполняем восстановление
-    success = db.restore_from_backup()
+    # Выполняем восстановление (соединение закрывается внутри restore_from_backup)
+    success = await adb.restore_from_backup(backup_path)
     
     if success:
         await update.message.reply_text("✅ Восстановление из backup завершено успешно!")
         
         # Показываем восстановленные данные
         try:
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            appointments_count = cursor.fetchone()[0]
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            users_count = cursor.fetchone()[0]
+            appointments_count = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+            users_count = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
             
             await update.message.reply_text(
                 f"📊 *Восстановленные данные:*\n"
@@ -4444,7 +4151,7 @@ async def confirm_restore_backup(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
@@ -4475,33 +4182,23 @@ async def execute_restore_backup(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await adb.is_admin(user_id):
         await query.answer("❌ У вас нет доступа к этой функции", show_alert=True)
         return
     
     await query.edit_message_text("🔄 Выполняю восстановление из backup...")
     
-    # Закрываем текущее соединение
-    if db.conn:
-        try:
-            db.conn.close()
-        except:
-            pass
-        db.conn = None
-    
-    # Выполняем восстановление
-    success = db.restore_from_backup()
+    # Выполняем восстановление (соединение закрывается внутри restore_from_backup)
+    success = await adb.restore_from_backup()
     
     if success:
         # Переподключаемся к БД
-        db.reconnect()
+        await adb.reconnect()
         
         # Показываем восстановленные данные
         try:
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            appointments_count = cursor.fetchone()[0]
-            cursor = db.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            users_count = cursor.fetchone()[0]
+            appointments_count = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+            users_count = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
             
             # 🎯 ИСПРАВЛЕНИЕ: Убираем проблемные символы Markdown
             text = (
@@ -4535,6 +4232,14 @@ async def execute_restore_backup(update: Update, context: ContextTypes.DEFAULT_T
         # Если ошибка форматирования, отправляем без Markdown
         await query.edit_message_text(text, reply_markup=reply_markup)
 
+async def close_async_database(application: Application):
+    """Закрывает асинхронный слой БД при остановке приложения"""
+    try:
+        await adb.close()
+        logger.info("✅ Асинхронное соединение с БД закрыто")
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка закрытия асинхронного соединения с БД: {e}")
+
 def setup_job_queue(application: Application):
     job_queue = application.job_queue
 
@@ -4553,14 +4258,6 @@ def setup_job_queue(application: Application):
         name="scheduled_restart"
     )
     
-    # 🎯 ПРЕДОТВРАЩЕНИЕ СНА - КАЖДЫЕ 10 МИНУТ
-    job_queue.run_repeating(
-        prevent_sleep_mode, 
-        interval=600, 
-        first=60, 
-        name="prevent_sleep"
-    )
-
     # 🎯 МОНИТОРИНГ ПАМЯТИ КАЖДЫЕ 30 МИНУТ
     job_queue.run_repeating(
         check_memory_usage,
@@ -4575,16 +4272,14 @@ def setup_job_queue(application: Application):
         name="restore_reminders"
     )
     
-    job_queue.run_repeating(optimize_database, interval=3600, first=60, name="optimize_db")
+    # 🎯 ОБСЛУЖИВАНИЕ И ПРОВЕРКУ СОЕДИНЕНИЯ БД ВЕДЕТ database.ConnectionSupervisor
+    # ПО ИСХОДАМ ЗАПРОСОВ - ТАЙМЕРНЫЕ KEEP-ALIVE ЗАДАЧИ НЕ НУЖНЫ
     
     # ИСПРАВЛЕННЫЕ ВРЕМЕНА (в UTC):
     
     # 06:00 UTC = 09:00 MSK - Ежедневное расписание администраторам
     job_queue.run_daily(send_daily_schedule, time=datetime.strptime("06:00", "%H:%M").time(), name="daily_schedule")
     
-    # 02:00 UTC = 05:00 MSK - Проверка дубликатов  
-    job_queue.run_daily(check_duplicates_daily, time=datetime.strptime("02:00", "%H:%M").time(), name="check_duplicates")
-    
     # 21:00 UTC = 00:00 MSK - Очистка неактивных пользователей
     job_queue.run_daily(cleanup_old_data, time=datetime.strptime("21:00", "%H:%M").time(), name="cleanup_old_data")
     
@@ -4661,12 +4356,14 @@ async def check_database_status(context: ContextTypes.DEFAULT_TYPE):
         db_path = get_database_path()
         db_exists = os.path.exists(db_path)
         
-        # Получаем статистику
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-        appointments_count = cursor.fetchone()[0]
-        
-        cursor = db.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-        users_count = cursor.fetchone()[0]
+        # 🎯 ПОСЛЕ ЧИСТОЙ ОСТАНОВКИ СТАТИСТИКА УЖЕ ЕСТЬ В МАНИФЕСТЕ
+        startup_info = await adb.get_startup_info()
+        if startup_info['clean_start']:
+            appointments_count = startup_info['appointments']
+            users_count = startup_info['users']
+        else:
+            appointments_count = (await adb.fetchone('SELECT COUNT(*) FROM appointments'))[0]
+            users_count = (await adb.fetchone('SELECT COUNT(*) FROM bot_users'))[0]
         
         # Логируем информацию
         logger.info(f"🔍 ДИАГНОСТИКА БД:")
@@ -4674,6 +4371,10 @@ async def check_database_status(context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"   ✅ Файл существует: {db_exists}")
         logger.info(f"   📊 Записей: {appointments_count}")
         logger.info(f"   👥 Пользователей: {users_count}")
+        logger.info(f"   ⏱ Старт БД: {startup_info['startup_seconds']:.3f} с")
+        
+        # 🎯 ПЛАНЫ ЗАПРОСОВ МЕНЯЮТСЯ ТОЛЬКО С МИГРАЦИЯМИ - ПОСЛЕ ЧИСТОГО СТАРТА НЕ ПРОВЕРЯЕМ
+        full_scans = [] if startup_info['clean_start'] else await adb.check_query_plans()
         
         # Отправляем уведомление администраторам
         if context:
@@ -4682,10 +4383,12 @@ async def check_database_status(context: ContextTypes.DEFAULT_TYPE):
                 f"• Файл БД: {'✅ Существует' if db_exists else '❌ Отсутствует'}\n"
                 f"• Путь: `{db_path}`\n"
                 f"• Записей: {appointments_count}\n"
-                f"• Пользователей: {users_count}"
+                f"• Пользователей: {users_count}\n"
+                f"• Старт: {'⚡ по манифесту' if startup_info['clean_start'] else '🔍 полная проверка'} ({startup_info['startup_seconds']:.2f} с)\n"
+                f"• Планы запросов: {'✅ по индексам' if not full_scans else f'⚠️ полных сканирований: {len(full_scans)}'}"
             )
             
-            notification_chats = db.get_notification_chats()
+            notification_chats = await adb.get_notification_chats()
             for chat_id in notification_chats:
                 try:
                     await context.bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
@@ -4766,6 +4469,7 @@ def main():
         logger.error("🚨 ПРОВЕРЬТЕ BOT_TOKEN И INTERNET ДОСТУП В RENDER!")
         sys.exit(1)
     
+    atexit.register(close_database_at_exit)
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
@@ -4817,15 +4521,16 @@ def main():
             logger.info(f"🤖 Initializing bot application (restart #{restart_count})...")
             
             # 🎯 ПЕРЕПОДКЛЮЧЕНИЕ К БАЗЕ ДАННЫХ
-            global db
+            global db, adb
             try:
-                db = database.Database()
+                db.close()
+                db = storage.create_storage()
+                adb = async_database.AsyncDatabase(db)
                 logger.info("✅ Database connection reestablished")
                 
                 # 🎯 ПРОВЕРЯЕМ ЧТО БАЗА РАБОТАЕТ
-                cursor = db.execute_with_retry('SELECT COUNT(*) FROM appointments')
-                appointments_count = cursor.fetchone()[0]
-                logger.info(f"📊 В базе данных: {appointments_count} записей")
+                if not db.ping():
+                    raise RuntimeError("БД не отвечает")
                 
             except Exception as e:
                 logger.error(f"❌ Database connection failed: {e}")
@@ -4834,7 +4539,7 @@ def main():
                 continue
             
             # 🎯 СОЗДАЕМ ПРИЛОЖЕНИЕ БОТА
-            application = Application.builder().token(config.BOT_TOKEN).build()
+            application = Application.builder().token(config.BOT_TOKEN).post_shutdown(close_async_database).build()
             logger.info("✅ Application created")
             
             # 🎯 ДОБАВЛЯЕМ ОБРАБОТЧИКИ
@@ -4882,6 +4587,9 @@ def main():
             
             application.add_handler(CommandHandler("debug", debug_bot_status))
             logger.info("✅ CommandHandler 'debug' added")
+            
+            application.add_handler(CommandHandler("db_top", show_query_stats))
+            logger.info("✅ CommandHandler 'db_top' added")
 
             # 🎯 ДОБАВЛЯЕМ КОМАНДУ ПРИНУДИТЕЛЬНОГО ВОССТАНОВЛЕНИЯ
             application.add_handler(CommandHandler("restore", force_restore_backup))
@@ -4947,9 +4655,7 @@ def main():
             
             # 🎯 ОЧИСТКА РЕСУРСОВ
             try:
-                if db.conn:
-                    db.conn.close()
-                    db.conn = None
+                db.close()
                 logger.info("✅ Database connection closed")
             except Exception as e:
                 logger.warning(f"⚠️ Database close failed: {e}")
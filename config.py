@@ -39,5 +39,73 @@ BARBERSHOP_NAME = "Бархат"
 CLEANUP_DAYS_OLD = 30
 
 # Настройки базы данных
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///barbershop.db')
-TIMEZONE_OFFSET = 3
\ No newline at end of file
+# sqlite:////abs/path.db - файл, sqlite::memory: - общая БД SQLite в памяти,
+# memory:// - хранилище на словарях Python без SQL, только для benchmark_storage.py
+# (бот с ним не запускается)
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:////tmp/barbershop.db')
+TIMEZONE_OFFSET = 3
+# Поток записи: групповой коммит
+WRITE_BATCH_WINDOW = 0.002  # секунд ожидания следующих операций в пакете
+WRITE_MAX_BATCH = 64
+
+# Пул соединений только для чтения
+READ_POOL_SIZE = 3
+
+# Профили настройки SQLite, выбираются переменной DB_TUNING_PROFILE
+# cache_size < 0 - KB на соединение (read_cache_size - для пула чтения),
+# mmap_size - байт, page_size применяется только к новой БД
+TUNING_PROFILES = {
+    # Бесплатный инстанс Render на 512 MB: маленький кэш, временные таблицы на диске
+    'low_memory': {'page_size': 4096, 'cache_size': -2000, 'read_cache_size': -1000,
+                   'mmap_size': 0, 'temp_store': 'FILE', 'synchronous': 'NORMAL'},
+    # Прежние настройки по умолчанию
+    'balanced': {'page_size': 4096, 'cache_size': -64000, 'read_cache_size': -8000,
+                 'mmap_size': 0, 'temp_store': 'DEFAULT', 'synchronous': 'NORMAL'},
+    # Чтение через mmap, крупные страницы, временные таблицы в памяти
+    'throughput': {'page_size': 8192, 'cache_size': -64000, 'read_cache_size': -16000,
+                   'mmap_size': 256 * 1024 * 1024, 'temp_store': 'MEMORY', 'synchronous': 'NORMAL'},
+    # fsync на каждый COMMIT: записи переживают и отключение питания
+    'durable': {'page_size': 4096, 'cache_size': -16000, 'read_cache_size': -8000,
+                'mmap_size': 0, 'temp_store': 'DEFAULT', 'synchronous': 'FULL'},
+}
+DB_TUNING_PROFILE = os.getenv('DB_TUNING_PROFILE', 'balanced')
+
+# Фоновый checkpoint WAL
+WAL_CHECK_INTERVAL = 5  # секунд между проверками
+WAL_IDLE_SECONDS = 2  # PASSIVE checkpoint после стольких секунд без записей
+WAL_RESTART_AFTER_BUSY = 3  # RESTART после стольких неполных PASSIVE подряд
+WAL_TRUNCATE_SIZE_KB = 16384  # TRUNCATE, если WAL вырос больше
+
+# Онлайн backup через sqlite3 backup API
+BACKUP_PAGES_PER_STEP = 256  # страниц за шаг (~1 MB при странице 4 KB)
+BACKUP_STEP_SLEEP = 0.005  # секунд паузы между шагами
+
+# Отложенный backup после изменений
+BACKUP_DEBOUNCE_SECONDS = 60  # не больше одного backup за окно
+
+# Хранилище backup: сжатые поколения с ротацией
+BACKUP_DIR = '/tmp/barbershop_backups'
+BACKUP_KEEP_HOURLY = 24  # последний backup каждого часа
+BACKUP_KEEP_DAILY = 7  # первый backup каждого дня
+BACKUP_CHUNK_SIZE = 1024 * 1024  # байт за шаг сжатия/распаковки
+
+# Инкрементальный backup: сегменты журнала изменений между базовыми снимками
+BACKUP_BASE_INTERVAL = 3600  # секунд между полными снимками
+
+# Архив прошедших записей (ATTACH archive)
+ARCHIVE_BATCH_SIZE = 500  # записей за одну транзакцию переноса
+
+# Статистика запросов
+SLOW_QUERY_MS = 200  # запросы дольше пишутся в лог
+QUERY_STATS_TOP = 10  # строк в /db_top по умолчанию
+
+# Повторы при блокировке БД
+DB_BUSY_TIMEOUT = 10.0  # секунд ожидания блокировки внутри SQLite (busy_timeout)
+DB_MAX_RETRIES = 3
+DB_RETRY_BASE_DELAY = 0.05  # секунд, удваивается с каждой попыткой
+DB_RETRY_MAX_DELAY = 1.0  # верхняя граница паузы
+
+# Здоровье соединения и обслуживание БД
+DB_FAILURE_THRESHOLD = 3  # ошибок соединения подряд до переподключения
+DB_MAINTENANCE_WRITES = 500  # PRAGMA optimize и quick_check после стольких записей
+DB_EMERGENCY_SIZE_MB = 8  # размер БД, после которого emergency_size_management делает backup и экстренный архив
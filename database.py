@@ -1,32 +1,195 @@
 # database.py
 import os
+import re
+import random
+import asyncio
 import logging
 import sqlite3
 import time
 import shutil
 import glob
+import gzip
+import hashlib
+import json
+import tempfile
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import config
 
 logger = logging.getLogger(__name__)
 
+# 🎯 ЧАСТЫЕ ЗАПРОСЫ: методы берут SQL отсюда, check_query_plans проверяет,
+# что ни один из них не читает таблицу целиком
+HOT_QUERIES = {
+    'user_appointments': '''
+        SELECT id, service, appointment_date, appointment_time 
+        FROM appointments 
+        WHERE user_id = ? AND starts_at >= ?
+        ORDER BY starts_at
+    ''',
+    'future_appointments': '''
+        SELECT id, user_name, user_username, phone, service, appointment_date, appointment_time 
+        FROM appointments 
+        WHERE starts_at >= ?
+        ORDER BY starts_at
+    ''',
+    'future_appointments_count': '''
+        SELECT COUNT(*) FROM appointments 
+        WHERE starts_at >= ?
+    ''',
+    'booked_times': '''
+        SELECT appointment_time FROM appointments 
+        WHERE appointment_date = ?
+    ''',
+    'day_appointments': '''
+        SELECT user_name, phone, service, appointment_time 
+        FROM appointments 
+        WHERE appointment_date = ?
+        ORDER BY appointment_time
+    ''',
+    'conflicting_appointments': '''
+        SELECT id, user_id, user_name, phone, service, appointment_date, appointment_time
+        FROM appointments 
+        WHERE weekday = ? AND start_minute < ? AND starts_at >= ?
+        UNION ALL
+        SELECT id, user_id, user_name, phone, service, appointment_date, appointment_time
+        FROM appointments 
+        WHERE weekday = ? AND start_minute >= ? AND starts_at >= ?
+        ORDER BY appointment_date, appointment_time
+    ''',
+    'appointment_counts_by_date': '''
+        SELECT appointment_date, COUNT(*) FROM appointments 
+        WHERE starts_at >= ? AND starts_at < ?
+        GROUP BY appointment_date
+    ''',
+    'range_appointments_page': '''
+        SELECT id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at
+        FROM appointments 
+        WHERE starts_at < ? AND (starts_at, id) > (?, ?)
+        ORDER BY starts_at, id
+        LIMIT ?
+    ''',
+    'user_appointments_page': '''
+        SELECT id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at
+        FROM appointments 
+        WHERE user_id = ? AND (starts_at, id) > (?, ?)
+        ORDER BY starts_at, id
+        LIMIT ?
+    ''',
+    'manual_appointments_page': '''
+        SELECT id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at
+        FROM appointments 
+        WHERE is_manual = 1 AND (starts_at, id) > (?, ?)
+        ORDER BY starts_at, id
+        LIMIT ?
+    ''',
+    'weekly_appointments_count': '''
+        SELECT (SELECT COUNT(*) FROM appointments WHERE starts_at >= ? AND starts_at < ?)
+             + (SELECT COUNT(*) FROM archive.appointments_archive WHERE starts_at >= ? AND starts_at < ?)
+    ''',
+    'weekly_peak_time': '''
+        SELECT appointment_time, COUNT(*) as count
+        FROM (
+            SELECT appointment_time FROM appointments 
+            WHERE starts_at >= ? AND starts_at < ?
+            UNION ALL
+            SELECT appointment_time FROM archive.appointments_archive 
+            WHERE starts_at >= ? AND starts_at < ?
+        )
+        GROUP BY appointment_time 
+        ORDER BY count DESC 
+        LIMIT 1
+    ''',
+    'active_users_count': '''
+        SELECT COUNT(*) FROM bot_users 
+        WHERE last_seen >= ?
+    ''',
+    'backup_history': '''
+        SELECT timestamp, size_kb, success, backup_path, error_message
+        FROM backup_metadata 
+        ORDER BY timestamp DESC 
+        LIMIT 5
+    ''',
+    'pending_reminders': '''
+        SELECT sr.appointment_id, sr.reminder_type, sr.scheduled_time, a.user_id, a.appointment_date, a.appointment_time
+        FROM scheduled_reminders sr
+        JOIN appointments a ON sr.appointment_id = a.id
+        WHERE sr.sent = FALSE 
+        AND datetime(sr.scheduled_time) > datetime('now')
+        ORDER BY sr.scheduled_time
+    ''',
+    'appointments_without_reminders': '''
+        SELECT a.id, a.user_id, a.appointment_date, a.appointment_time
+        FROM appointments a
+        WHERE a.starts_at >= ? AND a.starts_at < ?
+        AND NOT EXISTS (
+            SELECT 1 FROM scheduled_reminders sr 
+            WHERE sr.appointment_id = a.id AND sr.sent = FALSE
+        )
+        ORDER BY a.starts_at
+    ''',
+    'old_sent_reminders': '''
+        DELETE FROM scheduled_reminders 
+        WHERE sent = TRUE AND scheduled_time < ?
+    ''',
+}
+
+SCHEDULE_SNAPSHOT_QUERY = '''
+    SELECT id, weekday, start_time, end_time, is_working
+    FROM work_schedule ORDER BY weekday
+'''
+
 def get_moscow_time():
     """Возвращает текущее московское время (UTC+3)"""
     return datetime.now(timezone(timedelta(hours=3)))
 
-def get_database_path():
+def epoch_minutes(moment):
+    """Минуты эпохи (UTC) для datetime с часовым поясом - единица appointments.starts_at"""
+    return int(moment.timestamp()) // 60
+
+def local_epoch_minutes(date, time="00:00"):
+    """Минуты эпохи для московских даты 'YYYY-MM-DD' и времени 'HH:MM'"""
+    local = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+    return epoch_minutes(local.replace(tzinfo=timezone(timedelta(hours=config.TIMEZONE_OFFSET))))
+
+def connect_sqlite(path, **kwargs):
+    """sqlite3.connect, понимающий и URI вида file:имя?mode=memory&cache=shared"""
+    return sqlite3.connect(path, uri=path.startswith('file:'), **kwargs)
+
+def get_tuning_profile(name=None):
+    """Профиль настройки SQLite из config.TUNING_PROFILES (по умолчанию DB_TUNING_PROFILE)"""
+    name = name or config.DB_TUNING_PROFILE
+    if name not in config.TUNING_PROFILES:
+        logger.warning(f"⚠️ Неизвестный профиль настройки БД {name!r}, используется balanced")
+        name = 'balanced'
+    return dict(config.TUNING_PROFILES[name], name=name)
+
+def apply_tuning(conn, tuning, cache_size=None):
+    """Применяет к соединению PRAGMA профиля (кроме page_size - он задается один раз для БД)"""
+    conn.execute(f"PRAGMA cache_size={int(cache_size if cache_size is not None else tuning['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(tuning['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store={tuning['temp_store']}")
+    conn.execute(f"PRAGMA synchronous={tuning['synchronous']}")
+
+def get_database_path(db_path='/tmp/barbershop.db'):
     """🎯 ОПТИМИЗИРОВАННЫЙ ПУТЬ ДЛЯ RENDER"""
-    db_path = '/tmp/barbershop.db'
+    if db_path.startswith('file:'):
+        logger.info(f"📁 БД В ПАМЯТИ: {db_path}")
+        return db_path
     
-    # Проверяем доступность /tmp/ для записи
+    # Проверяем доступность каталога БД для записи
+    db_dir = os.path.dirname(db_path) or '.'
     try:
-        test_file = '/tmp/test_write_barbershop'
+        test_file = os.path.join(db_dir, 'test_write_barbershop')
         with open(test_file, 'w') as f:
             f.write('test')
         os.unlink(test_file)
-        logger.info("✅ /tmp/ доступен для записи")
+        logger.info(f"✅ {db_dir}/ доступен для записи")
     except Exception as e:
-        logger.error(f"❌ /tmp/ не доступен для записи: {e}")
+        logger.error(f"❌ {db_dir}/ не доступен для записи: {e}")
         # Fallback на текущую директорию
         db_path = 'barbershop.db'
         logger.info(f"🔄 Используем fallback путь: {db_path}")
@@ -44,30 +207,1089 @@ def get_database_path():
     
     return db_path
 
-class Database:
+def copy_database(source_path, target_path, pages=config.BACKUP_PAGES_PER_STEP, sleep=config.BACKUP_STEP_SLEEP):
+    """🎯 КОПИРУЕТ БД ЧЕРЕЗ sqlite3 backup API
+
+    Копия согласована (учитывает WAL), а между шагами по pages страниц
+    источник не заблокирован - поток записи продолжает работать.
+    """
+    source = connect_sqlite(source_path, timeout=config.DB_BUSY_TIMEOUT)
+    try:
+        target = connect_sqlite(target_path, timeout=config.DB_BUSY_TIMEOUT)
+        try:
+            source.backup(target, pages=pages, sleep=sleep)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+class QueryStats:
+    """🎯 СТАТИСТИКА ЗАПРОСОВ ПО ОТПЕЧАТКУ SQL
+
+    Отпечаток - текст запроса без лишних пробелов, с литералами и списками
+    IN (...), замененными на ?. Для каждого отпечатка копятся число
+    вызовов, гистограмма задержек, строки, повторы и ожидание блокировок.
+    """
+
+    # Верхние границы корзин гистограммы, ms (последняя корзина - все дольше)
+    BUCKETS_MS = (1, 5, 20, 100, 500)
+    MAX_CACHED_FINGERPRINTS = 1000
+
+    def __init__(self, slow_ms=config.SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._fingerprints = {}
+
+    def fingerprint(self, query):
+        """Нормализованный текст запроса (результат кэшируется)"""
+        cached = self._fingerprints.get(query)
+        if cached is not None:
+            return cached
+        normalized = re.sub(r"'(?:[^']|'')*'", '?', query)
+        normalized = re.sub(r'\b\d+(?:\.\d+)?\b', '?', normalized)
+        normalized = re.sub(r'\s+', ' ', normalized).strip()
+        normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', normalized)
+        if len(self._fingerprints) < self.MAX_CACHED_FINGERPRINTS:
+            self._fingerprints[query] = normalized
+        return normalized
+
+    def record(self, query, duration_ms, rows=0, retries=0, lock_wait_ms=0.0, error=False):
+        """Учитывает один вызов запроса"""
+        fingerprint = self.fingerprint(query)
+        bucket = next((i for i, bound in enumerate(self.BUCKETS_MS) if duration_ms <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None:
+                stats = self._stats[fingerprint] = {
+                    'fingerprint': fingerprint, 'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'rows': 0, 'retries': 0, 'lock_wait_ms': 0.0, 'slow': 0,
+                    'histogram': [0] * (len(self.BUCKETS_MS) + 1)
+                }
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['rows'] += max(rows, 0)
+            stats['retries'] += retries
+            stats['lock_wait_ms'] += lock_wait_ms
+            stats['histogram'][bucket] += 1
+            if duration_ms >= self.slow_ms:
+                stats['slow'] += 1
+
+        if duration_ms >= self.slow_ms:
+            logger.warning(f"🐢 Медленный запрос {duration_ms:.1f} ms (строк: {rows}, повторов: {retries}): {fingerprint[:200]}")
+
+    def top(self, limit=config.QUERY_STATS_TOP, order_by='total_ms'):
+        """Первые limit отпечатков по order_by (total_ms, calls, max_ms, lock_wait_ms)"""
+        with self._lock:
+            items = [dict(stats, histogram=list(stats['histogram'])) for stats in self._stats.values()]
+        for stats in items:
+            stats['avg_ms'] = stats['total_ms'] / stats['calls']
+        items.sort(key=lambda stats: stats[order_by], reverse=True)
+        return items[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+class RetryPolicy:
+    """🎯 ПОВТОРЫ ЗАПРОСА ПРИ БЛОКИРОВКЕ БД
+
+    Короткие блокировки пережидает сам SQLite (busy_timeout соединения).
+    Если блокировка не снялась, запрос повторяется после паузы со
+    случайным разбросом от 0 до base_delay * 2^attempt, чтобы повторы
+    разных чатов не совпадали. Пауза - time.sleep в потоках БД и
+    asyncio.sleep в корутинах. В потоке event loop синхронный повтор не
+    делается: ошибка сразу уходит вызывающему, остальные чаты не ждут.
+    """
+
+    def __init__(self, max_retries=config.DB_MAX_RETRIES, base_delay=config.DB_RETRY_BASE_DELAY,
+                 max_delay=config.DB_RETRY_MAX_DELAY, busy_timeout=config.DB_BUSY_TIMEOUT):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self.stats = {'contention': 0, 'retries': 0, 'gave_up': 0, 'refused_in_loop': 0, 'backoff_ms': 0.0}
+
+    @staticmethod
+    def is_locked(error):
+        """database is locked (SQLITE_BUSY) или database table is locked (SQLITE_LOCKED)"""
+        return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+    def delay(self, attempt):
+        """Пауза перед повтором номер attempt (с нуля)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _count(self, attempt):
+        """Учитывает блокировку и решает, повторять ли запрос после попытки attempt"""
+        with self._lock:
+            self.stats['contention'] += 1
+            if attempt < self.max_retries - 1:
+                self.stats['retries'] += 1
+                return True
+            self.stats['gave_up'] += 1
+            return False
+
+    @staticmethod
+    def _in_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    def backoff(self, attempt):
+        """Пауза в потоке БД; в потоке event loop не ждет и возвращает False"""
+        if self._in_event_loop():
+            with self._lock:
+                self.stats['refused_in_loop'] += 1
+            return False
+        delay = self.delay(attempt)
+        time.sleep(delay)
+        with self._lock:
+            self.stats['backoff_ms'] += delay * 1000
+        return True
+
+    def retry(self, attempt):
+        """Блокировка в синхронном коде: True - пауза выдержана, можно повторять"""
+        if self._in_event_loop():
+            with self._lock:
+                self.stats['contention'] += 1
+                self.stats['refused_in_loop'] += 1
+            return False
+        return self._count(attempt) and self.backoff(attempt)
+
+    async def async_backoff(self, attempt):
+        """Пауза в корутине: event loop продолжает обслуживать другие чаты"""
+        delay = self.delay(attempt)
+        await asyncio.sleep(delay)
+        with self._lock:
+            self.stats['backoff_ms'] += delay * 1000
+
+    async def retry_async(self, attempt):
+        """Блокировка в корутине: True - пауза выдержана, можно повторять"""
+        if not self._count(attempt):
+            return False
+        await self.async_backoff(attempt)
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+class ConnectionSupervisor:
+    """🎯 ЗДОРОВЬЕ СОЕДИНЕНИЯ ПО ИСХОДАМ НАСТОЯЩИХ ЗАПРОСОВ
+
+    healthy -> degraded после ошибки соединения, -> failed после
+    failure_threshold ошибок подряд (или сразу, если файл БД поврежден).
+    В состоянии failed следующий запрос сначала переподключается, любой
+    успешный запрос возвращает healthy. Блокировки и нарушения
+    ограничений - не ошибки соединения. Обслуживание (PRAGMA optimize,
+    quick_check) становится нужным после maintenance_writes записей, так
+    что в простое к БД никто не обращается.
+    """
+
+    HEALTHY, DEGRADED, FAILED = 'healthy', 'degraded', 'failed'
+
+    def __init__(self, failure_threshold=config.DB_FAILURE_THRESHOLD, maintenance_writes=config.DB_MAINTENANCE_WRITES):
+        self.failure_threshold = failure_threshold
+        self.maintenance_writes = maintenance_writes
+        self.state = self.HEALTHY
+        self.consecutive_failures = 0
+        self.writes_since_maintenance = 0
+        self._maintenance_pending = False
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'reconnects': 0, 'maintenance_runs': 0,
+                      'last_error': None, 'last_quick_check': None, 'last_maintenance_at': None}
+
+    @staticmethod
+    def is_connection_error(error):
+        """Ошибка, после которой соединению нельзя доверять"""
+        if not isinstance(error, sqlite3.DatabaseError):
+            return False
+        if isinstance(error, (sqlite3.IntegrityError, sqlite3.ProgrammingError)):
+            return False
+        return not RetryPolicy.is_locked(error)
+
+    def record_success(self, write=False):
+        """Учитывает успешный запрос, возвращает True, если пора запустить обслуживание"""
+        with self._lock:
+            self.stats['successes'] += 1
+            self.consecutive_failures = 0
+            if self.state != self.HEALTHY:
+                logger.info(f"✅ Соединение с БД снова в порядке (было: {self.state})")
+                self.state = self.HEALTHY
+            if not write:
+                return False
+            self.writes_since_maintenance += 1
+            if self._maintenance_pending or self.writes_since_maintenance < self.maintenance_writes:
+                return False
+            self._maintenance_pending = True
+            return True
+
+    def record_failure(self, error):
+        """Учитывает ошибку запроса; не связанные с соединением ошибки игнорируются"""
+        if not self.is_connection_error(error):
+            return
+        with self._lock:
+            self.stats['failures'] += 1
+            self.stats['last_error'] = str(error)
+            self.consecutive_failures += 1
+            corrupted = not isinstance(error, sqlite3.OperationalError)
+            new_state = self.FAILED if corrupted or self.consecutive_failures >= self.failure_threshold else self.DEGRADED
+            if new_state != self.state:
+                logger.warning(f"⚠️ Состояние соединения с БД: {self.state} -> {new_state} ({error})")
+                self.state = new_state
+
+    def needs_reconnect(self):
+        return self.state == self.FAILED
+
+    def mark_reconnected(self):
+        with self._lock:
+            self.stats['reconnects'] += 1
+            self.consecutive_failures = 0
+            self.state = self.HEALTHY
+
+    def maintenance_done(self, quick_check):
+        with self._lock:
+            self.writes_since_maintenance = 0
+            self._maintenance_pending = False
+            self.stats['maintenance_runs'] += 1
+            self.stats['last_quick_check'] = quick_check
+            self.stats['last_maintenance_at'] = get_moscow_time().strftime("%d.%m.%Y %H:%M")
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.consecutive_failures,
+                        writes_since_maintenance=self.writes_since_maintenance)
+
+class AvailabilityIndex:
+    """🎯 ИНДЕКС СВОБОДНЫХ СЛОТОВ: ЦЕЛОЕ ЧИСЛО-МАСКА НА ДАТУ
+
+    Бит m означает слот, начинающийся в минуту m от полуночи. Для каждого
+    дня недели хранится маска рабочих слотов (как в generate_time_slots),
+    для каждой даты - маска занятых, свободные слоты - work & ~booked.
+    Индекс строится при первом обращении одним запросом по записям с
+    since и дальше обновляется при записи, отмене, переносе в архив и
+    смене графика. Даты раньше since индекс не знает (None).
+    """
+
+    # Подписи слотов по минуте от полуночи
+    LABELS = tuple(f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(24 * 60))
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self.built = False
+        self.since = None
+        self._work = {}
+        self._booked = {}
+
+    @staticmethod
+    def minute_of(time_str):
+        hours, minutes = time_str.split(':')
+        return int(hours) * 60 + int(minutes)
+
+    @classmethod
+    def work_mask(cls, start_time, end_time, is_working=True):
+        """Маска слотов от start_time с шагом 30 минут до end_time"""
+        if not is_working:
+            return 0
+        mask = 0
+        for minute in range(cls.minute_of(start_time), cls.minute_of(end_time), 30):
+            mask |= 1 << minute
+        return mask
+
+    def build(self, schedule_rows, booked_rows, since):
+        """Строит индекс из (weekday, start_time, end_time, is_working) и (date, time); вызывать под _lock"""
+        self._work = {weekday: self.work_mask(start_time, end_time, is_working)
+                      for weekday, start_time, end_time, is_working in schedule_rows}
+        self._booked = {}
+        for date, time_str in booked_rows:
+            self._booked[date] = self._booked.get(date, 0) | (1 << self.minute_of(time_str))
+        self.since = since
+        self.built = True
+
+    def invalidate(self):
+        """Сбрасывает индекс - при следующем обращении он строится заново"""
+        with self._lock:
+            self.built = False
+            self._booked = {}
+
+    def _update(self, date, time_str, booked):
+        with self._lock:
+            # До построения события не нужны: построение само прочитает БД
+            if not self.built or date < self.since:
+                return
+            bit = 1 << self.minute_of(time_str)
+            mask = self._booked.get(date, 0)
+            self._booked[date] = mask | bit if booked else mask & ~bit
+
+    def book(self, date, time_str):
+        self._update(date, time_str, True)
+
+    def release(self, date, time_str):
+        self._update(date, time_str, False)
+
+    def set_work_hours(self, weekday, start_time, end_time, is_working):
+        with self._lock:
+            if self.built:
+                self._work[weekday] = self.work_mask(start_time, end_time, is_working)
+
+    def free_slots(self, date):
+        """Свободные слоты даты по возрастанию или None, если даты нет в индексе"""
+        with self._lock:
+            if not self.built or date < self.since:
+                return None
+            weekday = datetime.fromisoformat(date).weekday()
+            free = self._work.get(weekday, 0) & ~self._booked.get(date, 0)
+        slots = []
+        while free:
+            lowest = free & -free
+            slots.append(self.LABELS[lowest.bit_length() - 1])
+            free ^= lowest
+        return slots
+
+class WorkScheduleSnapshot:
+    """🎯 НЕИЗМЕНЯЕМЫЙ СНИМОК ГРАФИКА РАБОТЫ
+
+    Строки (id, weekday, start_time, end_time, is_working) по дням недели.
+    Снимок не меняется после создания: Database заменяет его целиком после
+    set_work_schedule, поэтому читатели без блокировок видят либо старый,
+    либо новый график, но не их смесь.
+    """
+
+    __slots__ = ('_rows',)
+
+    def __init__(self, rows):
+        object.__setattr__(self, '_rows', {row[1]: tuple(row) for row in rows})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("WorkScheduleSnapshot неизменяем")
+
+    def get(self, weekday):
+        """Строка графика дня недели или None"""
+        return self._rows.get(weekday)
+
+    def rows(self, weekday=None):
+        """Как get_work_schedule: список строк дня или всех дней по порядку"""
+        if weekday is not None:
+            row = self._rows.get(weekday)
+            return [row] if row else []
+        return [self._rows[day] for day in sorted(self._rows)]
+
+    def week(self):
+        """Как get_week_schedule: строка на каждый день, 10:00-20:00 для отсутствующих"""
+        return {weekday: self._rows.get(weekday, (0, weekday, "10:00", "20:00", True)) for weekday in range(7)}
+
+class BackupStore:
+    """🎯 ХРАНИЛИЩЕ BACKUP: СЖАТЫЕ ПОКОЛЕНИЯ С РОТАЦИЕЙ
+
+    Поколение - gzip-копия БД с контрольной суммой в файле .sha256.
+    Хранится последний backup каждого часа (hourly) и первый backup
+    каждого дня (daily), лишние поколения удаляются.
+
+    Между снимками изменения выгружаются сегментами журнала changelog
+    (gzip JSON lines, по записи на строку), имя сегмента содержит
+    диапазон seq. Сегменты старше самого старого поколения удаляются.
+    """
+
+    def __init__(self, directory=config.BACKUP_DIR, keep_hourly=config.BACKUP_KEEP_HOURLY,
+                 keep_daily=config.BACKUP_KEEP_DAILY, chunk_size=config.BACKUP_CHUNK_SIZE):
+        self.directory = directory
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, kind, slot):
+        return os.path.join(self.directory, f"barbershop_{kind}_{slot}.db.gz")
+
+    def save(self, snapshot_path, now, base_seq=0):
+        """Сжимает снимок БД в поколение текущего часа (и дня, если его еще нет)
+
+        base_seq - последний seq журнала изменений, вошедший в снимок.
+        """
+        hourly_path = self.path_for('hourly', now.strftime("%Y%m%d_%H"))
+        checksum, raw_size = self._compress(snapshot_path, hourly_path, base_seq)
+        created = [('hourly', hourly_path)]
+
+        daily_path = self.path_for('daily', now.strftime("%Y%m%d"))
+        if not os.path.exists(daily_path):
+            shutil.copyfile(hourly_path, daily_path)
+            shutil.copyfile(f"{hourly_path}.sha256", f"{daily_path}.sha256")
+            created.append(('daily', daily_path))
+
+        return {
+            'path': hourly_path,
+            'checksum': checksum,
+            'raw_size': raw_size,
+            'base_seq': base_seq,
+            'size': os.path.getsize(hourly_path),
+            'created': created,
+            'removed': self._rotate()
+        }
+
+    def _compress(self, source_path, target_path, base_seq):
+        """Потоково сжимает файл частями по chunk_size, возвращает sha256 и размер исходника"""
+        tmp_path = f"{target_path}.tmp"
+        digest = hashlib.sha256()
+        raw_size = 0
+        with open(source_path, 'rb') as source, gzip.open(tmp_path, 'wb', compresslevel=6) as target:
+            while True:
+                chunk = source.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                raw_size += len(chunk)
+                target.write(chunk)
+        checksum = digest.hexdigest()
+        with open(f"{target_path}.sha256", 'w') as f:
+            f.write(f"{checksum} {raw_size} {base_seq}\n")
+        os.replace(tmp_path, target_path)
+        return checksum, raw_size
+
+    def _read_sidecar(self, backup_path):
+        """Поля файла .sha256: контрольная сумма, исходный размер, base_seq"""
+        if not os.path.exists(f"{backup_path}.sha256"):
+            return []
+        with open(f"{backup_path}.sha256") as f:
+            return f.read().split()
+
+    def base_seq(self, backup_path):
+        """Последний seq журнала изменений в поколении (0 - поколение без журнала)"""
+        fields = self._read_sidecar(backup_path)
+        return int(fields[2]) if len(fields) > 2 else 0
+
+    def extract(self, backup_path):
+        """Распаковывает поколение во временный файл, проверяя контрольную сумму"""
+        fields = self._read_sidecar(backup_path)
+        expected = fields[0] if fields else None
+
+        fd, restore_path = tempfile.mkstemp(dir=self.directory, suffix='.restore.db')
+        digest = hashlib.sha256()
+        try:
+            with gzip.open(backup_path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    target.write(chunk)
+            if expected and digest.hexdigest() != expected:
+                raise ValueError(f"контрольная сумма не совпадает: {os.path.basename(backup_path)}")
+        except Exception:
+            os.remove(restore_path)
+            raise
+        return restore_path
+
+    def generations(self):
+        """Поколения от новых к старым"""
+        result = []
+        for path in glob.glob(os.path.join(self.directory, 'barbershop_*.db.gz')):
+            stat = os.stat(path)
+            result.append({
+                'path': path,
+                'kind': 'daily' if '_daily_' in os.path.basename(path) else 'hourly',
+                'size_kb': round(stat.st_size / 1024, 1),
+                'mtime': stat.st_mtime,
+                'date': datetime.fromtimestamp(stat.st_mtime).strftime("%d.%m.%Y %H:%M")
+            })
+        result.sort(key=lambda item: item['mtime'], reverse=True)
+        return result
+
+    def latest(self):
+        """Самое свежее поколение или None"""
+        generations = self.generations()
+        return generations[0] if generations else None
+
+    def save_segment(self, records):
+        """Записывает сегмент журнала изменений, возвращает путь и размер"""
+        first_seq, last_seq = records[0]['seq'], records[-1]['seq']
+        path = os.path.join(self.directory, f"barbershop_segment_{first_seq:012d}_{last_seq:012d}.jsonl.gz")
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as target:
+            for record in records:
+                target.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+        return {'path': path, 'first_seq': first_seq, 'last_seq': last_seq, 'size': os.path.getsize(path)}
+
+    def segments(self):
+        """Сегменты журнала в порядке seq"""
+        result = []
+        for path in glob.glob(os.path.join(self.directory, 'barbershop_segment_*.jsonl.gz')):
+            first_seq, last_seq = os.path.basename(path)[len('barbershop_segment_'):-len('.jsonl.gz')].split('_')
+            result.append({'path': path, 'first_seq': int(first_seq), 'last_seq': int(last_seq)})
+        result.sort(key=lambda item: item['first_seq'])
+        return result
+
+    def last_shipped_seq(self):
+        """Последний seq, уже выгруженный в сегмент"""
+        segments = self.segments()
+        return segments[-1]['last_seq'] if segments else 0
+
+    def read_changes(self, after_seq):
+        """Записи журнала из сегментов с seq больше after_seq, по порядку"""
+        for segment in self.segments():
+            if segment['last_seq'] <= after_seq:
+                continue
+            with gzip.open(segment['path'], 'rt', encoding='utf-8') as source:
+                for line in source:
+                    record = json.loads(line)
+                    if record['seq'] > after_seq:
+                        yield record
+
+    def _rotate(self):
+        """Удаляет поколения сверх лимитов, возвращает удаленные пути"""
+        removed = []
+        for kind, keep in (('hourly', self.keep_hourly), ('daily', self.keep_daily)):
+            # Имена содержат дату и час, поэтому сортируются по времени
+            paths = sorted(glob.glob(os.path.join(self.directory, f'barbershop_{kind}_*.db.gz')), reverse=True)
+            for path in paths[keep:]:
+                for stale in (path, f"{path}.sha256"):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                removed.append(path)
+
+        # Сегменты нужны только для наката на оставшиеся поколения
+        base_seqs = [self.base_seq(path) for path in glob.glob(os.path.join(self.directory, 'barbershop_*.db.gz'))]
+        if base_seqs:
+            oldest_base_seq = min(base_seqs)
+            for segment in self.segments():
+                if segment['last_seq'] <= oldest_base_seq:
+                    os.remove(segment['path'])
+                    removed.append(segment['path'])
+        return removed
+
+class DatabaseWriter(threading.Thread):
+    """🎯 ЕДИНСТВЕННЫЙ ПОТОК ЗАПИСИ С ГРУППОВЫМ КОММИТОМ
+
+    Операции записи - функции operation(conn), которые поток выполняет
+    пакетами в одной транзакции (каждая под своим SAVEPOINT), после чего
+    делает один COMMIT и разрешает future каждой операции.
+    """
+
+    def __init__(self, db_path, batch_window=config.WRITE_BATCH_WINDOW, max_batch=config.WRITE_MAX_BATCH, attach=None, tuning=None):
+        super().__init__(name="db-writer", daemon=True)
+        self.db_path = db_path
+        self.attach = attach or {}
+        self.tuning = tuning or get_tuning_profile()
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.conn = None
+        self._ready = threading.Event()
+        self._stopped = False
+        self.stats = {'operations': 0, 'failed': 0, 'commits': 0, 'max_batch': 0}
+        self.last_commit_at = time.monotonic()
+        self._op_hooks = None
+
+    def start(self):
+        super().start()
+        self._ready.wait(timeout=15)
+        return self
+
+    def submit(self, operation):
+        """Ставит операцию в очередь записи, возвращает Future с ее результатом"""
+        future = Future()
+        if threading.current_thread() is self:
+            # Вложенная запись из операции - выполняем в текущей транзакции
+            try:
+                future.set_result(operation(self.conn))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._stopped:
+            future.set_exception(sqlite3.OperationalError("Поток записи остановлен"))
+            return future
+        self.queue.put((operation, future))
+        return future
+
+    def after_commit(self, callback):
+        """Из выполняемой операции: callback() будет вызван в потоке записи
+        сразу после COMMIT ее пакета, до разрешения future
+
+        Колбэки выполняются в порядке коммита операций, поэтому состояние
+        в памяти, которое они обновляют, меняется в том же порядке, что и БД.
+        Если операция откатилась, ее колбэки отбрасываются.
+        """
+        if threading.current_thread() is not self or self._op_hooks is None:
+            raise RuntimeError("after_commit вызывается только из операции записи")
+        self._op_hooks.append(callback)
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self.queue.put(None)
+        if threading.current_thread() is not self:
+            self.join(timeout=15)
+
+    def run(self):
+        try:
+            self.conn = connect_sqlite(self.db_path, isolation_level=None, timeout=config.DB_BUSY_TIMEOUT)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            apply_tuning(self.conn, self.tuning)
+            self.conn.execute('PRAGMA foreign_keys=ON')
+            # Checkpoint делает WalCheckpointer, а не COMMIT на пути запроса
+            self.conn.execute('PRAGMA wal_autocheckpoint=0')
+            for schema, path in self.attach.items():
+                self.conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+        except Exception as e:
+            logger.error(f"❌ Поток записи не смог подключиться к БД: {e}")
+            self._stopped = True
+            self._ready.set()
+            self._fail_pending(e)
+            return
+        self._ready.set()
+        logger.info("✅ Поток записи БД запущен")
+
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            if not self._commit_batch(batch):
+                # Соединение неисправно: поток завершается, и следующая запись
+                # через Database.submit_operation откроет соединения заново
+                self._stopped = True
+                break
+
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self._fail_pending(sqlite3.OperationalError("Поток записи остановлен"))
+        logger.info("✅ Поток записи БД остановлен")
+
+    def _commit_batch(self, batch):
+        """Выполняет пакет операций в одной транзакции
+
+        Любой сбой пакета отклоняет его еще не разрешенные future, чтобы
+        вызывающие не ждали .result() вечно. Возвращает False, если после
+        сбоя не удалось откатить транзакцию - соединением пользоваться нельзя.
+        """
+        try:
+            self._run_batch(batch)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Сбой пакета записи ({len(batch)} операций): {e}")
+            for _, future in batch:
+                if not future.done():
+                    self.stats['failed'] += 1
+                    future.set_exception(e)
+            try:
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
+                return True
+            except Exception as rollback_error:
+                logger.error(f"❌ Соединение записи неисправно, поток записи останавливается: {rollback_error}")
+                return False
+
+    def _run_batch(self, batch):
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except Exception as e:
+            logger.error(f"❌ Не удалось начать транзакцию записи: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        results = []
+        for operation, future in batch:
+            self.conn.execute('SAVEPOINT write_op')
+            self._op_hooks = []
+            try:
+                result = operation(self.conn)
+                self.conn.execute('RELEASE write_op')
+                results.append((future, result, None, self._op_hooks))
+            except Exception as e:
+                self.conn.execute('ROLLBACK TO write_op')
+                self.conn.execute('RELEASE write_op')
+                results.append((future, None, e, []))
+            finally:
+                self._op_hooks = None
+
+        try:
+            self.conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"❌ Ошибка группового коммита ({len(batch)} операций): {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            # Откат делает _commit_batch: если он не удастся, поток остановится
+            raise
+
+        self.last_commit_at = time.monotonic()
+        self.stats['commits'] += 1
+        self.stats['operations'] += len(batch)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        for _, _, _, hooks in results:
+            for callback in hooks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработчика после коммита: {e}")
+        for future, result, error, _ in results:
+            if error is not None:
+                self.stats['failed'] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _fail_pending(self, error):
+        """Отклоняет операции, оставшиеся в очереди"""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[1].set_exception(error)
+
+class ReadPool:
+    """🎯 ПУЛ СОЕДИНЕНИЙ ТОЛЬКО ДЛЯ ЧТЕНИЯ
+
+    В режиме WAL читатели не ждут ни поток записи, ни checkpoint, поэтому
+    SELECT-запросы обработчиков, health-check и заданий идут через пул.
+    """
+
+    def __init__(self, db_path, size=config.READ_POOL_SIZE, attach=None, tuning=None):
+        self.db_path = db_path
+        self.size = size
+        self.attach = attach or {}
+        self.tuning = tuning or get_tuning_profile()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        conn = connect_sqlite(self.db_path, check_same_thread=False, timeout=config.DB_BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only=ON')
+        apply_tuning(conn, self.tuning, cache_size=self.tuning['read_cache_size'])
+        for schema, path in self.attach.items():
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return self._idle.get(timeout=30)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение из пула и возвращает его после использования"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            if not isinstance(e, sqlite3.OperationalError):
+                # Поврежденное соединение не возвращаем в пул
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._closed:
+                    self._discard(conn)
+                else:
+                    self._idle.put(conn)
+
+    def close(self):
+        """Закрывает все свободные соединения пула"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+class WalCheckpointer(threading.Thread):
+    """🎯 ФОНОВЫЙ CHECKPOINT WAL
+
+    В простое переносит WAL в основной файл через PASSIVE checkpoint
+    (не ждет ни читателей, ни писателя). RESTART - если PASSIVE несколько
+    раз подряд не успевает из-за читателей, TRUNCATE - если WAL вырос
+    больше порога.
+    """
+
+    def __init__(self, db_path, writer, interval=config.WAL_CHECK_INTERVAL, idle_seconds=config.WAL_IDLE_SECONDS,
+                 restart_after_busy=config.WAL_RESTART_AFTER_BUSY, truncate_size_kb=config.WAL_TRUNCATE_SIZE_KB):
+        super().__init__(name="db-checkpoint", daemon=True)
+        self.db_path = db_path
+        self.writer = writer
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.restart_after_busy = restart_after_busy
+        self.truncate_size_kb = truncate_size_kb
+        self._wake = threading.Event()
+        self._stopped = False
+        self._checkpointed_commits = 0
+        self._busy_in_row = 0
+        self.stats = {
+            'checkpoints': 0, 'passive': 0, 'restart': 0, 'truncate': 0, 'busy': 0,
+            'last_mode': None, 'last_duration_ms': 0.0, 'max_duration_ms': 0.0,
+            'wal_pages': 0, 'checkpointed_pages': 0, 'wal_size_kb': 0
+        }
+
+    def wal_size_kb(self):
+        """Текущий размер файла WAL в KB"""
+        try:
+            return os.path.getsize(self.db_path + '-wal') // 1024
+        except OSError:
+            return 0
+
+    def stop(self):
+        """Останавливает поток, перед выходом переносит WAL целиком"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        if threading.current_thread() is not self:
+            self.join(timeout=15)
+
+    def run(self):
+        try:
+            conn = connect_sqlite(self.db_path, isolation_level=None, timeout=config.DB_BUSY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"❌ Фоновый checkpoint не смог подключиться к БД: {e}")
+            return
+        logger.info("✅ Фоновый checkpoint WAL запущен")
+
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            if self._stopped:
+                break
+            try:
+                mode = self._choose_mode()
+                if mode:
+                    self.checkpoint(conn, mode)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка фонового checkpoint: {e}")
+
+        try:
+            self.checkpoint(conn, 'TRUNCATE')
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка checkpoint при остановке: {e}")
+        conn.close()
+        logger.info("✅ Фоновый checkpoint WAL остановлен")
+
+    def _choose_mode(self):
+        """Выбирает режим checkpoint или None, если сейчас он не нужен"""
+        wal_size_kb = self.wal_size_kb()
+        self.stats['wal_size_kb'] = wal_size_kb
+        if wal_size_kb >= self.truncate_size_kb:
+            return 'TRUNCATE'
+        if self.writer.stats['commits'] == self._checkpointed_commits:
+            return None  # новых записей нет
+        if time.monotonic() - self.writer.last_commit_at < self.idle_seconds:
+            return None  # идут записи - ждем простоя
+        if self._busy_in_row >= self.restart_after_busy:
+            return 'RESTART'
+        return 'PASSIVE'
+
+    def checkpoint(self, conn, mode):
+        """Выполняет checkpoint и обновляет метрики"""
+        commits = self.writer.stats['commits']
+        started = time.monotonic()
+        busy, log_pages, checkpointed_pages = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        duration_ms = (time.monotonic() - started) * 1000
+
+        self.stats['checkpoints'] += 1
+        self.stats[mode.lower()] += 1
+        self.stats['last_mode'] = mode
+        self.stats['last_duration_ms'] = duration_ms
+        self.stats['max_duration_ms'] = max(self.stats['max_duration_ms'], duration_ms)
+        self.stats['wal_pages'] = max(log_pages, 0)
+        self.stats['checkpointed_pages'] = max(checkpointed_pages, 0)
+        self.stats['wal_size_kb'] = self.wal_size_kb()
+
+        if busy or checkpointed_pages < log_pages:
+            # Читатели держат старые страницы - попробуем позже
+            self.stats['busy'] += 1
+            self._busy_in_row += 1
+        else:
+            self._busy_in_row = 0
+            self._checkpointed_commits = commits
+
+        if mode != 'PASSIVE':
+            logger.info(f"🔄 WAL checkpoint {mode}: {checkpointed_pages}/{log_pages} страниц за {duration_ms:.1f} ms")
+
+class BackupScheduler(threading.Thread):
+    """🎯 ОТЛОЖЕННЫЙ BACKUP ПОСЛЕ ИЗМЕНЕНИЙ
+
+    Изменения только помечают БД как измененную (mark_dirty), а поток
+    делает один backup на все изменения за окно window секунд и
+    последний backup при остановке.
+    """
+
+    def __init__(self, backup_func, window=config.BACKUP_DEBOUNCE_SECONDS):
+        super().__init__(name="db-backup-scheduler", daemon=True)
+        self.backup_func = backup_func
+        self.window = window
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._dirty = False
+        self.stats = {'marked': 0, 'coalesced': 0, 'backups': 0, 'not_created': 0, 'last_reason': None}
+
+    def mark_dirty(self, reason):
+        """Помечает БД как измененную, backup будет сделан в конце окна"""
+        with self._lock:
+            self.stats['marked'] += 1
+            if self._dirty:
+                self.stats['coalesced'] += 1
+            self._dirty = True
+            self.stats['last_reason'] = reason
+        self._wake.set()
+
+    def stop(self):
+        """Останавливает поток, сделав backup несохраненных изменений"""
+        self._stop_event.set()
+        self._wake.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=60)
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            # Копим изменения в течение окна (остановка прерывает ожидание)
+            self._stop_event.wait(self.window)
+            self._wake.clear()
+            self._flush()
+            if self._stop_event.is_set():
+                return
+
+    def _flush(self):
+        """Делает backup, если с прошлого были изменения"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            reason = self.stats['last_reason']
+        try:
+            created = self.backup_func()
+        except Exception as e:
+            logger.error(f"❌ Ошибка отложенного backup: {e}")
+            created = None
+        if created:
+            self.stats['backups'] += 1
+            logger.info(f"💾 Отложенный backup создан после {reason}")
+        else:
+            self.stats['not_created'] += 1
+
+def memory_uri(name):
+    """URI общей БД в памяти: все соединения процесса с этим именем видят одни данные"""
+    return f"file:{name}?mode=memory&cache=shared"
+
+class Database:
+    def __init__(self, db_path=None, tuning_profile=None, backup_dir=None, backup_enabled=True):
+        """db_path - файл SQLite или URI общей БД в памяти (см. storage.parse_database_url),
+        tuning_profile - имя профиля из config.TUNING_PROFILES, backup_dir - каталог
+        backup вместо config.BACKUP_DIR, backup_enabled=False - без backup и без
+        восстановления из него уже при открытии БД"""
         self.database_url = config.DATABASE_URL
-        self.max_retries = 3
-        self.retry_delay = 0.1
+        self.tuning = get_tuning_profile(tuning_profile)
+        self.retry_policy = RetryPolicy()
+        self.supervisor = ConnectionSupervisor()
+        self.availability = AvailabilityIndex()
+        self._schedule_snapshot = None
+        self._schedule_lock = threading.Lock()
+        self._recover_lock = threading.Lock()
+        self._archive_ready = False
         self.conn = None
-        self.db_path = get_database_path()
+        self.writer = None
+        self.readers = None
+        self.checkpointer = None
+        self.query_stats = QueryStats()
+        self.db_path = get_database_path(db_path) if db_path else get_database_path()
+        self.in_memory = 'mode=memory' in self.db_path
+        self.manifest_path = f"{self.db_path}.manifest.json"
         self.last_backup_time = None
-        self.backup_enabled = True
+        self.backup_enabled = backup_enabled and not self.in_memory
+        self._memory_anchors = []
+        if self.in_memory:
+            # 🎯 БД В ПАМЯТИ: АРХИВ ТОЖЕ В ПАМЯТИ, BACKUP И МАНИФЕСТ НЕ НУЖНЫ
+            # Общая БД в памяти живет, пока открыто хотя бы одно соединение
+            # с ней, поэтому держим по соединению на время жизни объекта
+            self.archive_path = memory_uri(f"{self.db_path[5:].split('?')[0]}_archive")
+            self._memory_anchors = [connect_sqlite(path, check_same_thread=False)
+                                    for path in (self.db_path, self.archive_path)]
+        else:
+            # Архив рядом с БД и с ее именем: у каждой БД в каталоге свой архив
+            self.archive_path = f"{os.path.splitext(self.db_path)[0]}_archive.db"
+        # Backup выполняются по одному в отдельном потоке
+        self._backup_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-backup")
+        # Обслуживание - в своем потоке: optimize и quick_check не задерживают backup
+        self._maintenance_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-maintenance")
+        self.backup_store = BackupStore(backup_dir or config.BACKUP_DIR)
+        self._force_full_backup = False
+        self.backup_scheduler = BackupScheduler(self.create_scheduled_backup)
+        self.backup_scheduler.start()
         
         # 🎯 ДОБАВЛЯЕМ ДЕТАЛЬНУЮ ДИАГНОСТИКУ ПРИ ИНИЦИАЛИЗАЦИИ
         logger.info("🎯 ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ")
         logger.info(f"📁 Путь к БД: {self.db_path}")
+        logger.info(f"⚙️ Профиль настройки SQLite: {self.tuning['name']}")
         logger.info(f"📊 Файл существует: {os.path.exists(self.db_path)}")
         
         if os.path.exists(self.db_path):
             size = os.path.getsize(self.db_path)
             logger.info(f"📏 Размер БД: {size} bytes ({size/1024/1024:.2f} MB)")
         
-        self.reconnect()
+        # 🎯 ПОСЛЕ ЧИСТОЙ ОСТАНОВКИ ДОВЕРЯЕМ МАНИФЕСТУ, ПОСЛЕ АВАРИЙНОЙ - ПОЛНАЯ ПРОВЕРКА
+        started = time.monotonic()
+        self.startup_manifest = self._read_manifest()
+        self.reconnect(probe=self.startup_manifest is None)
+        self.ensure_config_admins()
+        self.startup_seconds = time.monotonic() - started
+        logger.info(f"✅ БД готова за {self.startup_seconds:.3f} с ({'чистый старт по манифесту' if self.startup_manifest else 'полная проверка'})")
     
-    def reconnect(self):
-        """Переподключается к базе данных с повторными попытками"""
-        for attempt in range(self.max_retries):
+    def reconnect(self, probe=False):
+        """Переподключается к базе данных с повторными попытками
+
+        probe - проверить данные и при необходимости восстановиться из backup
+        даже для БД с актуальной схемой (старт после аварийного завершения).
+        """
+        for attempt in range(self.retry_policy.max_retries):
             try:
                 if self.conn:
                     try:
@@ -86,31 +1308,23 @@ class Database:
                     file_size = os.path.getsize(self.db_path) if db_file_exists else 0
                     logger.info(f"📏 Размер файла БД: {file_size} bytes")
                 
-                self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-                self.conn.row_factory = sqlite3.Row
-                
-                # Оптимизации для SQLite
-                self.conn.execute('PRAGMA journal_mode=WAL')
-                self.conn.execute('PRAGMA synchronous=NORMAL')
-                self.conn.execute('PRAGMA cache_size=-64000')
-                self.conn.execute('PRAGMA foreign_keys=ON')
-                self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                previous_version = self._connect_main()
+                self._open_connections()
                 
-                self.create_tables()
-                self.update_database_structure()
-                self.create_admin_tables()
-                self.setup_default_notifications()
-                self.setup_default_schedule()
+                # 🎯 БД С АКТУАЛЬНОЙ СХЕМОЙ НЕ ПРОВЕРЯЕМ - ВОССТАНОВЛЕНИЕ НУЖНО ТОЛЬКО НОВОЙ БД
+                if previous_version > 0 and not probe:
+                    logger.info("✅ Успешное подключение к SQLite")
+                    return
                 
                 # 🎯 УЛУЧШЕННОЕ ВОССТАНОВЛЕНИЕ ИЗ BACKUP
-                backup_path = "/tmp/barbershop_latest_backup.db"
-                backup_exists = os.path.exists(backup_path)
+                latest_backup = self.backup_store.latest()
+                backup_exists = latest_backup is not None
                 
-                logger.info(f"🔍 Backup файл существует: {backup_exists}")
+                logger.info(f"🔍 Backup существует: {backup_exists}")
                 backup_size = 0
                 if backup_exists:
-                    backup_size = os.path.getsize(backup_path)
-                    logger.info(f"📏 Размер backup: {backup_size} bytes")
+                    backup_size = latest_backup['size_kb']
+                    logger.info(f"📏 Последний backup: {os.path.basename(latest_backup['path'])} ({backup_size} KB)")
                 
                 # 🎯 ИСПРАВЛЕНИЕ: Проверяем что это действительно первый запуск
                 current_data_exists = self.has_data()
@@ -129,18 +1343,98 @@ class Database:
                 return
                 
             except sqlite3.OperationalError as e:
-                if "locked" in str(e) and attempt < self.max_retries - 1:
-                    logger.warning(f"⚠️ База данных заблокирована, попытка {attempt + 1}/{self.max_retries}")
-                    time.sleep(self.retry_delay)
+                if RetryPolicy.is_locked(e) and self.retry_policy.retry(attempt):
+                    logger.warning(f"⚠️ База данных заблокирована, попытка {attempt + 1}/{self.retry_policy.max_retries}")
                     continue
                 raise
             except Exception as e:
                 logger.error(f"❌ Ошибка подключения к SQLite: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
+                if attempt < self.retry_policy.max_retries - 1 and self.retry_policy.backoff(attempt):
                     continue
                 raise
 
+    def _connect_main(self):
+        """Открывает основное соединение и применяет миграции, возвращает прежнюю версию схемы"""
+        self.conn = connect_sqlite(self.db_path, check_same_thread=False, timeout=self.retry_policy.busy_timeout, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        
+        # Оптимизации для SQLite: page_size и auto_vacuum действуют только
+        # для новой БД, поэтому идут до перехода в WAL и создания таблиц
+        self.conn.execute(f"PRAGMA page_size={int(self.tuning['page_size'])}")
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        apply_tuning(self.conn, self.tuning)
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        
+        return self.migrate()
+
+    def _read_manifest(self):
+        """🎯 ЧИТАЕТ И СРАЗУ УДАЛЯЕТ МАНИФЕСТ ЧИСТОЙ ОСТАНОВКИ
+
+        Манифест принимается, только если файл БД не менялся после остановки.
+        Удаление при старте означает, что после аварийного завершения
+        манифеста не будет и следующий старт пройдет с полной проверкой.
+        """
+        if self.in_memory:
+            return None
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logger.info("🔍 Манифест чистой остановки не найден - полная проверка БД")
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Манифест чистой остановки поврежден: {e}")
+            manifest = None
+        
+        try:
+            os.remove(self.manifest_path)
+        except OSError:
+            pass
+        
+        if not manifest or not manifest.get('clean_shutdown'):
+            return None
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        if stat.st_size != manifest.get('db_size') or stat.st_mtime_ns != manifest.get('db_mtime_ns'):
+            logger.warning("⚠️ Файл БД изменился после остановки - манифест не используется")
+            return None
+        
+        logger.info(f"✅ Манифест чистой остановки: схема v{manifest['schema_version']}, "
+                   f"записей {manifest['appointments']}, пользователей {manifest['users']}")
+        return manifest
+
+    def _write_manifest(self, schema_version, appointments, users):
+        """Записывает манифест чистой остановки (после закрытия всех соединений)"""
+        stat = os.stat(self.db_path)
+        manifest = {
+            'schema_version': schema_version,
+            'appointments': appointments,
+            'users': users,
+            'clean_shutdown': True,
+            'closed_at': get_moscow_time().isoformat(),
+            'db_size': stat.st_size,
+            'db_mtime_ns': stat.st_mtime_ns
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def get_startup_info(self):
+        """Как прошел старт: по манифесту или с полной проверкой, и за сколько"""
+        manifest = self.startup_manifest or {}
+        return {
+            'clean_start': self.startup_manifest is not None,
+            'startup_seconds': self.startup_seconds,
+            'schema_version': manifest.get('schema_version'),
+            'appointments': manifest.get('appointments'),
+            'users': manifest.get('users'),
+            'closed_at': manifest.get('closed_at')
+        }
+
     def has_data(self):
         """🎯 ИСПРАВЛЕННАЯ ПРОВЕРКА НАЛИЧИЯ ДАННЫХ В БД"""
         try:
@@ -155,7 +1449,7 @@ class Database:
                 return False
             
             # Пробуем подключиться и проверить таблицы
-            test_conn = sqlite3.connect(self.db_path)
+            test_conn = connect_sqlite(self.db_path)
             cursor = test_conn.cursor()
             
             # Проверяем существование основных таблиц
@@ -189,153 +1483,466 @@ class Database:
             logger.error(f"❌ Ошибка при проверке данных в БД: {e}")
             return False
 
-    def restore_from_backup(self):
-        """🎯 УЛУЧШЕННОЕ ВОССТАНОВЛЕНИЕ ИЗ BACKUP"""
+    def execute_with_retry(self, conn, query, params=(), fetch=None):
+        """Выполняет запрос на conn с повторными попытками при блокировке
+
+        Прочие ошибки БД не повторяются и не переподключают БД: они
+        отмечаются в supervisor, и после нескольких отказов подряд пул
+        пересоздает следующий запрос (см. _recover).
+
+        fetch='one' или 'all' сразу читает результат - тогда чтение строк
+        входит в задержку в query_stats; без fetch возвращается курсор.
+        """
+        started = time.monotonic()
+        lock_wait = 0.0
+        retries = 0
+        rows = 0
+        failed = True
         try:
-            if not self.backup_enabled:
-                logger.info("⏩ Восстановление отключено")
-                return False
-        
-            backup_path = "/tmp/barbershop_latest_backup.db"
-        
-            if not os.path.exists(backup_path):
-                logger.info("⏩ Нет backup файла для восстановления")
-                return False
-        
-            # 🎯 ПРОВЕРЯЕМ ЦЕЛОСТЬ BACKUP ФАЙЛА
-            backup_size = os.path.getsize(backup_path)
-            logger.info(f"🔍 Размер backup файла: {backup_size} bytes")
-        
-            if backup_size < 1024:  # Меньше 1KB
-                logger.error("❌ Backup файл слишком мал - вероятно поврежден")
-                return False
-        
-            # 🎯 ПРОВЕРЯЕМ СОДЕРЖИМОЕ BACKUP ФАЙЛА
+            for attempt in range(self.retry_policy.max_retries):
+                attempt_started = time.monotonic()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(query, params)
+                    if fetch == 'one':
+                        result = cursor.fetchone()
+                        rows = int(result is not None)
+                    elif fetch == 'all':
+                        result = cursor.fetchall()
+                        rows = len(result)
+                    else:
+                        result = cursor
+                        rows = cursor.rowcount
+                    failed = False
+                    self.supervisor.record_success()
+                    return result
+                except sqlite3.OperationalError as e:
+                    if RetryPolicy.is_locked(e):
+                        lock_wait += time.monotonic() - attempt_started
+                        # 🎯 В ПОТОКЕ EVENT LOOP НЕ ЖДЕМ: ОШИБКА ТОЛЬКО У ЭТОГО ЗАПРОСА
+                        if self.retry_policy.retry(attempt):
+                            logger.warning(f"⚠️ База заблокирована, повторная попытка {attempt + 1}")
+                            retries += 1
+                            continue
+                    raise
+        except sqlite3.DatabaseError as e:
+            self.supervisor.record_failure(e)
+            raise
+        finally:
+            self.query_stats.record(query, (time.monotonic() - started) * 1000, rows, retries, lock_wait * 1000, failed)
+
+    def _reader_pool(self):
+        if self.supervisor.needs_reconnect():
+            self._recover()
+        if self.readers is None:
+            self._open_connections()
+        return self.readers
+
+    def _recover(self):
+        """🎯 ЛЕНИВОЕ ПЕРЕПОДКЛЮЧЕНИЕ: ВЫЗЫВАЕТСЯ ЗАПРОСОМ, ПРИШЕДШИМ ПОСЛЕ ОТКАЗА"""
+        with self._recover_lock:
+            # Пока ждали блокировку, переподключиться мог другой поток
+            if not self.supervisor.needs_reconnect():
+                return
+            logger.warning("🔄 Соединение с БД помечено как неисправное - переподключаемся")
+            self.reconnect()
+            self.supervisor.mark_reconnected()
+
+    def _run_maintenance(self):
+        """PRAGMA optimize и quick_check после накопленных записей (в потоке обслуживания)"""
+        try:
+            self.execute_write('PRAGMA optimize')
+            quick_check = self.fetchone('PRAGMA quick_check')[0]
+            if quick_check == 'ok':
+                logger.info("✅ Обслуживание БД: optimize выполнен, quick_check ok")
+            else:
+                logger.error(f"❌ quick_check нашел проблемы: {quick_check}")
+                self.supervisor.record_failure(sqlite3.DatabaseError(f"quick_check: {quick_check}"))
+        except Exception as e:
+            logger.error(f"❌ Ошибка обслуживания БД: {e}")
+            quick_check = f"ошибка: {e}"
+        self.supervisor.maintenance_done(quick_check)
+
+    def get_health(self):
+        """Состояние соединения, ошибки, переподключения и последнее обслуживание"""
+        return self.supervisor.get_stats()
+
+    def fetchone(self, query, params=()):
+        """Выполняет SELECT на соединении из пула чтения, возвращает одну строку"""
+        with self._reader_pool().connection() as conn:
+            return self.execute_with_retry(conn, query, params, fetch='one')
+
+    def fetchall(self, query, params=()):
+        """Выполняет SELECT на соединении из пула чтения, возвращает все строки"""
+        with self._reader_pool().connection() as conn:
+            return self.execute_with_retry(conn, query, params, fetch='all')
+
+    def ping(self):
+        """Быстрая проверка БД через пул чтения (не ждет поток записи)"""
+        try:
+            self.fetchone('SELECT 1')
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Проверка соединения с БД не прошла: {e}")
+            return False
+
+    def _open_connections(self):
+        """Запускает (или перезапускает) поток записи и пул чтения"""
+        self._close_connections()
+        # Схема архива проверяется один раз за жизнь объекта, переподключение только делает ATTACH
+        if not self._archive_ready:
+            self._ensure_archive()
+            self._archive_ready = True
+        attach = {'archive': self.archive_path}
+        self.writer = DatabaseWriter(self.db_path, attach=attach, tuning=self.tuning).start()
+        self.readers = ReadPool(self.db_path, attach=attach, tuning=self.tuning)
+        # У БД в памяти нет WAL-файла
+        if not self.in_memory:
+            self.checkpointer = WalCheckpointer(self.db_path, self.writer)
+            self.checkpointer.start()
+
+    # Версия схемы файла архива (PRAGMA user_version в самом архиве)
+    ARCHIVE_SCHEMA_VERSION = 1
+
+    def _ensure_archive(self):
+        """Создает файл архива и таблицу appointments_archive, если схема архива устарела
+
+        Архив с актуальной user_version не получает DDL - теплый старт только читает версию.
+        """
+        conn = connect_sqlite(self.archive_path, timeout=self.retry_policy.busy_timeout, isolation_level=None)
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= self.ARCHIVE_SCHEMA_VERSION:
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS appointments_archive (
+                    id INTEGER PRIMARY KEY,
+                    user_id BIGINT,
+                    user_name TEXT,
+                    user_username TEXT,
+                    phone TEXT,
+                    service TEXT,
+                    appointment_date TEXT,
+                    appointment_time TEXT,
+                    starts_at INTEGER,
+                    created_at TIMESTAMP,
+                    archived_at INTEGER
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_starts_at ON appointments_archive (starts_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_user_starts_at ON appointments_archive (user_id, starts_at)')
+            conn.execute(f'PRAGMA user_version = {int(self.ARCHIVE_SCHEMA_VERSION)}')
+            conn.execute('COMMIT')
+            logger.info(f"✅ Схема архива создана (версия {self.ARCHIVE_SCHEMA_VERSION})")
+        finally:
+            conn.close()
+
+    def _close_connections(self):
+        """Останавливает поток записи, дописав очередь, и закрывает пул чтения"""
+        if self.writer:
+            self.writer.stop()
+            self.writer = None
+        if self.checkpointer:
+            self.checkpointer.stop()
+            self.checkpointer = None
+        if self.readers:
+            self.readers.close()
+            self.readers = None
+
+    def get_query_stats(self, limit=config.QUERY_STATS_TOP, order_by='total_ms'):
+        """Самые дорогие запросы по отпечатку SQL"""
+        return self.query_stats.top(limit, order_by)
+
+    def get_retry_stats(self):
+        """Счетчики блокировок и повторов (вместе с асинхронным слоем)"""
+        return self.retry_policy.get_stats()
+
+    def get_wal_stats(self):
+        """Метрики фонового checkpoint и размер WAL"""
+        if not self.checkpointer:
+            return {}
+        stats = dict(self.checkpointer.stats)
+        stats['wal_size_kb'] = self.checkpointer.wal_size_kb()
+        return stats
+
+    def submit_write(self, query, params=()):
+        """Ставит изменяющий запрос в очередь записи, возвращает Future с rowcount"""
+        def operation(conn):
+            started = time.monotonic()
+            rowcount = conn.execute(query, params).rowcount
+            self.query_stats.record(query, (time.monotonic() - started) * 1000, rowcount)
+            return rowcount
+        return self.submit_operation(operation)
+
+    def submit_operation(self, operation):
+        """Ставит операцию operation(conn) в очередь записи, возвращает Future"""
+        if self.supervisor.needs_reconnect():
+            self._recover()
+        if self.writer is None or not self.writer.is_alive():
+            self._open_connections()
+        
+        def supervised(conn):
             try:
-                import sqlite3
-                test_conn = sqlite3.connect(backup_path)
-                cursor = test_conn.cursor()
-            
-                # Проверяем основные таблицы в backup
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                backup_tables = [row[0] for row in cursor.fetchall()]
-                
-                required_tables = ['appointments', 'bot_users', 'bot_admins']
-                missing_tables = [table for table in required_tables if table not in backup_tables]
-                
-                if missing_tables:
-                    logger.error(f"❌ Backup файл не содержит необходимые таблицы: {missing_tables}")
-                    test_conn.close()
-                    return False
-                
-                # Проверяем данные в backup
-                cursor.execute('SELECT COUNT(*) FROM appointments')
-                backup_appointments = cursor.fetchone()[0]
-            
-                cursor.execute('SELECT COUNT(*) FROM bot_users')
-                backup_users = cursor.fetchone()[0]
-            
-                test_conn.close()
-            
-                logger.info(f"🔍 Данные в backup: таблиц={len(backup_tables)}, записей={backup_appointments}, пользователей={backup_users}")
-            
-                if backup_appointments == 0:
-                    logger.info("⏩ Backup файл не содержит записей - восстановление не требуется")
-                    return False
-                
+                result = operation(conn)
             except sqlite3.DatabaseError as e:
-                logger.error(f"❌ Backup файл поврежден: {e}")
-                return False
-            
-            logger.info(f"🔄 Восстанавливаем из backup: {backup_path} ({backup_size} bytes)")
-        
-            # 🎯 ЗАКРЫВАЕМ СОЕДИНЕНИЕ ПРАВИЛЬНО
-            if self.conn:
+                self.supervisor.record_failure(e)
+                raise
+            if self.supervisor.record_success(write=True):
+                # Поток записи не ждет обслуживание - оно уходит в свой поток
                 try:
-                    self.conn.close()
-                except:
-                    pass
-                self.conn = None
-        
-            # 🎯 СОЗДАЕМ РЕЗЕРВНУЮ КОПИЮ ТЕКУЩЕЙ БД (НА ВСЯКИЙ СЛУЧАЙ)
-            try:
-                if os.path.exists(self.db_path):
-                    backup_current = f"{self.db_path}.backup_before_restore"
-                    import shutil
-                    shutil.copy2(self.db_path, backup_current)
-                    logger.info(f"✅ Создана резервная копия текущей БД: {backup_current}")
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось создать резервную копию текущей БД: {e}")
-        
-            # 🎯 УДАЛЯЕМ СТАРУЮ БД ЕСЛИ СУЩЕСТВУЕТ
+                    self._maintenance_worker.submit(self._run_maintenance)
+                except RuntimeError:
+                    pass  # БД закрывается
+            return result
+        return self.writer.submit(supervised)
+
+    def execute_write(self, query, params=()):
+        """Выполняет изменяющий запрос через поток записи, возвращает rowcount"""
+        return self.submit_write(query, params).result()
+
+    def run_write(self, operation):
+        """Выполняет операцию operation(conn) в потоке записи и возвращает ее результат"""
+        return self.submit_operation(operation).result()
+
+    @staticmethod
+    def after_commit(callback):
+        """Из операции записи: callback() выполнится после COMMIT, в порядке коммитов (DatabaseWriter.after_commit)"""
+        threading.current_thread().after_commit(callback)
+
+    # 🎯 МИГРАЦИИ СХЕМЫ: (версия PRAGMA user_version, описание, метод)
+    # Новые шаги только добавляются в конец, примененные не меняются
+    MIGRATIONS = (
+        (1, "базовая схема", '_migration_baseline'),
+        (2, "индексы для частых запросов", '_migration_indexes'),
+        (3, "уникальный слот записи", '_migration_unique_slot'),
+        (4, "поколения backup", '_migration_backup_generations'),
+        (5, "журнал изменений для инкрементального backup", '_migration_changelog'),
+        (6, "время начала записи в минутах эпохи", '_migration_starts_at'),
+        (7, "признак ручной записи", '_migration_is_manual'),
+        (8, "день недели и минута начала записи", '_migration_weekday_minute'),
+    )
+
+    # Таблицы, изменения которых пишутся в changelog
+    CHANGELOG_TABLES = ('appointments', 'work_schedule', 'bot_admins', 'admin_settings', 'scheduled_reminders')
+
+    def migrate(self):
+        """🎯 ПРИМЕНЯЕТ НЕДОСТАЮЩИЕ МИГРАЦИИ, ВОЗВРАЩАЕТ ВЕРСИЮ СХЕМЫ ДО МИГРАЦИИ"""
+        current_version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        latest_version = self.MIGRATIONS[-1][0]
+        
+        if current_version >= latest_version:
+            logger.info(f"✅ Схема БД актуальна (версия {current_version})")
+            return current_version
+        
+        for version, description, method_name in self.MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            logger.info(f"🔄 Миграция БД до версии {version}: {description}")
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
             try:
-                if os.path.exists(self.db_path):
-                    os.remove(self.db_path)
-                    logger.info("✅ Старая БД удалена")
+                getattr(self, method_name)(cursor)
+                cursor.execute(f'PRAGMA user_version = {int(version)}')
+                cursor.execute('COMMIT')
             except Exception as e:
-                logger.error(f"❌ Ошибка удаления старой БД: {e}")
-                return False
-        
-            # Копируем backup
-            import shutil
-            shutil.copy2(backup_path, self.db_path)
-            logger.info("✅ Бэкап скопирован")
-        
-            # 🎯 ПЕРЕСОЗДАЕМ СОЕДИНЕНИЕ К НОВОЙ БД
-            self.reconnect()
-        
-            # 🎯 ПРОВЕРЯЕМ ЧТО ДАННЫЕ ВОССТАНОВИЛИСЬ
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            restored_appointments = cursor.fetchone()[0]
-        
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            restored_users = cursor.fetchone()[0]
-        
-            logger.info(f"✅ Восстановление завершено! Записей: {restored_appointments}, пользователей: {restored_users}")
+                cursor.execute('ROLLBACK')
+                logger.error(f"❌ Ошибка миграции до версии {version}: {e}")
+                raise
         
-            return True
+        logger.info(f"✅ Схема БД обновлена: {current_version} → {latest_version}")
+        return current_version
+
+    def _migration_baseline(self, cursor):
+        """Миграция 1: таблицы, колонки старых версий и данные по умолчанию"""
+        self.create_tables(cursor)
+        self.update_database_structure(cursor)
+        self.create_admin_tables(cursor)
+        self.setup_default_notifications(cursor)
+        self.setup_default_schedule(cursor)
+
+    def _migration_indexes(self, cursor):
+        """Миграция 2: индексы под HOT_QUERIES и очистку старых данных"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_date_time ON appointments (appointment_date, appointment_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_date_time ON appointments (user_id, appointment_date, appointment_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_sent_time ON scheduled_reminders (sent, scheduled_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_appointment_sent ON scheduled_reminders (appointment_id, sent)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bot_users_last_seen ON bot_users (last_seen)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_backup_metadata_timestamp ON backup_metadata (timestamp)')
+        logger.info("✅ Индексы созданы")
+
+    def _migration_unique_slot(self, cursor):
+        """Миграция 3: UNIQUE(appointment_date, appointment_time) вместо таблицы schedule"""
+        # Дубли, появившиеся до ограничения, переносим в отдельную таблицу;
+        # она создается, только если дубли есть
+        has_duplicates = cursor.execute('''
+            SELECT 1 FROM appointments
+            GROUP BY appointment_date, appointment_time
+            HAVING COUNT(*) > 1
+            LIMIT 1
+        ''').fetchone()
+        moved_count = 0
+        if has_duplicates:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS appointments_duplicates AS
+                SELECT * FROM appointments
+                WHERE id NOT IN (
+                    SELECT MIN(id) FROM appointments
+                    GROUP BY appointment_date, appointment_time
+                )
+            ''')
+            cursor.execute('DELETE FROM appointments WHERE id IN (SELECT id FROM appointments_duplicates)')
+            moved_count = cursor.rowcount
+            cursor.execute('DELETE FROM scheduled_reminders WHERE appointment_id IN (SELECT id FROM appointments_duplicates)')
         
-        except Exception as e:
-            logger.error(f"❌ Ошибка при восстановлении из backup: {e}")
-            import traceback
-            logger.error(f"❌ Traceback: {traceback.format_exc()}")
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_slot ON appointments (appointment_date, appointment_time)')
+        cursor.execute('DROP INDEX IF EXISTS idx_appointments_date_time')
+        cursor.execute('DROP TABLE IF EXISTS schedule')
         
-            # Пытаемся восстановить оригинальную БД
-            try:
-                self.reconnect()
-                logger.info("✅ Восстановлено соединение с оригинальной БД")
-            except:
-                logger.error("❌ Не удалось восстановить соединение с БД")
-            
-            return False
+        if moved_count > 0:
+            logger.warning(f"⚠️ {moved_count} дублирующихся записей перенесено в appointments_duplicates")
+        logger.info("✅ Слот записи защищен уникальным индексом")
+
+    def _migration_backup_generations(self, cursor):
+        """Миграция 4: поколение, контрольная сумма и исходный размер backup"""
+        cursor.execute('ALTER TABLE backup_metadata ADD COLUMN generation TEXT')
+        cursor.execute('ALTER TABLE backup_metadata ADD COLUMN checksum TEXT')
+        cursor.execute('ALTER TABLE backup_metadata ADD COLUMN raw_size_kb INTEGER')
+
+    def _migration_changelog(self, cursor):
+        """Миграция 5: таблица changelog и триггеры, которые ее заполняют"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changelog (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                op TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                row_data TEXT,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self._create_changelog_triggers(cursor)
+
+    def _migration_starts_at(self, cursor):
+        """Миграция 6: appointments.starts_at - минуты эпохи (UTC) по дате и времени записи
+
+        Колонка вычисляемая, поэтому всегда совпадает с appointment_date и
+        appointment_time, а существующие строки не нужно заполнять отдельно.
+        """
+        offset_minutes = int(config.TIMEZONE_OFFSET) * 60
+        cursor.execute(f'''
+            ALTER TABLE appointments ADD COLUMN starts_at INTEGER
+            GENERATED ALWAYS AS (
+                CAST(strftime('%s', appointment_date || ' ' || appointment_time) AS INTEGER) / 60 - {offset_minutes}
+            ) VIRTUAL
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_starts_at ON appointments (starts_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_starts_at ON appointments (user_id, starts_at)')
+        cursor.execute('DROP INDEX IF EXISTS idx_appointments_user_date_time')
+
+    def _migration_is_manual(self, cursor):
+        """Миграция 7: appointments.is_manual - запись внесена администратором вручную"""
+        cursor.execute('ALTER TABLE appointments ADD COLUMN is_manual INTEGER NOT NULL DEFAULT 0')
+        self._create_changelog_triggers(cursor)
+        # Ручные записи раньше отличались только по user_username
+        cursor.execute("UPDATE appointments SET is_manual = 1 WHERE user_username = 'admin_manual'")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_manual_starts_at ON appointments (is_manual, starts_at)')
 
-    def execute_with_retry(self, query, params=()):
-        """Выполняет запрос с повторными попытками при блокировке"""
-        for attempt in range(self.max_retries):
+    def _migration_weekday_minute(self, cursor):
+        """Миграция 8: вычисляемые день недели и минута начала записи для поиска конфликтов графика
+
+        weekday считается как datetime.weekday() (понедельник - 0), start_minute -
+        минуты от полуночи. Колонки VIRTUAL и в changelog не попадают.
+        """
+        cursor.execute('''
+            ALTER TABLE appointments ADD COLUMN weekday INTEGER
+            GENERATED ALWAYS AS ((CAST(strftime('%w', appointment_date) AS INTEGER) + 6) % 7) VIRTUAL
+        ''')
+        cursor.execute('''
+            ALTER TABLE appointments ADD COLUMN start_minute INTEGER
+            GENERATED ALWAYS AS (CAST(substr(appointment_time, 1, 2) AS INTEGER) * 60 + CAST(substr(appointment_time, 4, 2) AS INTEGER)) VIRTUAL
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_weekday_minute ON appointments (weekday, start_minute, starts_at)')
+
+    def _create_changelog_triggers(self, cursor):
+        """🎯 ПЕРЕСОЗДАЕТ ТРИГГЕРЫ changelog ПО ТЕКУЩИМ КОЛОНКАМ ТАБЛИЦ
+
+        Миграции, меняющие колонки таблиц из CHANGELOG_TABLES, должны
+        вызывать этот метод, иначе новые колонки не попадут в журнал.
+        """
+        for table in self.CHANGELOG_TABLES:
+            columns = cursor.execute(f'PRAGMA table_info({table})').fetchall()
+            names = [column[1] for column in columns]
+            key = [column[1] for column in sorted(columns, key=lambda column: column[5]) if column[5] > 0]
+            
+            def row_json(ref, cols):
+                return 'json_object(' + ', '.join(f"'{col}', {ref}.{col}" for col in cols) + ')'
+            
+            # Ключ - по OLD для UPDATE/DELETE, данные - новая версия строки
+            for op, key_ref, data in (
+                ('INSERT', 'NEW', row_json('NEW', names)),
+                ('UPDATE', 'OLD', row_json('NEW', names)),
+                ('DELETE', 'OLD', 'NULL'),
+            ):
+                trigger = f'changelog_{table}_{op.lower()}'
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                cursor.execute(f'''
+                    CREATE TRIGGER {trigger} AFTER {op} ON {table}
+                    BEGIN
+                        INSERT INTO changelog (table_name, op, row_key, row_data)
+                        VALUES ('{table}', '{op}', {row_json(key_ref, key)}, {data});
+                    END
+                ''')
+        logger.info(f"✅ Триггеры журнала изменений созданы для {len(self.CHANGELOG_TABLES)} таблиц")
+
+    def check_query_plans(self):
+        """🎯 ПРОВЕРЯЕТ ПЛАНЫ HOT_QUERIES, ВОЗВРАЩАЕТ ЗАПРОСЫ С ПОЛНЫМ СКАНИРОВАНИЕМ ТАБЛИЦЫ"""
+        problems = []
+        for name, query in HOT_QUERIES.items():
             try:
-                if not self.conn:
-                    self.reconnect()
-                    
-                cursor = self.conn.cursor()
-                cursor.execute(query, params)
-                return cursor
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e) and attempt < self.max_retries - 1:
-                    logger.warning(f"⚠️ База заблокирована, повторная попытка {attempt + 1}")
-                    time.sleep(self.retry_delay * (attempt + 1))
-                    continue
-                raise
-            except sqlite3.DatabaseError as e:
-                logger.error(f"❌ Ошибка базы данных, переподключаемся: {e}")
-                self.reconnect()
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                raise
+                params = (None,) * query.count('?')
+                plan = self.fetchall(f'EXPLAIN QUERY PLAN {query}', params)
+                for row in plan:
+                    detail = row['detail']
+                    # SCAN CONSTANT ROW и SCAN (subquery-N) - не чтение таблицы
+                    if detail.startswith('SCAN ') and 'USING' not in detail and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (')):
+                        problems.append(f"{name}: {detail}")
+            except Exception as e:
+                problems.append(f"{name}: ошибка проверки плана ({e})")
+        
+        if problems:
+            for problem in problems:
+                logger.warning(f"⚠️ Полное сканирование таблицы: {problem}")
+        else:
+            logger.info(f"✅ Планы запросов в порядке ({len(HOT_QUERIES)} запросов)")
+        return problems
+
+    def ensure_config_admins(self):
+        """Добавляет администраторов из config.ADMIN_IDS, которых еще нет в БД"""
+        try:
+            known_admins = {row[0] for row in self.fetchall('SELECT admin_id FROM bot_admins')}
+            missing_admins = [admin_id for admin_id in config.ADMIN_IDS if admin_id not in known_admins]
+            if not missing_admins:
+                return
+            
+            def insert(conn):
+                for admin_id in missing_admins:
+                    conn.execute('''
+                        INSERT OR IGNORE INTO bot_admins (admin_id, username, first_name, last_name, added_by)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (admin_id, 'system', 'Система', 'Администратор', 0))
+                    conn.execute('''
+                        INSERT OR IGNORE INTO admin_settings (admin_id, notification_chat_id)
+                        VALUES (?, ?)
+                    ''', (admin_id, admin_id))
+            
+            self.run_write(insert)
+            logger.info(f"✅ Добавлены администраторы из конфигурации: {missing_admins}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка добавления администраторов из конфигурации: {e}")
 
-    def create_tables(self):
+    def create_tables(self, cursor):
         """Создает все необходимые таблицы"""
-        cursor = self.conn.cursor()
         
         # Таблица appointments
         cursor.execute('''
@@ -431,46 +2038,38 @@ class Database:
                 backup_path TEXT,
                 error_message TEXT
             )
-        ''')
-        
-        self.conn.commit()
-        logger.info("✅ Таблицы успешно созданы/проверены")
-
-    def update_database_structure(self):
-        """Обновляет структуру базы данных"""
-        cursor = self.conn.cursor()
-        
-        try:
-            cursor.execute("PRAGMA table_info(appointments)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'reminder_24h_sent' not in columns:
-                cursor.execute('ALTER TABLE appointments ADD COLUMN reminder_24h_sent BOOLEAN DEFAULT FALSE')
-                logger.info("✅ Добавлена колонка reminder_24h_sent")
-            
-            if 'reminder_1h_sent' not in columns:
-                cursor.execute('ALTER TABLE appointments ADD COLUMN reminder_1h_sent BOOLEAN DEFAULT FALSE')
-                logger.info("✅ Добавлена колонка reminder_1h_sent")
-                
-            self.conn.commit()
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка при обновлении структуры БД: {e}")
-            self.conn.rollback()
+        ''')
+        
+        logger.info("✅ Таблицы успешно созданы/проверены")
+
+    def update_database_structure(self, cursor):
+        """Добавляет колонки, которых нет в БД старых версий"""
+        cursor.execute("PRAGMA table_info(appointments)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'phone' not in columns:
+            cursor.execute('ALTER TABLE appointments ADD COLUMN phone TEXT')
+            logger.info("✅ Добавлена колонка phone")
+        
+        if 'reminder_24h_sent' not in columns:
+            cursor.execute('ALTER TABLE appointments ADD COLUMN reminder_24h_sent BOOLEAN DEFAULT FALSE')
+            logger.info("✅ Добавлена колонка reminder_24h_sent")
+        
+        if 'reminder_1h_sent' not in columns:
+            cursor.execute('ALTER TABLE appointments ADD COLUMN reminder_1h_sent BOOLEAN DEFAULT FALSE')
+            logger.info("✅ Добавлена колонка reminder_1h_sent")
 
     def create_backup(self):
-        """🎯 СОЗДАЕТ ЛОКАЛЬНЫЙ BACKUP (ПЕРЕЗАПИСЫВАЕТ СУЩЕСТВУЮЩИЙ)"""
+        """🎯 СОЗДАЕТ СЖАТОЕ ПОКОЛЕНИЕ BACKUP, ВОЗВРАЩАЕТ ЕГО ПУТЬ"""
         try:
             if not self.backup_enabled:
                 logger.info("⏩ Backup отключен")
                 return None
         
             # 🎯 ПРОВЕРЯЕМ ЧТО В БД ЕСТЬ ДАННЫЕ ДЛЯ БЭКАПА
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            appointments_count = cursor.fetchone()[0]
+            appointments_count = self.fetchone('SELECT COUNT(*) FROM appointments')[0]
         
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            users_count = cursor.fetchone()[0]
+            users_count = self.fetchone('SELECT COUNT(*) FROM bot_users')[0]
         
             if appointments_count == 0 and users_count == 0:
                 logger.info("⏩ Нет данных для бэкапа")
@@ -478,79 +2077,34 @@ class Database:
         
             logger.info(f"💾 Создание backup (записей: {appointments_count}, пользователей: {users_count})...")
         
-            backup_path = "/tmp/barbershop_latest_backup.db"
-
-            # 🎯 ВАЖНО: ДЕЛАЕМ COMMIT ПЕРЕД БЭКАПОМ
-            self.conn.commit()
-            logger.info("✅ Транзакция закоммичена перед backup")
-            
             # 🎯 ПРОВЕРЯЕМ РАЗМЕР ОСНОВНОЙ БД ПЕРЕД BACKUP
             original_size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
             logger.info(f"📊 Размер основной БД перед backup: {original_size} bytes")
 
-            # 🎯 ДИАГНОСТИКА: ПРОБУЕМ СОЗДАТЬ ТЕСТОВЫЙ ФАЙЛ
-            try:
-                test_file = "/tmp/test_backup_write.db"
-                with open(test_file, 'w') as f:
-                    f.write('test')
-                os.unlink(test_file)
-                logger.info("✅ /tmp/ доступен для записи")
-            except Exception as e:
-                logger.error(f"❌ /tmp/ НЕ доступен для записи: {e}")
-                return None
-        
-            # Копируем файл БД (перезаписываем существующий)
-            import shutil
-            shutil.copy2(self.db_path, backup_path)
-            logger.info("✅ Файл скопирован через shutil.copy2")
-
-            # 🎯 ДИАГНОСТИКА: ПРОВЕРЯЕМ РЕЗУЛЬТАТ КОПИРОВАНИЯ
-            if os.path.exists(backup_path):
-                backup_size = os.path.getsize(backup_path)
-                logger.info(f"✅ Файл backup создан: {backup_size} bytes")
-            
-                if backup_size == 0:
-                    logger.error("❌ Бэкап файл пустой!")
-                    return None
-                
-                logger.info(f"📊 ДИАГНОСТИКА: оригинал={original_size} bytes, backup={backup_size} bytes")
-                
-                # 🎯 ПРОВЕРЯЕМ ЧТО BACKUP СОДЕРЖИТ ДАННЫЕ
-                try:
-                    import sqlite3
-                    test_conn = sqlite3.connect(backup_path)
-                    test_cursor = test_conn.cursor()
-                    test_cursor.execute('SELECT COUNT(*) FROM appointments')
-                    backup_appointments = test_cursor.fetchone()[0]
-                    test_cursor.execute('SELECT COUNT(*) FROM bot_users')
-                    backup_users = test_cursor.fetchone()[0]
-                    test_conn.close()
-                    
-                    logger.info(f"🔍 ПРОВЕРКА BACKUP: {backup_appointments} записей, {backup_users} пользователей")
-                    
-                    if backup_appointments == 0:
-                        logger.error("❌ Backup файл создан, но не содержит записей!")
-                        return None
-                        
-                except Exception as e:
-                    logger.error(f"❌ Ошибка проверки backup файла: {e}")
-                    return None
-            else:
-                logger.error("❌ Бэкап файл не создался после shutil.copy2!")
-                return None
+            # 🎯 КОПИЯ ЧЕРЕЗ backup API И СЖАТИЕ В ПОТОКЕ BACKUP
+            started = time.monotonic()
+            generation = self._backup_worker.submit(self._write_backup_generation).result()
+            raw_size_kb = generation['raw_size'] // 1024
+            size_kb = generation['size'] // 1024
+            logger.info(f"✅ Backup сжат за {time.monotonic() - started:.2f} с: {raw_size_kb} KB → {size_kb} KB")
+            for removed_path in generation['removed']:
+                logger.info(f"🗑 Удалено старое поколение backup: {os.path.basename(removed_path)}")
         
             # Сохраняем информацию о backup в БД
-            cursor = self.execute_with_retry('''
-                INSERT INTO backup_metadata 
-                (backup_type, size_kb, success, backup_path) 
-                VALUES (?, ?, ?, ?)
-            ''', ('auto_backup', backup_size // 1024, True, backup_path))
-        
-            self.conn.commit()
+            def insert(conn):
+                for kind, path in generation['created']:
+                    conn.execute('''
+                        INSERT INTO backup_metadata 
+                        (backup_type, size_kb, success, backup_path, generation, checksum, raw_size_kb) 
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', ('auto_backup', size_kb, True, path, kind, generation['checksum'], raw_size_kb))
+            
+            self.run_write(insert)
         
             self.last_backup_time = get_moscow_time()
-            logger.info(f"✅ Локальный backup создан/обновлен: {backup_path} ({backup_size} bytes)")
-            return backup_path
+            self._force_full_backup = False
+            logger.info(f"✅ Локальный backup создан: {generation['path']}")
+            return generation['path']
         
         except Exception as e:
             logger.error(f"❌ Ошибка создания локального backup: {e}")
@@ -558,106 +2112,183 @@ class Database:
             logger.error(f"❌ Traceback: {traceback.format_exc()}")
         
             try:
-                cursor = self.execute_with_retry('''
+                self.execute_write('''
                     INSERT INTO backup_metadata 
                     (backup_type, success, error_message) 
                     VALUES (?, ?, ?)
                 ''', ('auto_backup', False, str(e)))
-                self.conn.commit()
             except:
                 pass
         
             return None
 
-    def restore_from_backup(self):
-        """🎯 ВОССТАНОВЛЕНИЕ ИЗ ЛОКАЛЬНОГО BACKUP"""
+    def create_incremental_backup(self):
+        """🎯 ВЫГРУЖАЕТ НОВЫЕ ЗАПИСИ changelog В СЕГМЕНТ, ВОЗВРАЩАЕТ ЕГО ПУТЬ"""
+        try:
+            if not self.backup_enabled:
+                logger.info("⏩ Backup отключен")
+                return None
+            return self._backup_worker.submit(self._ship_changelog).result()
+        except Exception as e:
+            logger.error(f"❌ Ошибка инкрементального backup: {e}")
+            return None
+
+    def create_scheduled_backup(self):
+        """Полный снимок раз в BACKUP_BASE_INTERVAL, между ними - сегменты журнала"""
+        latest_backup = self.backup_store.latest()
+        if (self._force_full_backup or latest_backup is None
+                or time.time() - latest_backup['mtime'] >= config.BACKUP_BASE_INTERVAL):
+            return self.create_backup()
+        return self.create_incremental_backup()
+
+    def _ship_changelog(self):
+        """Записывает в сегмент еще не выгруженные изменения и удаляет их из changelog"""
+        after_seq = self.backup_store.last_shipped_seq()
+        rows = self.fetchall('''
+            SELECT seq, table_name, op, row_key, row_data, changed_at
+            FROM changelog WHERE seq > ? ORDER BY seq
+        ''', (after_seq,))
+        if not rows:
+            return None
+
+        segment = self.backup_store.save_segment([dict(row) for row in rows])
+        # Выгруженные изменения больше не нужны в БД
+        self.execute_write('DELETE FROM changelog WHERE seq <= ?', (segment['last_seq'],))
+        logger.info(f"💾 Сегмент журнала: {len(rows)} изменений (seq {segment['first_seq']}-{segment['last_seq']}), {segment['size']} bytes")
+        return segment['path']
+
+    def mark_dirty(self, reason):
+        """Планирует отложенный backup после изменения данных"""
+        if self.backup_enabled:
+            self.backup_scheduler.mark_dirty(reason)
+
+    def get_backup_scheduler_stats(self):
+        """Метрики отложенного backup"""
+        return dict(self.backup_scheduler.stats)
+
+    def _write_backup_generation(self):
+        """Снимает копию БД через backup API и сжимает ее в поколение"""
+        # Сначала выгружаем журнал, чтобы сегменты шли без пропусков
+        self._ship_changelog()
+        fd, snapshot_path = tempfile.mkstemp(dir=self.backup_store.directory, suffix='.snapshot.db')
+        os.close(fd)
+        try:
+            copy_database(self.db_path, snapshot_path)
+            snapshot = sqlite3.connect(snapshot_path)
+            try:
+                row = snapshot.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+            finally:
+                snapshot.close()
+            return self.backup_store.save(snapshot_path, get_moscow_time(), row[0] if row else 0)
+        finally:
+            os.remove(snapshot_path)
+
+    def restore_from_backup(self, backup_path=None, until=None):
+        """🎯 ВОССТАНОВЛЕНИЕ ИЗ ПОКОЛЕНИЯ BACKUP (ПО УМОЛЧАНИЮ - ПОСЛЕДНЕГО)
+
+        На снимок накатываются сегменты журнала изменений; until (UTC,
+        'YYYY-MM-DD HH:MM:SS') останавливает накат на этом моменте.
+        Архив (archive_path) не восстанавливается - см. archive_appointments.
+        """
         try:
             if not self.backup_enabled:
                 logger.info("⏩ Восстановление отключено")
                 return False
         
-            backup_path = "/tmp/barbershop_latest_backup.db"
-        
-            if not os.path.exists(backup_path):
-                logger.info("⏩ Нет backup файла для восстановления")
-                return False
-        
-            # 🎯 ПРОВЕРЯЕМ РАЗМЕР BACKUP ФАЙЛА
-            backup_size = os.path.getsize(backup_path)
-            logger.info(f"🔍 Размер backup файла: {backup_size} bytes")
-        
-            if backup_size == 0:
-                logger.info("⏩ Backup файл пустой - восстановление не требуется")
+            if backup_path is None:
+                latest_backup = self.backup_store.latest()
+                if not latest_backup:
+                    logger.info("⏩ Нет backup для восстановления")
+                    return False
+                backup_path = latest_backup['path']
+            elif not os.path.exists(backup_path):
+                logger.info(f"⏩ Backup не найден: {backup_path}")
                 return False
         
-            # 🎯 ПРОВЕРЯЕМ СОДЕРЖИМОЕ BACKUP ФАЙЛА
+            # 🎯 РАСПАКОВЫВАЕМ С ПРОВЕРКОЙ КОНТРОЛЬНОЙ СУММЫ
+            restore_path = self.backup_store.extract(backup_path)
             try:
-                import sqlite3
-                test_conn = sqlite3.connect(backup_path)
-                cursor = test_conn.cursor()
-            
-                # Проверяем таблицы в backup
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='appointments'")
-                if not cursor.fetchone():
-                    logger.error("❌ Backup файл не содержит таблицу appointments")
+                # 🎯 ПРОВЕРЯЕМ СОДЕРЖИМОЕ BACKUP
+                try:
+                    test_conn = sqlite3.connect(restore_path)
+                    cursor = test_conn.cursor()
+                
+                    # Проверяем основные таблицы в backup
+                    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                    backup_tables = [row[0] for row in cursor.fetchall()]
+                    
+                    required_tables = ['appointments', 'bot_users', 'bot_admins']
+                    missing_tables = [table for table in required_tables if table not in backup_tables]
+                    
+                    if missing_tables:
+                        logger.error(f"❌ Backup не содержит необходимые таблицы: {missing_tables}")
+                        test_conn.close()
+                        return False
+                    
+                    # Проверяем данные в backup
+                    cursor.execute('SELECT COUNT(*) FROM appointments')
+                    backup_appointments = cursor.fetchone()[0]
+                
+                    cursor.execute('SELECT COUNT(*) FROM bot_users')
+                    backup_users = cursor.fetchone()[0]
+                
                     test_conn.close()
-                    return False
                 
-                # Проверяем данные в backup
-                cursor.execute('SELECT COUNT(*) FROM appointments')
-                backup_appointments = cursor.fetchone()[0]
-            
-                cursor.execute('SELECT COUNT(*) FROM bot_users')
-                backup_users = cursor.fetchone()[0]
-            
-                test_conn.close()
-            
-                logger.info(f"🔍 Данные в backup: {backup_appointments} записей, {backup_users} пользователей")
-            
-                if backup_appointments == 0:
-                    logger.info("⏩ Backup файл пустой (нет записей) - восстановление не требуется")
+                    logger.info(f"🔍 Данные в backup: {backup_appointments} записей, {backup_users} пользователей")
+                
+                    if backup_appointments == 0:
+                        logger.info("⏩ Backup не содержит записей - восстановление не требуется")
+                        return False
+                    
+                except sqlite3.DatabaseError as e:
+                    logger.error(f"❌ Backup поврежден: {e}")
                     return False
                 
-            except Exception as e:
-                logger.error(f"❌ Ошибка проверки backup файла: {e}")
-                return False
+                # 🎯 НАКАТЫВАЕМ ИЗМЕНЕНИЯ, СДЕЛАННЫЕ ПОСЛЕ СНИМКА
+                replayed = self._replay_changes(restore_path, self.backup_store.base_seq(backup_path), until)
+                logger.info(f"🔄 Восстанавливаем из backup: {os.path.basename(backup_path)} (+{replayed} изменений из журнала)")
             
-            logger.info(f"🔄 Восстанавливаем из backup: {backup_path} ({backup_size} bytes)")
-        
-            # 🎯 ЗАКРЫВАЕМ СОЕДИНЕНИЕ ПРАВИЛЬНО
-            if self.conn:
+                # 🎯 ЗАКРЫВАЕМ СОЕДИНЕНИЯ ПРАВИЛЬНО
+                self._close_connections()
+                if self.conn:
+                    try:
+                        self.conn.close()
+                    except:
+                        pass
+                    self.conn = None
+            
+                # 🎯 СОЗДАЕМ РЕЗЕРВНУЮ КОПИЮ ТЕКУЩЕЙ БД (НА ВСЯКИЙ СЛУЧАЙ)
                 try:
-                    self.conn.close()
-                except:
-                    pass
-                self.conn = None
-        
-            # 🎯 УДАЛЯЕМ СТАРУЮ БД ЕСЛИ СУЩЕСТВУЕТ
-            try:
-                if os.path.exists(self.db_path):
-                    os.remove(self.db_path)
-                    logger.info("✅ Старая БД удалена")
-            except Exception as e:
-                logger.error(f"❌ Ошибка удаления старой БД: {e}")
-                return False
-        
-            # Копируем backup
-            import shutil
-            shutil.copy2(backup_path, self.db_path)
-            logger.info("✅ Бэкап скопирован")
+                    if os.path.exists(self.db_path):
+                        backup_current = f"{self.db_path}.backup_before_restore"
+                        copy_database(self.db_path, backup_current)
+                        logger.info(f"✅ Создана резервная копия текущей БД: {backup_current}")
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось создать резервную копию текущей БД: {e}")
+            
+                # 🎯 ПЕРЕНОСИМ BACKUP В БД ЧЕРЕЗ backup API: ФАЙЛ НЕ УДАЛЯЕТСЯ,
+                # ПОЭТОМУ БД И ЕЕ WAL НЕ РАСХОДЯТСЯ
+                copy_database(restore_path, self.db_path)
+                logger.info("✅ Бэкап перенесен в БД")
+            finally:
+                os.remove(restore_path)
         
-            # 🎯 ПЕРЕСОЗДАЕМ СОЕДИНЕНИЕ К НОВОЙ БД
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-            self.conn.row_factory = sqlite3.Row
+            # 🎯 ПЕРЕСОЗДАЕМ СОЕДИНЕНИЯ К НОВОЙ БД (BACKUP МОЖЕТ БЫТЬ СТАРОЙ ВЕРСИИ)
+            self._connect_main()
+            self._open_connections()
         
             # 🎯 ПРОВЕРЯЕМ ЧТО ДАННЫЕ ВОССТАНОВИЛИСЬ
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM appointments')
-            restored_appointments = cursor.fetchone()[0]
+            restored_appointments = self.fetchone('SELECT COUNT(*) FROM appointments')[0]
         
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-            restored_users = cursor.fetchone()[0]
+            restored_users = self.fetchone('SELECT COUNT(*) FROM bot_users')[0]
         
             logger.info(f"✅ Восстановление завершено! Записей: {restored_appointments}, пользователей: {restored_users}")
+            
+            # Старые сегменты относятся к прежнему снимку - следующий backup полный
+            self._force_full_backup = True
+            self.availability.invalidate()
+            self._schedule_snapshot = None
+            self.mark_dirty("восстановления из backup")
         
             return True
         
@@ -666,124 +2297,138 @@ class Database:
             import traceback
             logger.error(f"❌ Traceback: {traceback.format_exc()}")
         
-            # Пытаемся восстановить оригинальную БД
-            try:
-                self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
-                self.conn.row_factory = sqlite3.Row
-                logger.info("✅ Восстановлено соединение с оригинальной БД")
-            except:
-                logger.error("❌ Не удалось восстановить соединение с БД")
+            # Пытаемся восстановить соединение с БД
+            if self.conn is None:
+                try:
+                    self._connect_main()
+                    self._open_connections()
+                    logger.info("✅ Восстановлено соединение с оригинальной БД")
+                except:
+                    logger.error("❌ Не удалось восстановить соединение с БД")
             
             return False
 
+    def _replay_changes(self, restore_path, base_seq, until=None):
+        """Накатывает на распакованный снимок изменения из сегментов, возвращает их число"""
+        conn = sqlite3.connect(restore_path, isolation_level=None)
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changelog'").fetchone():
+                logger.info("⏩ Снимок без журнала изменений - накат не выполняется")
+                return 0
+            
+            columns = {
+                table: {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                for table in self.CHANGELOG_TABLES
+            }
+            applied = 0
+            last_seq = base_seq
+            conn.execute('BEGIN')
+            try:
+                for record in self.backup_store.read_changes(base_seq):
+                    if until and record['changed_at'] > until:
+                        break
+                    if record['seq'] != last_seq + 1:
+                        logger.warning(f"⚠️ Пропуск в журнале изменений после seq {last_seq} - накат остановлен")
+                        break
+                    self._apply_change(conn, record, columns)
+                    last_seq = record['seq']
+                    applied += 1
+                
+                # Записи, созданные триггерами при накате, уже есть в сегментах.
+                # Новые seq начинаются после всех выгруженных, чтобы сегменты не пересекались
+                conn.execute('DELETE FROM changelog')
+                next_base = max(last_seq, self.backup_store.last_shipped_seq())
+                if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'changelog'", (next_base,)).rowcount:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('changelog', ?)", (next_base,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return applied
+        finally:
+            conn.close()
+
+    def _apply_change(self, conn, record, columns):
+        """Применяет одну запись журнала: UPDATE - как удаление старой строки и вставка новой"""
+        table = record['table_name']
+        if table not in columns:
+            raise ValueError(f"неизвестная таблица в журнале изменений: {table}")
+        
+        if record['op'] in ('UPDATE', 'DELETE'):
+            key = json.loads(record['row_key'])
+            where = ' AND '.join(f'{column} = ?' for column in key)
+            conn.execute(f'DELETE FROM {table} WHERE {where}', tuple(key.values()))
+        
+        if record['op'] in ('INSERT', 'UPDATE'):
+            # Колонки, добавленные более поздними миграциями, снимок еще не знает
+            data = {column: value for column, value in json.loads(record['row_data']).items() if column in columns[table]}
+            placeholders = ', '.join('?' for _ in data)
+            conn.execute(f'INSERT OR REPLACE INTO {table} ({", ".join(data)}) VALUES ({placeholders})', tuple(data.values()))
+
+    def inspect_backup(self, backup_path=None):
+        """Распаковывает поколение backup и считает в нем записи и пользователей"""
+        try:
+            if backup_path is None:
+                latest_backup = self.backup_store.latest()
+                if not latest_backup:
+                    return None
+                backup_path = latest_backup['path']
+            
+            restore_path = self.backup_store.extract(backup_path)
+            try:
+                test_conn = sqlite3.connect(restore_path)
+                try:
+                    appointments = test_conn.execute('SELECT COUNT(*) FROM appointments').fetchone()[0]
+                    users = test_conn.execute('SELECT COUNT(*) FROM bot_users').fetchone()[0]
+                finally:
+                    test_conn.close()
+            finally:
+                os.remove(restore_path)
+            
+            return {'path': backup_path, 'appointments': appointments, 'users': users}
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки backup {backup_path}: {e}")
+            return None
+
     def get_backup_status(self):
         """Получает статус последних backup"""
         try:
-            cursor = self.execute_with_retry('''
-                SELECT timestamp, size_kb, success, backup_path, error_message
-                FROM backup_metadata 
-                ORDER BY timestamp DESC 
-                LIMIT 5
-            ''')
-            
-            return cursor.fetchall()
+            return self.fetchall(HOT_QUERIES['backup_history'])
         except Exception as e:
             logger.error(f"❌ Ошибка получения статуса backup: {e}")
             return []
 
     def get_backup_files_info(self):
-        """🎯 ИСПРАВЛЕННАЯ: Получает информацию о backup файлах"""
+        """🎯 Поколения backup от новых к старым"""
         try:
-            backup_path = "/tmp/barbershop_latest_backup.db"
-            files_info = []
-    
-            logger.info(f"🔍 Поиск backup файла: {backup_path}")
-            logger.info(f"📁 Файл существует: {os.path.exists(backup_path)}")
-        
-            if os.path.exists(backup_path):
-                file_size = os.path.getsize(backup_path) / 1024  # KB
-                file_time = os.path.getmtime(backup_path)
-                file_date = datetime.fromtimestamp(file_time).strftime("%d.%m.%Y %H:%M")
-        
-                files_info.append({
-                    'path': backup_path,
-                    'size_kb': round(file_size, 1),
-                    'date': file_date
-                })
-            
-                logger.info(f"✅ Найден backup файл: {file_size:.1f} KB, {file_date}")
-            else:
-                logger.warning("⚠️ Backup файл не найден!")
-            
-                # 🎯 ПОИСК ВСЕХ ФАЙЛОВ BACKUP В /tmp/
-                import glob
-                backup_patterns = [
-                    "/tmp/barbershop_latest_backup.db",
-                    "/tmp/barbershop_latest_backup.db.*",
-                    "/tmp/barbershop_backup_*.db"
-                ]
-            
-                for pattern in backup_patterns:
-                    found_files = glob.glob(pattern)
-                    for file_path in found_files:
-                        if os.path.isfile(file_path):
-                            file_size = os.path.getsize(file_path) / 1024  # KB
-                            file_time = os.path.getmtime(file_path)
-                            file_date = datetime.fromtimestamp(file_time).strftime("%d.%m.%Y %H:%M")
-                        
-                            files_info.append({
-                                'path': file_path,
-                                'size_kb': round(file_size, 1),
-                                'date': file_date
-                            })
-                            logger.info(f"🔍 Найден альтернативный backup: {os.path.basename(file_path)} - {file_size:.1f} KB")
-    
-            logger.info(f"📊 Итого найдено backup файлов: {len(files_info)}")
+            files_info = self.backup_store.generations()
+            logger.info(f"📊 Поколений backup: {len(files_info)}")
             return files_info
-        
         except Exception as e:
-            logger.error(f"❌ Ошибка получения информации о backup файле: {e}")
+            logger.error(f"❌ Ошибка получения информации о backup: {e}")
             return []
 
-    def create_admin_tables(self):
-        """Создает таблицу для администраторов"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bot_admins (
-                admin_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                added_by BIGINT
-            )
-        ''')
-        
+    def create_admin_tables(self, cursor):
+        """Добавляет администраторов из конфигурации"""
         for admin_id in config.ADMIN_IDS:
             cursor.execute('''
                 INSERT OR IGNORE INTO bot_admins (admin_id, username, first_name, last_name, added_by)
                 VALUES (?, ?, ?, ?, ?)
             ''', (admin_id, 'system', 'Система', 'Администратор', 0))
         
-        self.conn.commit()
         logger.info("✅ Таблица администраторов создана/проверена")
 
-    def setup_default_notifications(self):
+    def setup_default_notifications(self, cursor):
         """Настраивает уведомления по умолчанию для администраторов"""
-        cursor = self.conn.cursor()
         for admin_id in config.ADMIN_IDS:
             cursor.execute('''
                 INSERT OR IGNORE INTO admin_settings (admin_id, notification_chat_id)
                 VALUES (?, ?)
             ''', (admin_id, admin_id))
-        self.conn.commit()
         logger.info("✅ Настроены уведомления по умолчанию для администраторов")
 
-    def setup_default_schedule(self):
+    def setup_default_schedule(self, cursor):
         """Устанавливает график работы по умолчанию"""
-        cursor = self.conn.cursor()
-        
         cursor.execute('SELECT COUNT(*) FROM work_schedule')
         count = cursor.fetchone()[0]
         
@@ -808,7 +2453,6 @@ class Database:
                     is_working = excluded.is_working
                 ''', (weekday, start_time, end_time, is_working))
             
-            self.conn.commit()
             logger.info("✅ Установлен график работы по умолчанию")
         else:
             logger.info(f"ℹ️ В таблице work_schedule уже есть {count} записей")
@@ -819,33 +2463,29 @@ class Database:
             # Очищаем прошедшие записи
             cleanup_result = self.cleanup_completed_appointments()
             
-            # Дополнительно: очищаем очень старые записи (> 14 дней) для экономии места
+            # Дополнительно: переносим в архив очень старые записи (> 14 дней)
             moscow_time = get_moscow_time()
-            cutoff_date_14_days = (moscow_time - timedelta(days=14)).strftime("%Y-%m-%d")
-            
-            cursor = self.execute_with_retry('''
-                DELETE FROM appointments 
-                WHERE appointment_date < ?
-            ''', (cutoff_date_14_days,))
-            deleted_old = cursor.rowcount
-            
-            # Очищаем старые напоминания
+            cutoff_date_14_days = local_epoch_minutes((moscow_time - timedelta(days=14)).strftime("%Y-%m-%d"))
             cutoff_datetime = (moscow_time - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
-            cursor = self.execute_with_retry('''
-                DELETE FROM scheduled_reminders 
-                WHERE sent = TRUE AND scheduled_time < ?
-            ''', (cutoff_datetime,))
-            deleted_reminders = cursor.rowcount
-            
-            # Очищаем неактивных пользователей (не заходили 60 дней)
             cutoff_users = (moscow_time - timedelta(days=60)).strftime("%Y-%m-%d %H:%M:%S")
-            cursor = self.execute_with_retry('''
-                DELETE FROM bot_users 
-                WHERE last_seen < ?
-            ''', (cutoff_users,))
-            deleted_users = cursor.rowcount
             
-            self.conn.commit()
+            deleted_old = self.archive_appointments(cutoff_date_14_days)
+            
+            def cleanup(conn):
+                # Очищаем старые напоминания
+                deleted_reminders = conn.execute('''
+                    DELETE FROM scheduled_reminders 
+                    WHERE sent = TRUE AND scheduled_time < ?
+                ''', (cutoff_datetime,)).rowcount
+                
+                # Очищаем неактивных пользователей (не заходили 60 дней)
+                deleted_users = conn.execute('''
+                    DELETE FROM bot_users 
+                    WHERE last_seen < ?
+                ''', (cutoff_users,)).rowcount
+                return deleted_reminders, deleted_users
+            
+            deleted_reminders, deleted_users = self.run_write(cleanup)
             
             total_deleted = (cleanup_result['total_deleted'] + deleted_old + 
                             deleted_reminders + deleted_users)
@@ -876,26 +2516,18 @@ class Database:
             # Создаем backup перед очисткой (без уведомлений)
             self.create_backup()
         
-            # Удаляем очень старые записи (> 7 дней)
+            # Переносим в архив очень старые записи (> 7 дней)
             moscow_time = get_moscow_time()
-            cutoff_date = (moscow_time - timedelta(days=7)).strftime("%Y-%m-%d")
-        
-            cursor = self.execute_with_retry('''
-                DELETE FROM appointments 
-                WHERE appointment_date < ?
-            ''', (cutoff_date,))
-            deleted_appointments = cursor.rowcount
+            cutoff_date = local_epoch_minutes((moscow_time - timedelta(days=7)).strftime("%Y-%m-%d"))
+            deleted_appointments = self.archive_appointments(cutoff_date)
         
             # Очищаем старые backup метаданные
-            cursor = self.execute_with_retry('''
+            deleted_backup_meta = self.execute_write('''
                 DELETE FROM backup_metadata 
                 WHERE timestamp < DATE('now', '-30 days')
             ''')
-            deleted_backup_meta = cursor.rowcount
-        
-            self.conn.commit()
         
-            logger.info(f"🚨 Экстренная очистка: удалено {deleted_appointments} записей, {deleted_backup_meta} backup метаданных")
+            logger.info(f"🚨 Экстренная очистка: в архив {deleted_appointments} записей, удалено {deleted_backup_meta} backup метаданных")
         
             return deleted_appointments + deleted_backup_meta
         
@@ -906,91 +2538,70 @@ class Database:
     def emergency_size_management(self):
         """🎯 ЭКСТРЕННОЕ УПРАВЛЕНИЕ РАЗМЕРОМ БД ПРИ ПРИБЛИЖЕНИИ К ЛИМИТУ"""
         try:
+            if self.in_memory:
+                return 0
             db_size = os.path.getsize(self.db_path) / (1024 * 1024)  # MB
             
-            if db_size > 8:  # Близко к лимиту Render
+            if db_size > config.DB_EMERGENCY_SIZE_MB:  # Близко к лимиту Render
                 logger.warning(f"🚨 Экстренная очистка! Размер БД: {db_size:.1f}MB")
                 
                 # 1. Создаем backup
                 self.create_backup()
                 
-                # 2. Агрессивная очистка
+                # 2. Агрессивный перенос в архив
                 moscow_time = get_moscow_time()
-                cutoff_date = (moscow_time - timedelta(days=3)).strftime("%Y-%m-%d")
-                
-                cursor = self.execute_with_retry('''
-                    DELETE FROM appointments 
-                    WHERE appointment_date < ?
-                ''', (cutoff_date,))
+                cutoff_date = local_epoch_minutes((moscow_time - timedelta(days=3)).strftime("%Y-%m-%d"))
                 
-                deleted = cursor.rowcount
-                self.conn.commit()
+                deleted = self.archive_appointments(cutoff_date)
                 
-                logger.info(f"🚨 Экстренно удалено {deleted} записей")
+                logger.info(f"🚨 Экстренно перенесено в архив {deleted} записей")
                 return deleted
                 
         except Exception as e:
             logger.error(f"❌ Ошибка экстренного управления размером: {e}")
             return 0
     
-    def add_appointment(self, user_id, user_name, user_username, phone, service, date, time):
+    def add_appointment(self, user_id, user_name, user_username, phone, service, date, time, is_manual=False):
         """🎯 ДОБАВЛЯЕТ НОВУЮ ЗАПИСЬ С BACKUP"""
         try:
-            # Проверяем, не занято ли время
-            cursor = self.execute_with_retry('''
-                SELECT COUNT(*) FROM appointments 
-                WHERE appointment_date = ? AND appointment_time = ?
-            ''', (date, time))
-        
-            if cursor.fetchone()[0] > 0:
-                raise Exception("Это время уже занято другим клиентом")
-        
             # 🎯 ДОБАВЛЯЕМ ДИАГНОСТИКУ
             logger.info(f"🔄 СОЗДАНИЕ ЗАПИСИ: {user_name}, {phone}, {service}, {date} {time}")
         
-            cursor = self.execute_with_retry('''
-                INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, user_name, user_username, phone, service, date, time))
+            def insert(conn):
+                # 🎯 ЗАНЯТОСТЬ СЛОТА ПРОВЕРЯЕТ UNIQUE ИНДЕКС - ОДНА АТОМАРНАЯ ОПЕРАЦИЯ
+                rows = conn.execute('''
+                    INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time, is_manual)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (appointment_date, appointment_time) DO NOTHING
+                    RETURNING id
+                ''', (user_id, user_name, user_username, phone, service, date, time, int(is_manual))).fetchall()
+                if not rows:
+                    return None
+                # 🎯 ИНДЕКС СЛОТОВ МЕНЯЕТСЯ В ПОРЯДКЕ КОММИТОВ, А НЕ ВОЗВРАТА В ВЫЗЫВАЮЩИЙ ПОТОК
+                self.after_commit(lambda: self.availability.book(date, time))
+                return rows[0][0]
         
-            appointment_id = cursor.lastrowid
+            # 🎯 ВАЖНО: ЗАПИСЬ КОММИТИТСЯ ПОТОКОМ ЗАПИСИ ДО ВОЗВРАТА
+            appointment_id = self.run_write(insert)
+            if appointment_id is None:
+                raise Exception("Это время уже занято другим клиентом")
             logger.info(f"✅ Запись создана в БД, ID: {appointment_id}")
         
-            self.execute_with_retry('''
-                INSERT OR REPLACE INTO schedule (date, time, available)
-                VALUES (?, ?, ?)
-            ''', (date, time, False))
-        
-            # 🎯 ВАЖНО: КОММИТИМ ТРАНЗАКЦИЮ И СИНХРОНИЗИРУЕМ
-            self.conn.commit()
-            
-            # 🎯 ПРИНУДИТЕЛЬНАЯ СИНХРОНИЗАЦИЯ ДЛЯ SQLite
-            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
-            logger.info("✅ Транзакция закоммичена и синхронизирована")
-        
-            # 🎯 ПРОВЕРЯЕМ ЧТО ЗАПИСЬ ДЕЙСТВИТЕЛЬНО СОХРАНИЛАСЬ
-            cursor = self.execute_with_retry('SELECT COUNT(*) FROM appointments WHERE id = ?', (appointment_id,))
-            exists = cursor.fetchone()[0] > 0
-            logger.info(f"🔍 ПРОВЕРКА ЗАПИСИ #{appointment_id}: {'✅ Существует' if exists else '❌ Не существует'}")
-        
             # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПРИ СОЗДАНИИ НОВОЙ ЗАПИСИ
             if self.backup_enabled:
-                logger.info(f"💾 Автоматический backup после создания записи #{appointment_id}")
-                self.create_backup()
+                self.mark_dirty(f"создания записи #{appointment_id}")
 
             return appointment_id
         
         except Exception as e:
             logger.error(f"❌ Ошибка БД в add_appointment: {e}")
-            # 🎯 ДОБАВЛЯЕМ ОТКАТ ТРАНЗАКЦИИ ПРИ ОШИБКЕ
-            self.conn.rollback()
             logger.error("❌ Транзакция откатана из-за ошибки")
             raise
 
     def add_or_update_user(self, user_id, username, first_name, last_name):
         """Добавляет или обновляет пользователя"""
         try:
-            self.execute_with_retry('''
+            self.execute_write('''
                 INSERT INTO bot_users (user_id, username, first_name, last_name, last_seen)
                 VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
                 ON CONFLICT(user_id) DO UPDATE SET
@@ -999,46 +2610,57 @@ class Database:
                 last_name = excluded.last_name,
                 last_seen = excluded.last_seen
             ''', (user_id, username, first_name, last_name))
-            
-            self.conn.commit()
         except Exception as e:
             logger.error(f"❌ Ошибка БД в add_or_update_user: {e}")
 
     def is_admin(self, user_id):
         """Проверяет, является ли пользователь администратором"""
         try:
-            cursor = self.execute_with_retry('SELECT 1 FROM bot_admins WHERE admin_id = ?', (user_id,))
-            result = cursor.fetchone() is not None
-            return result
+            return self.fetchone('SELECT 1 FROM bot_admins WHERE admin_id = ?', (user_id,)) is not None
         except Exception as e:
             logger.error(f"❌ Ошибка при проверке прав администратора для {user_id}: {e}")
             return False
 
     def get_available_slots(self, date):
         """Получает доступные временные слоты"""
-        cursor = self.execute_with_retry('''
-            SELECT time FROM schedule 
-            WHERE date = ? AND available = FALSE
-        ''', (date,))
-        booked_times = [row[0] for row in cursor.fetchall()]
+        # 🎯 ДЛЯ ДАТ ИЗ ИНДЕКСА - БИТОВАЯ ОПЕРАЦИЯ БЕЗ ОБРАЩЕНИЯ К БД
+        free_slots = self._availability_index().free_slots(date)
+        if free_slots is not None:
+            return free_slots
+        
+        rows = self.fetchall(HOT_QUERIES['booked_times'], (date,))
+        booked_times = [row[0] for row in rows]
         
         date_obj = datetime.strptime(date, "%Y-%m-%d").date()
         weekday = date_obj.weekday()
-        cursor = self.execute_with_retry('''
-            SELECT start_time, end_time, is_working FROM work_schedule 
-            WHERE weekday = ?
-        ''', (weekday,))
-        
-        work_hours = cursor.fetchone()
+        work_hours = self.get_schedule_snapshot().get(weekday)
         
-        if not work_hours or not work_hours[2]:
+        if not work_hours or not work_hours[4]:
             return []
         
-        start_time, end_time = work_hours[0], work_hours[1]
+        start_time, end_time = work_hours[2], work_hours[3]
         all_slots = self.generate_time_slots(start_time, end_time)
         
         return [slot for slot in all_slots if slot not in booked_times]
 
+    def _availability_index(self):
+        """Индекс свободных слотов, построенный при первом обращении"""
+        index = self.availability
+        if not index.built:
+            # Запись или отмена во время построения ждет его окончания и
+            # применяется уже к построенному индексу
+            with index._lock:
+                if not index.built:
+                    today = get_moscow_time().strftime("%Y-%m-%d")
+                    schedule_rows = [row[1:] for row in self.get_schedule_snapshot().rows()]
+                    booked_rows = self.fetchall('''
+                        SELECT appointment_date, appointment_time FROM appointments
+                        WHERE starts_at >= ?
+                    ''', (local_epoch_minutes(today),))
+                    index.build(schedule_rows, booked_rows, today)
+                    logger.info(f"✅ Индекс свободных слотов построен: {len(booked_rows)} занятых слотов с {today}")
+        return index
+
     def generate_time_slots(self, start_time, end_time):
         """Генерирует временные слоты"""
         slots = []
@@ -1053,213 +2675,229 @@ class Database:
 
     def set_work_schedule(self, weekday, start_time, end_time, is_working=True):
         """Устанавливает график работы"""
-        cursor = self.execute_with_retry('''
-            INSERT INTO work_schedule (weekday, start_time, end_time, is_working)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(weekday) DO UPDATE SET
-            start_time = excluded.start_time,
-            end_time = excluded.end_time,
-            is_working = excluded.is_working
-        ''', (weekday, start_time, end_time, is_working))
-        
-        self.conn.commit()
+        def upsert(conn):
+            conn.execute('''
+                INSERT INTO work_schedule (weekday, start_time, end_time, is_working)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(weekday) DO UPDATE SET
+                start_time = excluded.start_time,
+                end_time = excluded.end_time,
+                is_working = excluded.is_working
+            ''', (weekday, start_time, end_time, is_working))
+            # Новый снимок читается в той же транзакции и подменяется после
+            # COMMIT раньше обновления индекса: индекс, построенный между
+            # ними, уже видит новый график
+            snapshot = WorkScheduleSnapshot(conn.execute(SCHEDULE_SNAPSHOT_QUERY).fetchall())
+
+            def apply():
+                self._set_schedule_snapshot(snapshot)
+                self.availability.set_work_hours(weekday, start_time, end_time, is_working)
+            self.after_commit(apply)
+
+        self.run_write(upsert)
+        
         logger.info(f"✅ Установлен график для дня {weekday}: {start_time}-{end_time}, рабочий: {is_working}")
+        self.mark_dirty(f"изменения графика для дня {weekday}")
+
+    def get_schedule_snapshot(self):
+        """🎯 СНИМОК ГРАФИКА: ЧИТАЕТСЯ ИЗ БД ОДИН РАЗ, ДАЛЬШЕ ИЗ ПАМЯТИ"""
+        snapshot = self._schedule_snapshot
+        if snapshot is None:
+            snapshot = self._reload_schedule_snapshot()
+        return snapshot
+
+    def _reload_schedule_snapshot(self):
+        """Перечитывает work_schedule и подменяет снимок одной операцией присваивания"""
+        # Чтение и подмена под блокировкой: снимок, прочитанный позже,
+        # не может быть затерт более ранним
+        with self._schedule_lock:
+            snapshot = WorkScheduleSnapshot(self.fetchall(SCHEDULE_SNAPSHOT_QUERY))
+            self._schedule_snapshot = snapshot
+        return snapshot
+
+    def _set_schedule_snapshot(self, snapshot):
+        """Подменяет снимок графика, прочитанный в транзакции set_work_schedule"""
+        with self._schedule_lock:
+            self._schedule_snapshot = snapshot
 
     def get_work_schedule(self, weekday=None):
         """Получает график работы"""
-        if weekday is not None:
-            cursor = self.execute_with_retry('''
-                SELECT id, weekday, start_time, end_time, is_working 
-                FROM work_schedule WHERE weekday = ?
-            ''', (weekday,))
-        else:
-            cursor = self.execute_with_retry('''
-                SELECT id, weekday, start_time, end_time, is_working 
-                FROM work_schedule ORDER BY weekday
-            ''')
-        
-        return cursor.fetchall()
+        return self.get_schedule_snapshot().rows(weekday)
 
     def get_week_schedule(self):
         """Получает график на неделю"""
-        schedule = {}
-        for weekday in range(7):
-            result = self.get_work_schedule(weekday)
-            if result and len(result) > 0:
-                schedule[weekday] = result[0]
-            else:
-                schedule[weekday] = (0, weekday, "10:00", "20:00", True)
-        return schedule
+        return self.get_schedule_snapshot().week()
 
     def get_user_appointments(self, user_id):
         """Получает только будущие записи пользователя"""
-        moscow_time = get_moscow_time()
-        current_date = moscow_time.strftime("%Y-%m-%d")
-        current_time = moscow_time.strftime("%H:%M")
-    
-        cursor = self.execute_with_retry('''
-            SELECT id, service, appointment_date, appointment_time 
-            FROM appointments 
-            WHERE user_id = ? AND (
-                appointment_date > ? OR 
-                (appointment_date = ? AND appointment_time >= ?)
-            )
-            ORDER BY appointment_date, appointment_time
-        ''', (user_id, current_date, current_date, current_time))
-    
-        return cursor.fetchall()
+        return self.fetchall(HOT_QUERIES['user_appointments'], (user_id, epoch_minutes(get_moscow_time())))
 
     def get_all_appointments(self):
         """Получает только БУДУЩИЕ записи"""
-        moscow_time = get_moscow_time()
-        current_date = moscow_time.strftime("%Y-%m-%d")
-        current_time = moscow_time.strftime("%H:%M")
-    
-        cursor = self.execute_with_retry('''
-            SELECT id, user_name, user_username, phone, service, appointment_date, appointment_time 
-            FROM appointments 
-            WHERE appointment_date > ? OR 
-                  (appointment_date = ? AND appointment_time >= ?)
-            ORDER BY appointment_date, appointment_time
-        ''', (current_date, current_date, current_time))
-    
-        return cursor.fetchall()
+        return self.fetchall(HOT_QUERIES['future_appointments'], (epoch_minutes(get_moscow_time()),))
+
+    def get_appointments_in_range(self, start_date, end_date, after=None, limit=None):
+        """Будущие записи с start_date до end_date (не включая), по странице за вызов"""
+        since = max(local_epoch_minutes(start_date), epoch_minutes(get_moscow_time()))
+        return self._appointments_page('range_appointments_page', (local_epoch_minutes(end_date),), since, after, limit)
+
+    def get_appointments_by_date(self, date):
+        """Будущие записи на дату - читаются только строки этого дня"""
+        next_date = (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        return self.get_appointments_in_range(date, next_date)[0]
+
+    def get_appointments_by_user(self, user_id, after=None, limit=None):
+        """Будущие записи пользователя в формате get_all_appointments, по странице за вызов"""
+        return self._appointments_page('user_appointments_page', (user_id,), epoch_minutes(get_moscow_time()), after, limit)
+
+    def get_manual_appointments(self, after=None, limit=None):
+        """Будущие записи, внесенные администратором вручную, по странице за вызов"""
+        return self._appointments_page('manual_appointments_page', (), epoch_minutes(get_moscow_time()), after, limit)
+
+    def _appointments_page(self, query_name, params, since, after, limit):
+        """🎯 СТРАНИЦА ЗАПИСЕЙ ПО КЛЮЧУ (starts_at, id) БЕЗ OFFSET
+
+        Возвращает (строки, курсор). Курсор - ключ последней строки, его
+        передают в after за следующей страницей; None - страниц больше нет.
+        Строки - как в get_all_appointments.
+        """
+        key = (since, 0)
+        if after:
+            key = max(tuple(after), key)
+        rows = self.fetchall(HOT_QUERIES[query_name], (*params, *key, -1 if limit is None else limit + 1))
+        cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            cursor = (rows[-1][7], rows[-1][0])
+        return [tuple(row)[:7] for row in rows], cursor
+
+    def count_appointments_by_date(self, start_date, end_date):
+        """🎯 КОЛИЧЕСТВО ЗАПИСЕЙ ПО ДАТАМ ОТ start_date ДО end_date (НЕ ВКЛЮЧАЯ) ОДНИМ ЗАПРОСОМ"""
+        rows = self.fetchall(HOT_QUERIES['appointment_counts_by_date'],
+                             (local_epoch_minutes(start_date), local_epoch_minutes(end_date)))
+        return dict(rows)
 
     def get_today_appointments(self):
         """Получает записи на сегодня"""
         moscow_time = get_moscow_time()
         today = moscow_time.strftime("%Y-%m-%d")
         
-        cursor = self.execute_with_retry('''
-            SELECT user_name, phone, service, appointment_time 
-            FROM appointments 
-            WHERE appointment_date = ?
-            ORDER BY appointment_time
-        ''', (today,))
-        
-        return cursor.fetchall()
+        return self.fetchall(HOT_QUERIES['day_appointments'], (today,))
 
     def cancel_appointment(self, appointment_id, user_id=None):
-        """🎯 ОТМЕНЯЕТ ЗАПИСЬ С BACKUP"""
-        cursor = self.execute_with_retry('''
-            SELECT user_id, user_name, phone, service, appointment_date, appointment_time 
-            FROM appointments WHERE id = ?
-        ''', (appointment_id,))
-        appointment = cursor.fetchone()
-        
-        if not appointment:
-            return None
-        
-        if user_id:
-            cursor = self.execute_with_retry('''
+        """🎯 ОТМЕНЯЕТ ЗАПИСЬ ВМЕСТЕ С ЕЕ НАПОМИНАНИЯМИ, С BACKUP"""
+        def cancel(conn):
+            # 🎯 DELETE ... RETURNING: ПРОВЕРКА ВЛАДЕЛЬЦА, УДАЛЕНИЕ И ДАННЫЕ ЗАПИСИ ЗА ОДИН ЗАПРОС
+            rows = conn.execute('''
                 DELETE FROM appointments 
-                WHERE id = ? AND user_id = ?
-            ''', (appointment_id, user_id))
-        else:
-            cursor = self.execute_with_retry('''
-                DELETE FROM appointments WHERE id = ?
-            ''', (appointment_id,))
-        
-        if cursor.rowcount > 0:
-            user_id, user_name, phone, service, date, time = appointment
-            self.execute_with_retry('''
-                DELETE FROM schedule WHERE date = ? AND time = ?
-            ''', (date, time))
+                WHERE id = ? AND (? IS NULL OR user_id = ?)
+                RETURNING user_id, user_name, phone, service, appointment_date, appointment_time
+            ''', (appointment_id, user_id or None, user_id or None)).fetchall()
             
-            self.conn.commit()
-
+            if not rows:
+                return None
+            conn.execute('DELETE FROM scheduled_reminders WHERE appointment_id = ?', (appointment_id,))
+            self.after_commit(lambda: self.availability.release(rows[0][4], rows[0][5]))
+            return rows[0]
+        
+        appointment = self.run_write(cancel)
+        
+        if appointment:
             # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПРИ ОТМЕНЕ ЗАПИСИ
             if self.backup_enabled:
-                logger.info(f"💾 Автоматический backup после отмены записи #{appointment_id}")
-                self.create_backup()
+                self.mark_dirty(f"отмены записи #{appointment_id}")
 
             return appointment
         return None
 
     def mark_24h_reminder_sent(self, appointment_id):
         """Отмечает 24-часовое напоминание как отправленное"""
-        cursor = self.execute_with_retry('''
+        self.execute_write('''
             UPDATE appointments 
             SET reminder_24h_sent = TRUE 
             WHERE id = ?
         ''', (appointment_id,))
-        self.conn.commit()
 
     def mark_1h_reminder_sent(self, appointment_id):
         """Отмечает 1-часовое напоминание как отправленное"""
-        cursor = self.execute_with_retry('''
+        self.execute_write('''
             UPDATE appointments 
             SET reminder_1h_sent = TRUE 
             WHERE id = ?
         ''', (appointment_id,))
-        self.conn.commit()
+
+    def get_appointment(self, appointment_id):
+        """Данные записи для напоминания: user_name, user_username, phone, service, date, time"""
+        return self.fetchone('''
+            SELECT user_name, user_username, phone, service, appointment_date, appointment_time
+            FROM appointments WHERE id = ?
+        ''', (appointment_id,))
+
+    def save_reminder(self, appointment_id, reminder_type, scheduled_time):
+        """Сохраняет (или переносит) напоминание записи, сбрасывая признак отправки"""
+        self.execute_write('''
+            INSERT INTO scheduled_reminders (appointment_id, reminder_type, scheduled_time)
+            VALUES (?, ?, ?)
+            ON CONFLICT (appointment_id, reminder_type) DO UPDATE SET
+            scheduled_time = excluded.scheduled_time,
+            sent = FALSE
+        ''', (appointment_id, reminder_type, scheduled_time))
+
+    def mark_reminder_sent(self, appointment_id, reminder_type):
+        """Отмечает напоминание reminder_type ('24h' или '1h') как отправленное"""
+        self.execute_write('''
+            UPDATE scheduled_reminders
+            SET sent = TRUE
+            WHERE appointment_id = ? AND reminder_type = ?
+        ''', (appointment_id, reminder_type))
+
+    def get_pending_reminders(self):
+        """Неотправленные будущие напоминания вместе с данными их записей"""
+        return self.fetchall(HOT_QUERIES['pending_reminders'])
+
+    def get_appointments_without_reminders(self, start, end):
+        """Записи с starts_at в [start, end) без неотправленных напоминаний"""
+        return self.fetchall(HOT_QUERIES['appointments_without_reminders'], (start, end))
+
+    def delete_old_sent_reminders(self, before):
+        """Удаляет отправленные напоминания старше before, возвращает их число"""
+        return self.execute_write(HOT_QUERIES['old_sent_reminders'], (before,))
 
     def set_notification_chat(self, admin_id, chat_id):
         """Устанавливает чат для уведомлений"""
-        cursor = self.execute_with_retry('''
+        self.execute_write('''
             INSERT INTO admin_settings (admin_id, notification_chat_id)
             VALUES (?, ?)
             ON CONFLICT(admin_id) DO UPDATE SET
             notification_chat_id = excluded.notification_chat_id
         ''', (admin_id, chat_id))
-        self.conn.commit()
 
     def get_notification_chats(self):
         """Получает все чаты для уведомлений"""
-        cursor = self.execute_with_retry('SELECT DISTINCT notification_chat_id FROM admin_settings')
-        return [row[0] for row in cursor.fetchall() if row[0] is not None]
+        rows = self.fetchall('SELECT DISTINCT notification_chat_id FROM admin_settings')
+        return [row[0] for row in rows if row[0] is not None]
 
     def get_total_users_count(self):
         """Получает общее количество пользователей"""
-        cursor = self.execute_with_retry('SELECT COUNT(*) FROM bot_users')
-        return cursor.fetchone()[0]
+        return self.fetchone('SELECT COUNT(*) FROM bot_users')[0]
 
     def get_active_users_count(self, days=30):
         """Получает количество активных пользователей"""
         cutoff_date = (get_moscow_time() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-        cursor = self.execute_with_retry('''
-            SELECT COUNT(*) FROM bot_users 
-            WHERE last_seen >= ?
-        ''', (cutoff_date,))
-        return cursor.fetchone()[0]
+        return self.fetchone(HOT_QUERIES['active_users_count'], (cutoff_date,))[0]
 
     def cleanup_completed_appointments(self):
-        """Очищает прошедшие записи"""
+        """Переносит прошедшие записи в архив"""
         moscow_time = get_moscow_time()
-        current_date = moscow_time.strftime("%Y-%m-%d")
-        current_time = moscow_time.strftime("%H:%M")
-        
-        cursor = self.execute_with_retry('''
-            DELETE FROM appointments 
-            WHERE appointment_date < ?
-        ''', (current_date,))
-        
-        deleted_past_dates = cursor.rowcount
-        
-        cursor = self.execute_with_retry('''
-            DELETE FROM appointments 
-            WHERE appointment_date = ? 
-            AND appointment_time < ?
-        ''', (current_date, current_time))
+        today_start = local_epoch_minutes(moscow_time.strftime("%Y-%m-%d"))
         
-        deleted_today = cursor.rowcount
-        
-        self.execute_with_retry('''
-            DELETE FROM schedule 
-            WHERE date < ?
-        ''', (current_date,))
-        
-        self.execute_with_retry('''
-            DELETE FROM schedule 
-            WHERE date = ? AND time < ?
-        ''', (current_date, current_time))
-        
-        self.conn.commit()
+        deleted_past_dates = self.archive_appointments(today_start)
+        deleted_today = self.archive_appointments(epoch_minutes(moscow_time))
         
         total_deleted = deleted_past_dates + deleted_today
         
         if total_deleted > 0:
-            logger.info(f"✅ Автоочистка: удалено {total_deleted} прошедших записей")
+            logger.info(f"✅ Автоочистка: {total_deleted} прошедших записей перенесено в архив")
         
         return {
             'deleted_past_dates': deleted_past_dates,
@@ -1267,73 +2905,86 @@ class Database:
             'total_deleted': total_deleted
         }
 
-    def check_duplicate_appointments(self):
-        """Проверяет дублирующиеся записи"""
-        try:
-            cursor = self.execute_with_retry('''
-                SELECT appointment_date, appointment_time, COUNT(*) as count
+    def archive_appointments(self, before, batch_size=config.ARCHIVE_BATCH_SIZE):
+        """🎯 ПЕРЕНОСИТ В АРХИВ ЗАПИСИ С starts_at < before, ВОЗВРАЩАЕТ ИХ ЧИСЛО
+
+        Каждая пачка из batch_size записей - INSERT ... SELECT в архив и
+        DELETE из appointments в одной транзакции потока записи, так что
+        другие записи не ждут весь перенос. При WAL транзакция над двумя
+        файлами атомарна только в каждом из них, поэтому вставка в архив
+        идет через INSERT OR IGNORE и повтор пачки безопасен.
+
+        Файл архива не входит в поколения backup и сегменты журнала:
+        restore_from_backup восстанавливает только основную БД, и при
+        потере файла архива перенесенная история теряется.
+        """
+        archived_at = epoch_minutes(get_moscow_time())
+        
+        def move(conn):
+            batch = conn.execute('''
+                SELECT id, appointment_date, appointment_time FROM appointments 
+                WHERE starts_at < ? 
+                ORDER BY starts_at 
+                LIMIT ?
+            ''', (before, batch_size)).fetchall()
+            ids_json = json.dumps([row[0] for row in batch])
+            conn.execute('''
+                INSERT OR IGNORE INTO archive.appointments_archive 
+                (id, user_id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at, created_at, archived_at)
+                SELECT id, user_id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at, created_at, ?
                 FROM appointments 
-                WHERE appointment_date >= DATE('now')
-                GROUP BY appointment_date, appointment_time
-                HAVING COUNT(*) > 1
-                ORDER BY appointment_date, appointment_time
-            ''')
-            return cursor.fetchall()
-        except Exception as e:
-            logger.error(f"❌ Ошибка при проверке дубликатов: {e}")
-            return []
-    
-    def get_appointments_by_datetime(self, date, time):
-        """Получает все записи на указанные дату и время"""
+                WHERE id IN (SELECT value FROM json_each(?))
+            ''', (archived_at, ids_json))
+            moved = conn.execute('DELETE FROM appointments WHERE id IN (SELECT value FROM json_each(?))', (ids_json,)).rowcount
+            conn.execute('DELETE FROM scheduled_reminders WHERE appointment_id IN (SELECT value FROM json_each(?))', (ids_json,))
+            
+            def release():
+                for row in batch:
+                    self.availability.release(row[1], row[2])
+            self.after_commit(release)
+            return moved
+        
+        total_moved = 0
+        while True:
+            moved = self.run_write(move)
+            total_moved += moved
+            if moved < batch_size:
+                break
+        
+        if total_moved > 0:
+            logger.info(f"🗄 В архив перенесено {total_moved} записей")
+        return total_moved
+
+    def get_archive_stats(self):
+        """Число записей и размер файла архива"""
         try:
-            cursor = self.execute_with_retry('''
-                SELECT id, user_name, phone, service
-                FROM appointments 
-                WHERE appointment_date = ? AND appointment_time = ?
-                ORDER BY id
-            ''', (date, time))
-            return cursor.fetchall()
+            return {
+                'appointments': self.fetchone('SELECT COUNT(*) FROM archive.appointments_archive')[0],
+                'size_kb': 0 if self.in_memory else os.path.getsize(self.archive_path) // 1024
+            }
         except Exception as e:
-            logger.error(f"❌ Ошибка при получении записей: {e}")
-            return []
+            logger.error(f"❌ Ошибка получения статистики архива: {e}")
+            return {'appointments': 0, 'size_kb': 0}
 
     def get_conflicting_appointments(self, weekday, new_start_time, new_end_time, new_is_working):
-        """Находит конфликтующие записи при изменении графика"""
+        """🎯 НАХОДИТ КОНФЛИКТУЮЩИЕ ЗАПИСИ ПРИ ИЗМЕНЕНИИ ГРАФИКА ОДНИМ ИНДЕКСНЫМ ЗАПРОСОМ
+
+        Конфликт - будущая запись на этот день недели вне нового окна
+        [start, end). Для выходного окно пустое (0, 0), и конфликтуют все
+        записи дня. Читаются только конфликтующие строки.
+        """
         try:
-            cursor = self.execute_with_retry('''
-                SELECT id, user_id, user_name, phone, service, appointment_date, appointment_time
-                FROM appointments 
-                WHERE DATE(appointment_date) >= DATE('now')
-                ORDER BY appointment_date, appointment_time
-            ''')
-            
-            all_future_appointments = cursor.fetchall()
-            conflicting_appointments = []
-            
-            for appointment in all_future_appointments:
-                appt_id, user_id, user_name, phone, service, date, time = appointment
-                
-                try:
-                    appointment_date = datetime.strptime(date, "%Y-%m-%d").date()
-                    appointment_weekday = appointment_date.weekday()
-                except ValueError:
-                    continue
-                
-                if appointment_weekday == weekday:
-                    if not new_is_working:
-                        conflicting_appointments.append(appointment)
-                    else:
-                        try:
-                            appointment_time = datetime.strptime(time, "%H:%M").time()
-                            new_start = datetime.strptime(new_start_time, "%H:%M").time()
-                            new_end = datetime.strptime(new_end_time, "%H:%M").time()
-                            
-                            if appointment_time < new_start or appointment_time >= new_end:
-                                conflicting_appointments.append(appointment)
-                        except ValueError:
-                            continue
+            today_start = local_epoch_minutes(get_moscow_time().strftime("%Y-%m-%d"))
+            if new_is_working:
+                start_minute = AvailabilityIndex.minute_of(new_start_time)
+                end_minute = AvailabilityIndex.minute_of(new_end_time)
+            else:
+                start_minute = end_minute = 0
             
-            return conflicting_appointments
+            return self.fetchall(HOT_QUERIES['conflicting_appointments'], (
+                weekday, start_minute, today_start,
+                weekday, end_minute, today_start,
+            ))
             
         except Exception as e:
             logger.error(f"❌ Ошибка при поиске конфликтующих записей: {e}")
@@ -1342,27 +2993,32 @@ class Database:
     def cancel_appointments_by_ids(self, appointment_ids):
         """🎯 МАССОВО ОТМЕНЯЕТ ЗАПИСИ ПО СПИСКУ ID С BACKUP"""
         try:
-            canceled_appointments = []
+            # 🎯 СПИСОК ID ПЕРЕДАЕТСЯ ОДНИМ JSON-ПАРАМЕТРОМ: ДВА ЗАПРОСА НА ЛЮБОЕ ЧИСЛО ЗАПИСЕЙ
+            ids_json = json.dumps([int(appt_id) for appt_id in appointment_ids])
             
-            for appt_id in appointment_ids:
-                cursor = self.execute_with_retry('''
-                    SELECT user_id, user_name, phone, service, appointment_date, appointment_time 
-                    FROM appointments WHERE id = ?
-                ''', (appt_id,))
-                appointment = cursor.fetchone()
+            def cancel(conn):
+                canceled_appointments = conn.execute('''
+                    DELETE FROM appointments 
+                    WHERE id IN (SELECT value FROM json_each(?))
+                    RETURNING user_id, user_name, phone, service, appointment_date, appointment_time
+                ''', (ids_json,)).fetchall()
                 
-                if appointment:
-                    self.execute_with_retry('DELETE FROM appointments WHERE id = ?', (appt_id,))
-                    self.execute_with_retry('DELETE FROM schedule WHERE date = ? AND time = ?', 
-                              (appointment[4], appointment[5]))
-                    canceled_appointments.append(appointment)
+                conn.execute('''
+                    DELETE FROM scheduled_reminders 
+                    WHERE appointment_id IN (SELECT value FROM json_each(?))
+                ''', (ids_json,))
+                
+                def release():
+                    for appointment in canceled_appointments:
+                        self.availability.release(appointment[4], appointment[5])
+                self.after_commit(release)
+                return canceled_appointments
             
-            self.conn.commit()
+            canceled_appointments = self.run_write(cancel)
 
             # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПРИ МАССОВОЙ ОТМЕНЕ ЗАПИСЕЙ
             if self.backup_enabled and canceled_appointments:
-                logger.info(f"💾 Автоматический backup после массовой отмены {len(canceled_appointments)} записей")
-                self.create_backup()
+                self.mark_dirty(f"массовой отмены {len(canceled_appointments)} записей")
             
             return canceled_appointments
             
@@ -1373,25 +3029,20 @@ class Database:
     def add_admin(self, admin_id, username, first_name, last_name, added_by):
         """🎯 ДОБАВЛЯЕТ АДМИНИСТРАТОРА С BACKUP"""
         try:
-            cursor = self.execute_with_retry('''
+            added = self.execute_write('''
                 INSERT INTO bot_admins (admin_id, username, first_name, last_name, added_by)
                 VALUES (?, ?, ?, ?, ?)
                 ON CONFLICT(admin_id) DO NOTHING
-            ''', (admin_id, username, first_name, last_name, added_by))
-            self.conn.commit()
-            
-            added = cursor.rowcount > 0
+            ''', (admin_id, username, first_name, last_name, added_by)) > 0
 
             # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПРИ ДОБАВЛЕНИИ АДМИНИСТРАТОРА
             if self.backup_enabled and added:
-                logger.info(f"💾 Автоматический backup после добавления администратора {admin_id}")
-                self.create_backup()
+                self.mark_dirty(f"добавления администратора {admin_id}")
             
             return added
             
         except Exception as e:
             logger.error(f"❌ Ошибка при добавлении администратора: {e}")
-            self.conn.rollback()
             return False
 
     def remove_admin(self, admin_id):
@@ -1400,32 +3051,26 @@ class Database:
             if hasattr(config, 'PROTECTED_ADMINS') and admin_id in config.PROTECTED_ADMINS:
                 return False
                 
-            cursor = self.execute_with_retry('DELETE FROM bot_admins WHERE admin_id = ?', (admin_id,))
-            self.conn.commit()
-            
-            deleted = cursor.rowcount > 0
+            deleted = self.execute_write('DELETE FROM bot_admins WHERE admin_id = ?', (admin_id,)) > 0
 
             # 🎯 АВТОМАТИЧЕСКИЙ BACKUP ПРИ УДАЛЕНИИ АДМИНИСТРАТОРА
             if self.backup_enabled and deleted:
-                logger.info(f"💾 Автоматический backup после удаления администратора {admin_id}")
-                self.create_backup()
+                self.mark_dirty(f"удаления администратора {admin_id}")
             
             return deleted
             
         except Exception as e:
             logger.error(f"❌ Ошибка при удалении администратора: {e}")
-            self.conn.rollback()
             return False
 
     def get_all_admins(self):
         """Возвращает список всех администраторов"""
         try:
-            cursor = self.execute_with_retry('''
+            return self.fetchall('''
                 SELECT admin_id, username, first_name, last_name, added_at, added_by 
                 FROM bot_admins 
                 ORDER BY added_at DESC
             ''')
-            return cursor.fetchall()
         except Exception as e:
             logger.error(f"❌ Ошибка при получении списка администраторов: {e}")
             return []
@@ -1433,11 +3078,10 @@ class Database:
     def get_admin_info(self, admin_id):
         """Получает информацию об администраторе"""
         try:
-            cursor = self.execute_with_retry('''
+            return self.fetchone('''
                 SELECT admin_id, username, first_name, last_name, added_at, added_by
                 FROM bot_admins WHERE admin_id = ?
             ''', (admin_id,))
-            return cursor.fetchone()
         except Exception as e:
             logger.error(f"❌ Ошибка при получении информации об администраторе: {e}")
             return None
@@ -1448,22 +3092,11 @@ class Database:
             end_date = get_moscow_time().date()
             start_date = end_date - timedelta(days=7)
             
-            cursor = self.execute_with_retry('''
-                SELECT COUNT(*) 
-                FROM appointments 
-                WHERE appointment_date >= ? AND appointment_date < ?
-            ''', (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
-            total_appointments = cursor.fetchone()[0]
+            # Прошедшая неделя почти целиком в архиве - диапазон нужен для обеих таблиц
+            week_range = (local_epoch_minutes(start_date.strftime("%Y-%m-%d")), local_epoch_minutes(end_date.strftime("%Y-%m-%d"))) * 2
+            total_appointments = self.fetchone(HOT_QUERIES['weekly_appointments_count'], week_range)[0]
             
-            cursor = self.execute_with_retry('''
-                SELECT appointment_time, COUNT(*) as count
-                FROM appointments 
-                WHERE appointment_date >= ? AND appointment_date < ?
-                GROUP BY appointment_time 
-                ORDER BY count DESC 
-                LIMIT 1
-            ''', (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
-            peak_time_result = cursor.fetchone()
+            peak_time_result = self.fetchone(HOT_QUERIES['weekly_peak_time'], week_range)
             peak_time = peak_time_result[0] if peak_time_result else "Нет данных"
             peak_time_count = peak_time_result[1] if peak_time_result else 0
             
@@ -1489,7 +3122,47 @@ class Database:
                 'regular_clients': 0
             }
 
+    def close(self):
+        """Останавливает поток записи и закрывает соединение, оставляя манифест чистой остановки"""
+        self.backup_scheduler.stop()
+        self._maintenance_worker.shutdown(wait=True)
+        self._backup_worker.shutdown(wait=True)
+        if self.conn is None or self.in_memory:
+            self._close_connections()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            for anchor in self._memory_anchors:
+                anchor.close()
+            self._memory_anchors = []
+            return
+        
+        try:
+            schema_version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            appointments = self.fetchone('SELECT COUNT(*) FROM appointments')[0]
+            users = self.fetchone('SELECT COUNT(*) FROM bot_users')[0]
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось собрать данные для манифеста: {e}")
+            schema_version = None
+        
+        # Поток записи дописывает очередь, checkpoint переносит WAL в файл БД
+        self._close_connections()
+        try:
+            self.conn.close()
+        except Exception:
+            schema_version = None
+        self.conn = None
+        
+        if schema_version is not None:
+            try:
+                self._write_manifest(schema_version, appointments, users)
+                logger.info("✅ Манифест чистой остановки записан")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать манифест: {e}")
+
     def __del__(self):
         """Закрывает соединение при удалении объекта"""
-        if self.conn:
-            self.conn.close()
\ No newline at end of file
+        try:
+            self.close()
+        except Exception:
+            pass
\ No newline at end of file
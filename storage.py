@@ -0,0 +1,491 @@
+# storage.py
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+import config
+import database
+from database import get_moscow_time, epoch_minutes, local_epoch_minutes
+
+logger = logging.getLogger(__name__)
+
+# Имя общей БД SQLite в памяти для sqlite::memory:
+MEMORY_DB_NAME = 'barbershop'
+
+
+def parse_database_url(url):
+    """🎯 ПРЕОБРАЗУЕТ DATABASE_URL В ПУТЬ ДЛЯ SQLite
+
+    sqlite:////tmp/barbershop.db -> /tmp/barbershop.db (абсолютный путь)
+    sqlite:///barbershop.db      -> barbershop.db (относительный путь)
+    sqlite::memory:              -> URI общей БД в памяти (shared cache)
+    """
+    if url in ('sqlite::memory:', 'sqlite:///:memory:'):
+        return database.memory_uri(MEMORY_DB_NAME)
+    if url.startswith('sqlite:///') and len(url) > len('sqlite:///'):
+        return url[len('sqlite:///'):]
+    raise ValueError(f"Неподдерживаемый DATABASE_URL: {url}")
+
+
+def create_storage(url=None, allow_memory_storage=False, **options):
+    """🎯 СОЗДАЕТ ХРАНИЛИЩЕ ПО DATABASE_URL
+
+    memory:// - MemoryStorage (словари Python, без SQL и диска), только
+    при allow_memory_storage=True: бот работает через AsyncDatabase, которой
+    нужны произвольный SQL и submit_write, а у MemoryStorage их нет.
+    sqlite:... - Database над файлом или общей БД SQLite в памяти;
+    options (backup_dir, backup_enabled, ...) передаются в Database.
+    """
+    url = url or config.DATABASE_URL
+    if url.startswith('memory://'):
+        if not allow_memory_storage:
+            raise ValueError("DATABASE_URL=memory:// поддерживается только бенчмарком; "
+                             "для бота в памяти используйте sqlite::memory:")
+        logger.info("🧪 Хранилище в памяти процесса (memory://)")
+        return MemoryStorage()
+    return database.Database(parse_database_url(url), **options)
+
+
+class MemoryStorage:
+    """🎯 ХРАНИЛИЩЕ НА СЛОВАРЯХ PYTHON С МЕТОДАМИ Database
+
+    Именованные методы возвращают те же кортежи в том же порядке колонок,
+    что и Database, поэтому логику обработчиков можно гонять без SQLite
+    и диска. Произвольный SQL (AsyncDatabase.fetchone/fetchall/execute)
+    не поддерживается, поэтому бот на этом хранилище не запускается -
+    только бенчмарк (create_storage(..., allow_memory_storage=True)).
+    Backup, WAL и миграции - заглушки.
+    """
+
+    def __init__(self):
+        self.database_url = 'memory://'
+        self.db_path = ':memory:'
+        self.in_memory = True
+        self.retry_policy = database.RetryPolicy()
+        self.supervisor = database.ConnectionSupervisor()
+        self.backup_enabled = False
+        self.query_stats = database.QueryStats()
+        self.startup_seconds = 0.0
+        # Обработчики зовут методы из пула потоков AsyncDatabase: и запись, и
+        # чтение словарей - под _lock, иначе обход словаря падает при
+        # одновременной записи ("dictionary changed size during iteration")
+        self._lock = threading.RLock()
+        self._next_id = {'appointments': 1, 'work_schedule': 1}
+        self.appointments = {}
+        self.archive = {}
+        self.users = {}
+        self.admins = {}
+        self.admin_settings = {}
+        self.work_schedule = {}
+        self.reminders = {}
+        self._setup_defaults()
+        logger.info("✅ Хранилище в памяти готово")
+
+    def _new_id(self, table):
+        new_id = self._next_id[table]
+        self._next_id[table] += 1
+        return new_id
+
+    def _now_utc(self):
+        """Аналог CURRENT_TIMESTAMP SQLite"""
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _setup_defaults(self):
+        """График по умолчанию и администраторы из конфигурации"""
+        for weekday in range(7):
+            self.set_work_schedule(weekday, "10:00", "20:00", weekday < 5)
+        self.ensure_config_admins()
+
+    def ensure_config_admins(self):
+        with self._lock:
+            for admin_id in config.ADMIN_IDS:
+                if admin_id not in self.admins:
+                    self.admins[admin_id] = (admin_id, 'system', 'Система', 'Администратор', self._now_utc(), 0)
+                    self.admin_settings.setdefault(admin_id, admin_id)
+
+    # 🎯 СЛУЖЕБНЫЕ МЕТОДЫ: ДЛЯ ХРАНИЛИЩА В ПАМЯТИ - ЗАГЛУШКИ
+
+    def ping(self):
+        return True
+
+    def reconnect(self, probe=False):
+        return None
+
+    def migrate(self):
+        return 0
+
+    def close(self):
+        logger.info("✅ Хранилище в памяти закрыто")
+
+    def check_query_plans(self):
+        return []
+
+    def get_startup_info(self):
+        return {'clean_start': False, 'startup_seconds': self.startup_seconds, 'schema_version': None,
+                'appointments': None, 'users': None, 'closed_at': None}
+
+    def get_query_stats(self, limit=config.QUERY_STATS_TOP, order_by='total_ms'):
+        return self.query_stats.top(limit, order_by)
+
+    def get_retry_stats(self):
+        return self.retry_policy.get_stats()
+
+    def get_health(self):
+        return self.supervisor.get_stats()
+
+    def get_wal_stats(self):
+        return {}
+
+    def create_backup(self):
+        return None
+
+    def create_incremental_backup(self):
+        return None
+
+    def create_scheduled_backup(self):
+        return None
+
+    def restore_from_backup(self, backup_path=None, until=None):
+        return False
+
+    def inspect_backup(self, backup_path=None):
+        return None
+
+    def mark_dirty(self, reason):
+        pass
+
+    def get_backup_status(self):
+        return []
+
+    def get_backup_scheduler_stats(self):
+        return {}
+
+    def get_backup_files_info(self):
+        return []
+
+    def emergency_size_management(self):
+        return 0
+
+    def emergency_cleanup(self):
+        moscow_time = get_moscow_time()
+        return self.archive_appointments(local_epoch_minutes((moscow_time - timedelta(days=7)).strftime("%Y-%m-%d")))
+
+    # 🎯 ЗАПИСИ
+
+    def _future(self, since):
+        """Записи с starts_at >= since в порядке времени; вызывать под _lock"""
+        return sorted((a for a in self.appointments.values() if a['starts_at'] >= since),
+                      key=lambda a: a['starts_at'])
+
+    def add_appointment(self, user_id, user_name, user_username, phone, service, date, time, is_manual=False):
+        with self._lock:
+            if any(a['appointment_date'] == date and a['appointment_time'] == time for a in self.appointments.values()):
+                raise Exception("Это время уже занято другим клиентом")
+            appointment_id = self._new_id('appointments')
+            self.appointments[appointment_id] = {
+                'id': appointment_id, 'user_id': user_id, 'user_name': user_name,
+                'user_username': user_username, 'phone': phone, 'service': service,
+                'appointment_date': date, 'appointment_time': time,
+                'starts_at': local_epoch_minutes(date, time), 'created_at': self._now_utc(),
+                'is_manual': bool(is_manual),
+                'weekday': datetime.strptime(date, "%Y-%m-%d").weekday(),
+                'start_minute': database.AvailabilityIndex.minute_of(time)
+            }
+            return appointment_id
+
+    def get_appointment(self, appointment_id):
+        with self._lock:
+            a = self.appointments.get(appointment_id)
+            if a is None:
+                return None
+            return (a['user_name'], a['user_username'], a['phone'], a['service'], a['appointment_date'], a['appointment_time'])
+
+    def get_available_slots(self, date):
+        with self._lock:
+            booked_times = {a['appointment_time'] for a in self.appointments.values() if a['appointment_date'] == date}
+            weekday = datetime.strptime(date, "%Y-%m-%d").date().weekday()
+            work_hours = self.work_schedule.get(weekday)
+            if not work_hours or not work_hours[4]:
+                return []
+            return [slot for slot in self.generate_time_slots(work_hours[2], work_hours[3]) if slot not in booked_times]
+
+    def generate_time_slots(self, start_time, end_time):
+        return database.Database.generate_time_slots(self, start_time, end_time)
+
+    def get_user_appointments(self, user_id):
+        with self._lock:
+            return [(a['id'], a['service'], a['appointment_date'], a['appointment_time'])
+                    for a in self._future(epoch_minutes(get_moscow_time())) if a['user_id'] == user_id]
+
+    @staticmethod
+    def _appointment_row(a):
+        """Строка записи в формате get_all_appointments"""
+        return (a['id'], a['user_name'], a['user_username'], a['phone'], a['service'], a['appointment_date'], a['appointment_time'])
+
+    def get_all_appointments(self):
+        with self._lock:
+            return [self._appointment_row(a) for a in self._future(epoch_minutes(get_moscow_time()))]
+
+    def get_appointments_in_range(self, start_date, end_date, after=None, limit=None):
+        with self._lock:
+            since = max(local_epoch_minutes(start_date), epoch_minutes(get_moscow_time()))
+            end = local_epoch_minutes(end_date)
+            return self._appointments_page([a for a in self.appointments.values() if a['starts_at'] < end], since, after, limit)
+
+    def get_appointments_by_date(self, date):
+        next_date = (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        return self.get_appointments_in_range(date, next_date)[0]
+
+    def get_appointments_by_user(self, user_id, after=None, limit=None):
+        with self._lock:
+            rows = [a for a in self.appointments.values() if a['user_id'] == user_id]
+            return self._appointments_page(rows, epoch_minutes(get_moscow_time()), after, limit)
+
+    def get_manual_appointments(self, after=None, limit=None):
+        with self._lock:
+            rows = [a for a in self.appointments.values() if a['is_manual']]
+            return self._appointments_page(rows, epoch_minutes(get_moscow_time()), after, limit)
+
+    def _appointments_page(self, rows, since, after, limit):
+        """Как Database._appointments_page: страница по ключу (starts_at, id) и курсор следующей"""
+        key = (since, 0)
+        if after:
+            key = max(tuple(after), key)
+        rows = sorted((a for a in rows if (a['starts_at'], a['id']) > key), key=lambda a: (a['starts_at'], a['id']))
+        cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            cursor = (rows[-1]['starts_at'], rows[-1]['id'])
+        return [self._appointment_row(a) for a in rows], cursor
+
+    def count_appointments_by_date(self, start_date, end_date):
+        with self._lock:
+            counts = {}
+            for a in self.appointments.values():
+                if start_date <= a['appointment_date'] < end_date:
+                    counts[a['appointment_date']] = counts.get(a['appointment_date'], 0) + 1
+            return counts
+
+    def get_today_appointments(self):
+        with self._lock:
+            today = get_moscow_time().strftime("%Y-%m-%d")
+            rows = [a for a in self.appointments.values() if a['appointment_date'] == today]
+            return [(a['user_name'], a['phone'], a['service'], a['appointment_time'])
+                    for a in sorted(rows, key=lambda a: a['appointment_time'])]
+
+    def _delete_appointment(self, appointment_id):
+        a = self.appointments.pop(appointment_id)
+        for key in [key for key in self.reminders if key[0] == appointment_id]:
+            del self.reminders[key]
+        return (a['user_id'], a['user_name'], a['phone'], a['service'], a['appointment_date'], a['appointment_time'])
+
+    def cancel_appointment(self, appointment_id, user_id=None):
+        with self._lock:
+            a = self.appointments.get(appointment_id)
+            if a is None or (user_id and a['user_id'] != user_id):
+                return None
+            return self._delete_appointment(appointment_id)
+
+    def cancel_appointments_by_ids(self, appointment_ids):
+        with self._lock:
+            return [self._delete_appointment(int(appt_id)) for appt_id in appointment_ids
+                    if int(appt_id) in self.appointments]
+
+    def get_conflicting_appointments(self, weekday, new_start_time, new_end_time, new_is_working):
+        with self._lock:
+            today_start = local_epoch_minutes(get_moscow_time().strftime("%Y-%m-%d"))
+            if new_is_working:
+                start_minute = database.AvailabilityIndex.minute_of(new_start_time)
+                end_minute = database.AvailabilityIndex.minute_of(new_end_time)
+            else:
+                start_minute = end_minute = 0
+            conflicting_appointments = []
+            for a in self._future(today_start):
+                if a['weekday'] != weekday:
+                    continue
+                if not start_minute <= a['start_minute'] < end_minute:
+                    conflicting_appointments.append((a['id'], a['user_id'], a['user_name'], a['phone'], a['service'],
+                                                     a['appointment_date'], a['appointment_time']))
+            return conflicting_appointments
+
+    def mark_24h_reminder_sent(self, appointment_id):
+        self.mark_reminder_sent(appointment_id, '24h')
+
+    def mark_1h_reminder_sent(self, appointment_id):
+        self.mark_reminder_sent(appointment_id, '1h')
+
+    # 🎯 АРХИВ И ОЧИСТКА
+
+    def archive_appointments(self, before, batch_size=config.ARCHIVE_BATCH_SIZE):
+        with self._lock:
+            archived_at = epoch_minutes(get_moscow_time())
+            moved = [a for a in self.appointments.values() if a['starts_at'] < before]
+            for a in moved:
+                self._delete_appointment(a['id'])
+                self.archive.setdefault(a['id'], dict(a, archived_at=archived_at))
+            return len(moved)
+
+    def get_archive_stats(self):
+        with self._lock:
+            return {'appointments': len(self.archive), 'size_kb': 0}
+
+    def cleanup_completed_appointments(self):
+        moscow_time = get_moscow_time()
+        deleted_past_dates = self.archive_appointments(local_epoch_minutes(moscow_time.strftime("%Y-%m-%d")))
+        deleted_today = self.archive_appointments(epoch_minutes(moscow_time))
+        return {
+            'deleted_past_dates': deleted_past_dates,
+            'deleted_today': deleted_today,
+            'total_deleted': deleted_past_dates + deleted_today
+        }
+
+    def automatic_cleanup(self):
+        moscow_time = get_moscow_time()
+        cleanup_result = self.cleanup_completed_appointments()
+        deleted_old = self.archive_appointments(local_epoch_minutes((moscow_time - timedelta(days=14)).strftime("%Y-%m-%d")))
+        deleted_reminders = self.delete_old_sent_reminders((moscow_time - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S"))
+        cutoff_users = (moscow_time - timedelta(days=60)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            stale_users = [user_id for user_id, user in self.users.items() if user['last_seen'] < cutoff_users]
+            for user_id in stale_users:
+                del self.users[user_id]
+        return {
+            'total_deleted': cleanup_result['total_deleted'] + deleted_old + deleted_reminders + len(stale_users),
+            'deleted_past_appointments': cleanup_result['total_deleted'],
+            'deleted_old_appointments': deleted_old,
+            'deleted_reminders': deleted_reminders,
+            'deleted_users': len(stale_users)
+        }
+
+    # 🎯 НАПОМИНАНИЯ
+
+    @staticmethod
+    def _local_time_text(scheduled_time):
+        """Время напоминания строкой 'YYYY-MM-DD HH:MM:SS', как его сравнивает SQLite"""
+        if isinstance(scheduled_time, str):
+            return scheduled_time[:19].replace('T', ' ')
+        return scheduled_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def save_reminder(self, appointment_id, reminder_type, scheduled_time):
+        with self._lock:
+            self.reminders[(appointment_id, reminder_type)] = {'scheduled_time': scheduled_time, 'sent': False}
+
+    def mark_reminder_sent(self, appointment_id, reminder_type):
+        with self._lock:
+            reminder = self.reminders.get((appointment_id, reminder_type))
+            if reminder:
+                reminder['sent'] = True
+
+    def get_pending_reminders(self):
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            rows = []
+            for (appointment_id, reminder_type), reminder in list(self.reminders.items()):
+                a = self.appointments.get(appointment_id)
+                scheduled_time = reminder['scheduled_time']
+                if isinstance(scheduled_time, str):
+                    scheduled_time = datetime.fromisoformat(scheduled_time)
+                if scheduled_time.tzinfo is None:
+                    scheduled_time = scheduled_time.replace(tzinfo=timezone.utc)
+                if a is None or reminder['sent'] or scheduled_time <= now:
+                    continue
+                rows.append((appointment_id, reminder_type, reminder['scheduled_time'], a['user_id'],
+                             a['appointment_date'], a['appointment_time'], scheduled_time))
+            return [row[:6] for row in sorted(rows, key=lambda row: row[6])]
+
+    def get_appointments_without_reminders(self, start, end):
+        with self._lock:
+            pending = {appointment_id for (appointment_id, _), reminder in self.reminders.items() if not reminder['sent']}
+            return [(a['id'], a['user_id'], a['appointment_date'], a['appointment_time'])
+                    for a in self._future(start) if a['starts_at'] < end and a['id'] not in pending]
+
+    def delete_old_sent_reminders(self, before):
+        with self._lock:
+            old = [key for key, reminder in self.reminders.items()
+                   if reminder['sent'] and self._local_time_text(reminder['scheduled_time']) < before]
+            for key in old:
+                del self.reminders[key]
+            return len(old)
+
+    # 🎯 ПОЛЬЗОВАТЕЛИ, АДМИНИСТРАТОРЫ, ГРАФИК
+
+    def add_or_update_user(self, user_id, username, first_name, last_name):
+        with self._lock:
+            self.users[user_id] = {'username': username, 'first_name': first_name,
+                                   'last_name': last_name, 'last_seen': self._now_utc()}
+
+    def get_total_users_count(self):
+        with self._lock:
+            return len(self.users)
+
+    def get_active_users_count(self, days=30):
+        with self._lock:
+            cutoff_date = (get_moscow_time() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+            return sum(1 for user in self.users.values() if user['last_seen'] >= cutoff_date)
+
+    def is_admin(self, user_id):
+        with self._lock:
+            return user_id in self.admins
+
+    def add_admin(self, admin_id, username, first_name, last_name, added_by):
+        with self._lock:
+            if admin_id in self.admins:
+                return False
+            self.admins[admin_id] = (admin_id, username, first_name, last_name, self._now_utc(), added_by)
+            return True
+
+    def remove_admin(self, admin_id):
+        with self._lock:
+            if hasattr(config, 'PROTECTED_ADMINS') and admin_id in config.PROTECTED_ADMINS:
+                return False
+            return self.admins.pop(admin_id, None) is not None
+
+    def get_all_admins(self):
+        with self._lock:
+            return sorted(self.admins.values(), key=lambda admin: admin[4], reverse=True)
+
+    def get_admin_info(self, admin_id):
+        with self._lock:
+            return self.admins.get(admin_id)
+
+    def set_notification_chat(self, admin_id, chat_id):
+        with self._lock:
+            self.admin_settings[admin_id] = chat_id
+
+    def get_notification_chats(self):
+        with self._lock:
+            return [chat_id for chat_id in dict.fromkeys(self.admin_settings.values()) if chat_id is not None]
+
+    def set_work_schedule(self, weekday, start_time, end_time, is_working=True):
+        with self._lock:
+            schedule_id = self.work_schedule[weekday][0] if weekday in self.work_schedule else self._new_id('work_schedule')
+            self.work_schedule[weekday] = (schedule_id, weekday, start_time, end_time, is_working)
+
+    def get_schedule_snapshot(self):
+        with self._lock:
+            return database.WorkScheduleSnapshot(self.work_schedule.values())
+
+    def get_work_schedule(self, weekday=None):
+        return self.get_schedule_snapshot().rows(weekday)
+
+    def get_week_schedule(self):
+        return self.get_schedule_snapshot().week()
+
+    def get_weekly_stats(self):
+        with self._lock:
+            end_date = get_moscow_time().date()
+            start_date = end_date - timedelta(days=7)
+            start, end = local_epoch_minutes(start_date.strftime("%Y-%m-%d")), local_epoch_minutes(end_date.strftime("%Y-%m-%d"))
+            counts = {}
+            for a in list(self.appointments.values()) + list(self.archive.values()):
+                if start <= a['starts_at'] < end:
+                    counts[a['appointment_time']] = counts.get(a['appointment_time'], 0) + 1
+            peak_time = max(counts, key=counts.get) if counts else "Нет данных"
+            return {
+                'start_date': start_date.strftime("%d.%m.%Y"),
+                'end_date': (end_date - timedelta(days=1)).strftime("%d.%m.%Y"),
+                'total_appointments': sum(counts.values()),
+                'peak_time': peak_time,
+                'peak_time_count': counts.get(peak_time, 0),
+                'new_clients': 0,
+                'regular_clients': 0
+            }
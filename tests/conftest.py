@@ -0,0 +1,28 @@
+import os
+import sys
+
+# config требует токен и администраторов уже при импорте
+os.environ.setdefault('BOT_TOKEN', 'test-token')
+os.environ.setdefault('ADMIN_IDS', '1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Создает Database во временном каталоге, с backup в нем же; закрывает после теста"""
+    opened = []
+
+    def make(name='barbershop.db', **options):
+        options.setdefault('backup_dir', str(tmp_path / 'backups'))
+        options.setdefault('backup_enabled', False)
+        db = database.Database(str(tmp_path / name), **options)
+        opened.append(db)
+        return db
+
+    yield make
+    for db in opened:
+        db.close()
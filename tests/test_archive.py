@@ -0,0 +1,50 @@
+import sqlite3
+
+import database
+
+
+def test_archive_schema_created_once(make_db, monkeypatch):
+    db = make_db()
+    conn = sqlite3.connect(db.archive_path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == db.ARCHIVE_SCHEMA_VERSION
+    conn.close()
+
+    # Переподключение только делает ATTACH: схема архива больше не проверяется
+    calls = []
+    monkeypatch.setattr(db, '_ensure_archive', lambda: calls.append(1))
+    db.reconnect()
+    assert calls == []
+    assert db.fetchone('SELECT COUNT(*) FROM archive.appointments_archive')[0] == 0
+
+
+def test_warm_start_runs_no_archive_ddl(make_db, monkeypatch):
+    make_db().close()
+
+    statements = []
+    connect = database.connect_sqlite
+
+    def traced_connect(path, **kwargs):
+        conn = connect(path, **kwargs)
+        if path.endswith('barbershop_archive.db'):
+            conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database, 'connect_sqlite', traced_connect)
+    make_db()
+    assert statements == ['PRAGMA user_version']
+
+
+def test_each_database_has_its_own_archive(make_db):
+    first = make_db('first.db')
+    second = make_db('second.db')
+    assert first.archive_path != second.archive_path
+    assert first.archive_path.endswith('first_archive.db')
+
+    date = (database.get_moscow_time().date() - database.timedelta(days=3)).strftime("%Y-%m-%d")
+    first.execute_write('''
+        INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time)
+        VALUES (1, 'Клиент', NULL, '+79000000000', 'Стрижка', ?, '10:00')
+    ''', (date,))
+    assert first.archive_appointments(database.local_epoch_minutes(date, "23:59")) == 1
+    assert first.fetchone('SELECT COUNT(*) FROM archive.appointments_archive')[0] == 1
+    assert second.fetchone('SELECT COUNT(*) FROM archive.appointments_archive')[0] == 0
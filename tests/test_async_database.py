@@ -0,0 +1,28 @@
+import asyncio
+import threading
+
+import async_database
+
+
+def test_execute_submits_write_outside_event_loop(make_db, monkeypatch):
+    db = make_db()
+    submit_threads = []
+    submit_write = db.submit_write
+
+    def traced_submit_write(query, params=()):
+        # submit_write может переподключаться к БД - это не должно идти в event loop
+        submit_threads.append(threading.current_thread())
+        return submit_write(query, params)
+
+    monkeypatch.setattr(db, 'submit_write', traced_submit_write)
+
+    async def main():
+        adb = async_database.AsyncDatabase(db)
+        try:
+            rowcount = await adb.execute("INSERT INTO bot_admins (admin_id, username) VALUES (?, ?)", (42, 'admin'))
+        finally:
+            await adb.close()
+        return rowcount
+
+    assert asyncio.run(main()) == 1
+    assert submit_threads and submit_threads[0] is not threading.main_thread()
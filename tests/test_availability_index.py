@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import timedelta
+
+import database
+
+
+def index_matches_database(db, date):
+    """Свободные слоты из индекса совпадают с посчитанными по таблице appointments"""
+    booked = {row[0] for row in db.fetchall('SELECT appointment_time FROM appointments WHERE appointment_date = ?', (date,))}
+    work_hours = db.get_schedule_snapshot().get(database.datetime.strptime(date, "%Y-%m-%d").weekday())
+    expected = [slot for slot in db.generate_time_slots(work_hours[2], work_hours[3]) if slot not in booked]
+    return db.availability.free_slots(date) == expected
+
+
+def test_cancel_racing_book_keeps_index_in_commit_order(make_db, monkeypatch):
+    db = make_db()
+    day = database.get_moscow_time().date() + timedelta(days=1)
+    date = day.strftime("%Y-%m-%d")
+    db.set_work_schedule(day.weekday(), "10:00", "12:00", True)
+    # Индекс строится до начала гонки, дальше живет только на обновлениях
+    db.get_available_slots(date)
+
+    # Обновление индекса после записи ждет, пока другой поток отменит ту же
+    # запись. Если индекс обновляется вне порядка коммитов, отмена успевает
+    # раньше и освобождение слота затирается его поздней "записью"
+    canceled = threading.Event()
+    book = db.availability.book
+
+    def book_after_cancel(*args):
+        canceled.wait(timeout=1)
+        book(*args)
+
+    monkeypatch.setattr(db.availability, 'book', book_after_cancel)
+    errors = []
+
+    def cancel_when_visible():
+        # Как администратор: id записи берется из БД сразу после ее коммита
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                row = db.fetchone('SELECT id FROM appointments WHERE appointment_date = ?', (date,))
+                if row:
+                    db.cancel_appointment(row[0])
+                    canceled.set()
+                    return
+                time.sleep(0.001)
+        except Exception as e:
+            errors.append(e)
+
+    canceller = threading.Thread(target=cancel_when_visible)
+    canceller.start()
+    db.add_appointment(1, "Клиент", None, "+79000000000", "Стрижка", date, "10:30")
+    canceller.join(timeout=10)
+
+    assert errors == []
+    assert db.fetchone('SELECT COUNT(*) FROM appointments')[0] == 0
+    assert index_matches_database(db, date)
+
+
+def test_index_follows_schedule_and_archive(make_db):
+    db = make_db()
+    day = database.get_moscow_time().date() + timedelta(days=1)
+    date = day.strftime("%Y-%m-%d")
+    db.set_work_schedule(day.weekday(), "10:00", "12:00", True)
+    db.get_available_slots(date)
+
+    db.add_appointment(1, "Клиент", None, "+79000000000", "Стрижка", date, "10:30")
+    db.set_work_schedule(day.weekday(), "10:00", "14:00", True)
+    assert index_matches_database(db, date)
+
+    db.archive_appointments(database.local_epoch_minutes(date, "23:59"))
+    assert index_matches_database(db, date)
+
+
+def test_index_built_right_after_schedule_commit_sees_new_hours(make_db, monkeypatch):
+    db = make_db()
+    day = database.get_moscow_time().date() + timedelta(days=1)
+    date = day.strftime("%Y-%m-%d")
+    db.set_work_schedule(day.weekday(), "10:00", "12:00", True)
+
+    # Индекс еще не построен: обновление графика в нем пропускается, и
+    # сразу после COMMIT индекс строится другим потоком
+    set_work_hours = db.availability.set_work_hours
+
+    def build_after_set_work_hours(*args):
+        set_work_hours(*args)
+        builder = threading.Thread(target=db.get_available_slots, args=(date,))
+        builder.start()
+        builder.join(timeout=10)
+
+    monkeypatch.setattr(db.availability, 'set_work_hours', build_after_set_work_hours)
+    db.set_work_schedule(day.weekday(), "10:00", "14:00", True)
+
+    assert db.get_available_slots(date) == db.generate_time_slots("10:00", "14:00")
+    assert index_matches_database(db, date)
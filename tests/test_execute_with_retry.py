@@ -0,0 +1,23 @@
+import sqlite3
+
+import pytest
+
+
+class BrokenConnection:
+    def cursor(self):
+        raise sqlite3.DatabaseError("database disk image is malformed")
+
+
+def test_database_error_is_recorded_without_reconnect(make_db, monkeypatch):
+    db = make_db()
+    reconnects = []
+    monkeypatch.setattr(db, 'reconnect', lambda: reconnects.append(1))
+
+    with pytest.raises(sqlite3.DatabaseError):
+        db.execute_with_retry(BrokenConnection(), 'SELECT 1', fetch='one')
+
+    # Сам запрос не переподключает БД - это делает следующий запрос через supervisor
+    assert reconnects == []
+    assert db.supervisor.needs_reconnect()
+    db.fetchone('SELECT 1')
+    assert reconnects == [1]
@@ -0,0 +1,55 @@
+import threading
+import time
+from datetime import timedelta
+
+import config
+import database
+
+
+def run_with_timeout(function, timeout=20):
+    """Выполняет function в отдельном потоке; False, если она не завершилась за timeout"""
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def wait_for_maintenance(db, timeout=20):
+    deadline = time.monotonic() + timeout
+    while db.supervisor.get_stats()['maintenance_runs'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return db.supervisor.get_stats()['maintenance_runs']
+
+
+def test_maintenance_does_not_back_up_or_archive(make_db, monkeypatch):
+    # Даже при "критическом" размере обслуживание - только optimize и quick_check
+    monkeypatch.setattr(config, 'DB_EMERGENCY_SIZE_MB', 0)
+    db = make_db(backup_enabled=True)
+    db.supervisor.maintenance_writes = 1
+    backups = []
+    create_backup = db.create_backup
+    monkeypatch.setattr(db, 'create_backup', lambda: backups.append(1) or create_backup())
+
+    past_date = (database.get_moscow_time().date() - timedelta(days=5)).strftime("%Y-%m-%d")
+    db.execute_write('''
+        INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time)
+        VALUES (1, 'Клиент', NULL, '+79000000000', 'Стрижка', ?, '10:00')
+    ''', (past_date,))
+
+    assert wait_for_maintenance(db) >= 1
+    assert db.get_health()['last_quick_check'] == 'ok'
+    assert backups == []
+    assert db.fetchone('SELECT COUNT(*) FROM appointments')[0] == 1
+
+
+def test_backup_and_close_finish_after_maintenance(make_db):
+    db = make_db(backup_enabled=True)
+    db.supervisor.maintenance_writes = 1
+
+    date = (database.get_moscow_time().date() + timedelta(days=1)).strftime("%Y-%m-%d")
+    db.add_appointment(1, "Клиент", None, "+79000000000", "Стрижка", date, "10:00")
+
+    assert wait_for_maintenance(db) >= 1
+    assert run_with_timeout(db.create_backup)
+    assert db.backup_store.latest() is not None
+    assert run_with_timeout(db.close)
@@ -0,0 +1,60 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+import config
+import database
+import storage
+
+
+def test_readers_survive_concurrent_writes():
+    db = storage.MemoryStorage()
+    first_day = database.get_moscow_time().date() + timedelta(days=1)
+    dates = [(first_day + timedelta(days=n)).strftime("%Y-%m-%d") for n in range(20)]
+    for date in dates:
+        db.set_work_schedule(database.datetime.strptime(date, "%Y-%m-%d").weekday(), "10:00", "20:00", True)
+    errors = []
+    stop = threading.Event()
+
+    def write():
+        try:
+            for date in dates:
+                for slot in config.TIME_SLOTS:
+                    appointment_id = db.add_appointment(1, "Клиент", None, "+79000000000", "Стрижка", date, slot)
+                    db.save_reminder(appointment_id, '24h', f"{date} 09:00:00")
+                    db.add_or_update_user(appointment_id, None, "Имя", None)
+            for appointment_id in range(1, len(dates) * len(config.TIME_SLOTS), 2):
+                db.cancel_appointment(appointment_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stop.set()
+
+    def read():
+        try:
+            while not stop.is_set():
+                db.get_all_appointments()
+                db.get_available_slots(dates[0])
+                db.count_appointments_by_date(dates[0], dates[-1])
+                db.get_appointments_in_range(dates[0], dates[-1], limit=10)
+                db.get_appointments_without_reminders(0, 2 ** 40)
+                db.get_pending_reminders()
+                db.get_conflicting_appointments(first_day.weekday(), "12:00", "14:00", True)
+                db.get_active_users_count()
+                db.get_weekly_stats()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert errors == []
+
+
+def test_memory_url_is_rejected_outside_benchmark():
+    with pytest.raises(ValueError):
+        storage.create_storage('memory://')
+    assert isinstance(storage.create_storage('memory://', allow_memory_storage=True), storage.MemoryStorage)
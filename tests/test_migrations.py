@@ -0,0 +1,27 @@
+import sqlite3
+
+
+def table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def test_fresh_database_has_no_duplicates_table(make_db):
+    db = make_db()
+    with db.readers.connection() as conn:
+        assert not table_exists(conn, 'appointments_duplicates')
+
+
+def test_unique_slot_migration_moves_duplicates(make_db):
+    db = make_db()
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE appointments (id INTEGER PRIMARY KEY, appointment_date TEXT, appointment_time TEXT)')
+    conn.execute('CREATE TABLE scheduled_reminders (appointment_id INTEGER)')
+    conn.executemany('INSERT INTO appointments VALUES (?, ?, ?)',
+                     [(1, '2024-01-01', '10:00'), (2, '2024-01-01', '10:00'), (3, '2024-01-01', '10:30')])
+    conn.executemany('INSERT INTO scheduled_reminders VALUES (?)', [(1,), (2,)])
+
+    db._migration_unique_slot(conn.cursor())
+
+    assert [row[0] for row in conn.execute('SELECT id FROM appointments ORDER BY id')] == [1, 3]
+    assert [row[0] for row in conn.execute('SELECT id FROM appointments_duplicates')] == [2]
+    assert [row[0] for row in conn.execute('SELECT appointment_id FROM scheduled_reminders')] == [1]
@@ -0,0 +1,142 @@
+"""Планы всех SQL-запросов Database на БД со 100 тысячами строк в больших таблицах
+
+Запросы собираются из исходника database.py (строковые константы, начинающиеся
+с SELECT/INSERT/UPDATE/DELETE/WITH), поэтому новый запрос проверяется без
+ручного добавления в список. SCAN большой таблицы - ошибка.
+"""
+import ast
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import database
+
+ROWS = 100_000
+
+# Таблицы, которые по устройству бота остаются маленькими (дни недели,
+# администраторы), и служебные таблицы SQLite - их SCAN допустим
+SMALL_TABLES = {'work_schedule', 'bot_admins', 'admin_settings', 'sqlite_master', 'sqlite_sequence'}
+
+# Запросы, которым полный проход нужен по смыслу
+ALLOWED_SCANS = {
+    # Общее число строк для статистики и проверки перед backup
+    'SELECT COUNT(*) FROM appointments',
+    'SELECT COUNT(*) FROM archive.appointments_archive',
+    'SELECT COUNT(*) FROM bot_users',
+    # Однократное заполнение is_manual в миграции 7
+    "UPDATE appointments SET is_manual = 1 WHERE user_username = 'admin_manual'",
+    # Однократный поиск дублей слота в миграции 3 и удаление всех найденных
+    'SELECT 1 FROM appointments GROUP BY appointment_date, appointment_time HAVING COUNT(*) > 1 LIMIT 1',
+    'DELETE FROM appointments WHERE id IN (SELECT id FROM appointments_duplicates)',
+    'DELETE FROM scheduled_reminders WHERE appointment_id IN (SELECT id FROM appointments_duplicates)',
+}
+
+SCAN_RE = re.compile(r'^SCAN (\w+)(?: |$)')
+
+
+def normalize(statement):
+    return ' '.join(statement.split())
+
+
+def collect_statements():
+    """SQL-константы database.py; части f-строк пропускаются - это не целые запросы"""
+    with open(database.__file__, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    in_fstrings = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for part in node.values}
+    statements = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in in_fstrings:
+            # Одиночные слова 'INSERT'/'UPDATE'/'DELETE' - имена операций журнала, не запросы
+            if re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s+\S', node.value, re.IGNORECASE):
+                statements.add(normalize(node.value))
+    return sorted(statements)
+
+
+STATEMENTS = collect_statements()
+
+
+@pytest.fixture(scope='module')
+def seeded_db(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('plans')
+    db = database.Database(str(directory / 'barbershop.db'), backup_dir=str(directory / 'backups'), backup_enabled=False)
+    slots = config.TIME_SLOTS
+    first_day = datetime(2024, 1, 1)
+
+    def seed(conn):
+        appointments = []
+        for n in range(ROWS):
+            date = (first_day + timedelta(days=n // len(slots))).strftime("%Y-%m-%d")
+            appointments.append((1000 + n % 5000, f"Клиент {n}", f"user{n}", "+79000000000", "Стрижка",
+                                 date, slots[n % len(slots)], int(n % 50 == 0)))
+        conn.executemany('''
+            INSERT INTO appointments (user_id, user_name, user_username, phone, service, appointment_date, appointment_time, is_manual)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', appointments)
+        conn.executemany('''
+            INSERT INTO archive.appointments_archive
+            (id, user_id, user_name, user_username, phone, service, appointment_date, appointment_time, starts_at, created_at, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 0)
+        ''', ((ROWS + n, *row[:7], database.local_epoch_minutes(row[5], row[6])) for n, row in enumerate(appointments)))
+        conn.executemany('''
+            INSERT INTO scheduled_reminders (appointment_id, reminder_type, scheduled_time, sent)
+            VALUES (?, '24h', datetime('2024-01-01', ? || ' minutes'), ?)
+        ''', ((n + 1, n, n % 2) for n in range(ROWS)))
+        conn.executemany('''
+            INSERT INTO bot_users (user_id, username, first_name, last_name, last_seen)
+            VALUES (?, ?, 'Имя', 'Фамилия', datetime('2024-01-01', ? || ' minutes'))
+        ''', ((n, f"user{n}", n) for n in range(ROWS)))
+        conn.executemany('''
+            INSERT INTO backup_metadata (backup_type, size_kb, success, backup_path)
+            VALUES ('auto_backup', 100, 1, ?)
+        ''', ((f"/tmp/backup_{n}.db.gz",) for n in range(1000)))
+        # Таблица дублей миграции 3 есть только в БД, где дубли были
+        conn.execute('CREATE TABLE appointments_duplicates AS SELECT * FROM appointments LIMIT 10')
+        # Статистика, которую в работе собирает PRAGMA optimize
+        conn.execute('ANALYZE')
+
+    db.run_write(seed)
+    yield db
+    db.close()
+
+
+def full_scans(db, statement):
+    with db.readers.connection() as conn:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {statement}', (None,) * statement.count('?')).fetchall()
+    tables = []
+    for row in plan:
+        match = SCAN_RE.match(row[3])
+        if not match or match.group(1) in SMALL_TABLES or match.group(1) == 'CONSTANT' or 'VIRTUAL TABLE' in row[3]:
+            continue
+        # Проход по индексу в порядке ORDER BY с LIMIT читает только первые строки
+        if 'USING INDEX' in row[3] and 'ORDER BY' in statement and 'LIMIT' in statement:
+            continue
+        tables.append(row[3])
+    return tables
+
+
+def test_seeded_tables_are_large(seeded_db):
+    assert seeded_db.fetchone('SELECT COUNT(*) FROM appointments')[0] == ROWS
+    assert seeded_db.fetchone('SELECT COUNT(*) FROM changelog')[0] >= ROWS
+
+
+def test_statements_collected():
+    # Защита от поломки сбора: запросы из HOT_QUERIES должны попасть в список
+    assert {normalize(query) for query in database.HOT_QUERIES.values()} <= set(STATEMENTS)
+
+
+@pytest.mark.parametrize('statement', STATEMENTS, ids=lambda statement: statement[:60])
+def test_no_full_table_scan(seeded_db, statement):
+    try:
+        scans = full_scans(seeded_db, statement)
+    except sqlite3.OperationalError as e:
+        pytest.fail(f"запрос не компилируется: {e}")
+    if statement in ALLOWED_SCANS:
+        return
+    assert not scans, f"полное сканирование {scans} в запросе: {statement}"
+
+
+def test_check_query_plans_is_clean(seeded_db):
+    assert seeded_db.check_query_plans() == []